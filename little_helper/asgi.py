@@ -13,4 +13,29 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'little_helper.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+
+async def application(scope, receive, send):
+    """Serve the streaming transcription WebSocket and hand everything else to Django"""
+    if scope['type'] == 'websocket':
+        if scope['path'] == '/ws/transcribe/':
+            from little_helper.streaming import transcribe_stream
+            return await transcribe_stream(scope, receive, send)
+        # Reject unknown WebSocket paths
+        await receive()
+        return await send({'type': 'websocket.close', 'code': 4404})
+    return await django_application(scope, receive, send)
+
+
+from django.conf import settings
+
+# Load the Google SDKs and build the pooled clients before the first request needs them
+if settings.GOOGLE_CLIENTS_PREWARM:
+    from little_helper.views import prewarm_in_background
+    prewarm_in_background()
+
+# Drain rows left in the write-behind queue by a previous run
+if settings.SHEET_WRITE_BEHIND:
+    from little_helper.views import sheet_queue
+    sheet_queue.start()
@@ -0,0 +1,209 @@
+"""
+Async versions of transcribe and upload_to_sheet, for serving through asgi.py.
+
+A request waiting on an upstream no longer holds a worker: the imgbb upload
+uses a non-blocking HTTP client, scheduled with views.scheduler.call_async
+like every imgbb call, and the blocking Google SDK calls run in threads. Each upstream has its own concurrency limit, so a slow service
+cannot take every thread. The image upload runs while the row is parsed,
+validated and the credentials are refreshed.
+
+Django 3.2's csrf_exempt and require_http_methods decorators wrap views in
+sync functions, which would hide that these views are coroutines, so the
+views below set the CSRF exemption and check the method themselves.
+"""
+import asyncio
+import contextvars
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from functools import partial
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import images, timing, views
+from .upstreams import Overloaded, check_response
+
+UPSTREAM_LIMITS = {
+    'speech': settings.ASYNC_SPEECH_CONCURRENCY,
+    'sheets': settings.ASYNC_SHEETS_CONCURRENCY,
+    'imgbb': settings.ASYNC_IMGBB_CONCURRENCY,
+}
+
+# Threads for the blocking Speech and Sheets calls; the default executor of the
+# event loop can have fewer threads than the limits above allow calls
+upstream_executor = ThreadPoolExecutor(
+    max_workers=UPSTREAM_LIMITS['speech'] + UPSTREAM_LIMITS['sheets'], thread_name_prefix='async-upstream'
+)
+
+# Semaphores and HTTP clients belong to an event loop, so keep one set per loop
+_semaphores = weakref.WeakKeyDictionary()
+_http_clients = weakref.WeakKeyDictionary()
+
+
+@asynccontextmanager
+async def upstream_slot(upstream):
+    """Wait for a free slot in the concurrency limit of an upstream"""
+    loop = asyncio.get_running_loop()
+    semaphores = _semaphores.setdefault(loop, {})
+    if upstream not in semaphores:
+        semaphores[upstream] = asyncio.Semaphore(UPSTREAM_LIMITS[upstream])
+    with timing.stage(f'{upstream}_wait'):
+        await semaphores[upstream].acquire()
+    try:
+        yield
+    finally:
+        semaphores[upstream].release()
+
+
+async def run_upstream(upstream, func, *args):
+    """Run a blocking upstream call in a thread, within the upstream's concurrency limit"""
+    async with upstream_slot(upstream):
+        context = contextvars.copy_context()
+        return await asyncio.get_running_loop().run_in_executor(upstream_executor, partial(context.run, func, *args))
+
+
+def http_client():
+    loop = asyncio.get_running_loop()
+    client = _http_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            timeout=settings.ASYNC_HTTP_TIMEOUT,
+            limits=httpx.Limits(max_connections=UPSTREAM_LIMITS['imgbb'])
+        )
+        _http_clients[loop] = client
+    return client
+
+
+async def upload_image_async(image_file):
+    """Async version of views.upload_image; the hashing and image processing run in threads"""
+    image = images.PreparedImage(image_file)
+    with timing.stage('image_lookup'):
+        cached = await sync_to_async(images.lookup)(image)
+    if cached is None:
+        with timing.stage('image_process'):
+            await sync_to_async(images.process, thread_sensitive=False)(image)
+        with image.step('upload'):
+            body = views.imgbb_body(image.upload_file())
+
+            async def post():
+                # The body rewinds the file when it is sent again
+                return check_response(await http_client().post(
+                    views.IMGBB_UPLOAD_URL, content=body.async_chunks(), headers=body.headers()
+                ))
+            async with upstream_slot('imgbb'):
+                response = await views.scheduler.call_async('imgbb', post, stage='imgbb')
+        with timing.stage('image_save'):
+            await sync_to_async(images.remember)(image, views.image_url(response))
+    return views.image_formula(image.url), image.report()
+
+
+async def transcribe_async(request):
+    """Async version of views.transcribe"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        error_response = views.audio_upload_error(request)
+        if error_response:
+            return error_response
+
+        transcript = await run_upstream('speech', views.recognize_upload, request.FILES['audio'])
+
+        if not transcript:
+            return JsonResponse({
+                'success': False,
+                'error': 'Could not transcribe audio'
+            })
+
+        return JsonResponse({
+            'success': True,
+            'transcript': transcript
+        })
+
+    except Overloaded as e:
+        return views.overloaded_response(e)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+
+async def upload_to_sheet_async(request):
+    """Async version of views.upload_to_sheet"""
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    image_upload = None
+    try:
+        text, current_state, do_upload, steps, image_file = views.read_upload_request(request)
+
+        if not text:
+            return JsonResponse({
+                'success': False,
+                'error': 'Missing text'
+            })
+
+        # Check if it's a revert command
+        try:
+            revert_steps_count = views.revert_command_steps(text, steps)
+        except ValueError as e:
+            return views.revert_steps_error(e)
+        if revert_steps_count:
+            return await run_upstream('sheets', views.revert_last_entry, revert_steps_count)
+
+        # Start the image upload first so it runs while the row is prepared
+        if do_upload and image_file:
+            image_upload = asyncio.ensure_future(upload_image_async(image_file))
+
+        merged = views.merge_fields(text, current_state)
+
+        if not do_upload:
+            # Just return the merged result for preview
+            return JsonResponse({
+                'success': True,
+                **merged
+            })
+
+        error_response = views.merged_error_response(merged)
+        if error_response:
+            return error_response
+
+        if not settings.SHEET_WRITE_BEHIND:
+            if views.credentials_missing():
+                return views.credentials_missing_response()
+            await sync_to_async(views.client_pool.refresh_credentials, thread_sensitive=False)()
+
+        picture_url, image = await image_upload if image_upload else ('', None)
+        row = (merged['storage'], merged['shelf'], merged['keywords'], picture_url)
+
+        # In write-behind mode the row is queued and appended later in a batch
+        if settings.SHEET_WRITE_BEHIND:
+            queued_row = await sync_to_async(views.sheet_queue.enqueue)(*row)
+            await sync_to_async(views.draft_store.clear)(request)
+            return views.stored_row_response(merged, picture_url, queued_row=queued_row, image=image)
+
+        try:
+            updates = await run_upstream('sheets', views.append_rows, [list(row)])
+        except Overloaded:
+            queued_row = await sync_to_async(views.sheet_queue.enqueue)(*row)
+            await sync_to_async(views.draft_store.clear)(request)
+            return views.stored_row_response(merged, picture_url, queued_row=queued_row, image=image)
+        await sync_to_async(views.draft_store.clear)(request)
+        return views.stored_row_response(merged, picture_url, updates, image=image)
+
+    except Overloaded as e:
+        return views.overloaded_response(e)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+    finally:
+        if image_upload and not image_upload.done():
+            image_upload.cancel()
+
+
+transcribe_async.csrf_exempt = True
+upload_to_sheet_async.csrf_exempt = True
@@ -0,0 +1,213 @@
+"""
+Silence trimming and resampling of uncompressed (LINEAR16 WAV) uploads.
+
+Speech-to-Text bills and spends time on every second it is sent, including
+the silence before the first word, after the last one and in long pauses.
+Browsers record WebM/Opus, which is passed through as it is, but uploads of
+16-bit PCM WAV files (clip recorders, other clients) are:
+
+    1. mixed down to mono,
+    2. trimmed: frames more than AUDIO_VAD_RANGE_DB below the loudest frame
+       (or below AUDIO_VAD_FLOOR_DB) are silence; leading and trailing
+       silence is cut to AUDIO_TRIM_PADDING seconds and pauses between
+       words to at most AUDIO_MAX_PAUSE seconds,
+    3. low-pass filtered and resampled to AUDIO_TARGET_SAMPLE_RATE (16 kHz,
+       what the recognizer works with anyway); lower rates are kept,
+
+and sent as raw LINEAR16 with a RecognitionConfig for that sample rate.
+The frame energies, the filter and the interpolation are numpy array
+operations, so a minute of 48 kHz stereo takes well under 100 ms. numpy is
+optional; without it, or for other WAV formats, the upload is sent unchanged.
+
+Usage:
+
+    wav = preprocessor.wav_format(audio_file)
+    if wav is not None:
+        config = recognition_config('LINEAR16', preprocessor.output_rate(wav))
+        processed = preprocessor.process(audio_file)
+        ...recognize processed.audio...
+"""
+import collections
+import logging
+import threading
+import wave
+
+logger = logging.getLogger(__name__)
+
+WavFormat = collections.namedtuple('WavFormat', 'channels sample_width sample_rate frames')
+Processed = collections.namedtuple('Processed', 'audio sample_rate seconds_in seconds_out bytes_in bytes_out')
+
+# Taps of the anti-aliasing filter applied before downsampling
+FILTER_TAPS = 129
+
+
+def import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def wav_format(audio_file):
+    """Format of a 16-bit PCM WAV file read from its header, or None for anything else"""
+    audio_file.seek(0)
+    header = audio_file.read(12)
+    audio_file.seek(0)
+    if header[:4] != b'RIFF' or header[8:12] != b'WAVE':
+        return None
+    try:
+        with wave.open(audio_file) as wav:
+            params = wav.getparams()
+    except (wave.Error, EOFError) as e:
+        logger.warning('Could not read WAV header, sending the upload unchanged: %s', e)
+        return None
+    finally:
+        audio_file.seek(0)
+    if params.sampwidth != 2 or not params.framerate:
+        return None
+    return WavFormat(params.nchannels, params.sampwidth, params.framerate, params.nframes)
+
+
+def keep_mask(voiced, padding, max_pause):
+    """
+    Frames to keep: the voiced ones, `padding` frames of silence next to the
+    first and last of them, and at most `max_pause` frames (0 for all) of
+    every pause in between.
+    """
+    np = import_numpy()
+    keep = voiced.copy()
+    if not voiced.any():
+        return keep
+    # Runs of silence as [start, end) frame ranges
+    bounded = np.concatenate(([True], voiced, [True]))
+    changes = np.flatnonzero(bounded[1:] != bounded[:-1])
+    for start, end in zip(changes[0::2], changes[1::2]):
+        if start == 0:
+            keep[max(end - padding, 0):end] = True
+        elif end == len(voiced):
+            keep[start:start + padding] = True
+        elif not max_pause or end - start <= max_pause:
+            keep[start:end] = True
+        else:
+            keep[start:start + max_pause // 2] = True
+            keep[end - (max_pause - max_pause // 2):end] = True
+    return keep
+
+
+def trim_silence(mono, sample_rate, frame_seconds=0.02, range_db=35.0, floor_db=-55.0, padding=0.25, max_pause=1.0):
+    """mono (float samples in [-1, 1]) without its leading, trailing and excess interior silence"""
+    np = import_numpy()
+    frame_length = max(int(sample_rate * frame_seconds), 1)
+    count = len(mono) // frame_length
+    if not count:
+        return mono
+    frames = mono[:count * frame_length].reshape(count, frame_length)
+    level = 10 * np.log10(np.einsum('ij,ij->i', frames, frames) / frame_length + 1e-12)
+    voiced = level > max(level.max() - range_db, floor_db)
+    keep = keep_mask(voiced, round(padding / frame_seconds), round(max_pause / frame_seconds))
+    # Samples after the last whole frame go with it
+    mask = np.concatenate((np.repeat(keep, frame_length), np.full(len(mono) - count * frame_length, keep[-1])))
+    return mono[mask]
+
+
+def resample(mono, sample_rate, target_rate):
+    """mono at min(sample_rate, target_rate), low-pass filtered below the new Nyquist frequency first"""
+    np = import_numpy()
+    if sample_rate <= target_rate or not len(mono):
+        return mono
+    # Windowed-sinc low-pass with its cutoff a little under target_rate / 2
+    cutoff = 0.45 * target_rate / sample_rate
+    taps = np.arange(FILTER_TAPS) - (FILTER_TAPS - 1) / 2
+    kernel = np.sinc(2 * cutoff * taps) * np.blackman(FILTER_TAPS)
+    # 'full' and sliced, since 'same' returns the longer of the two for clips shorter than the filter
+    offset = (FILTER_TAPS - 1) // 2
+    filtered = np.convolve(mono, (kernel / kernel.sum()).astype(mono.dtype), mode='full')[offset:offset + len(mono)]
+    if sample_rate % target_rate == 0:
+        return filtered[::sample_rate // target_rate]
+    positions = np.arange(int(len(mono) * target_rate / sample_rate)) * (sample_rate / target_rate)
+    return np.interp(positions, np.arange(len(mono)), filtered)
+
+
+class AudioPreprocessor:
+    """Trims and resamples WAV uploads and counts the seconds and bytes that were not sent"""
+
+    def __init__(self, enabled=False, target_rate=16000, frame_seconds=0.02, range_db=35.0,
+                 floor_db=-55.0, padding=0.25, max_pause=1.0):
+        self.enabled = enabled
+        self.target_rate = target_rate
+        self.frame_seconds = frame_seconds
+        self.range_db = range_db
+        self.floor_db = floor_db
+        self.padding = padding
+        self.max_pause = max_pause
+        self.lock = threading.Lock()
+        self._warned = False
+        self._stats = {
+            'processed': 0, 'skipped': 0, 'silent': 0,
+            'seconds_in': 0.0, 'seconds_out': 0.0, 'bytes_in': 0, 'bytes_out': 0,
+        }
+
+    def wav_format(self, audio_file):
+        """Format of an upload that will be preprocessed, or None if it is sent unchanged"""
+        if not self.enabled:
+            return None
+        wav = wav_format(audio_file)
+        if wav is None:
+            return None
+        if import_numpy() is None:
+            if not self._warned:
+                logger.warning('numpy is not installed, sending WAV uploads unprocessed')
+                self._warned = True
+            with self.lock:
+                self._stats['skipped'] += 1
+            return None
+        return wav
+
+    def output_rate(self, wav):
+        return min(wav.sample_rate, self.target_rate)
+
+    def process(self, audio_file):
+        """Processed LINEAR16 mono audio of a WAV upload that wav_format() accepted"""
+        np = import_numpy()
+        audio_file.seek(0)
+        with wave.open(audio_file) as wav:
+            channels, sample_rate = wav.getnchannels(), wav.getframerate()
+            frames = wav.readframes(wav.getnframes())
+        samples = np.frombuffer(frames, dtype='<i2')
+        samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+        # Summed channel by channel, which is several times faster than mean(axis=1) over the interleaved frames
+        mono = np.zeros(len(samples), dtype=np.float32)
+        for channel in range(channels):
+            mono += samples[:, channel]
+        mono *= 1 / (32768.0 * channels)
+
+        trimmed = trim_silence(
+            mono, sample_rate, self.frame_seconds, self.range_db, self.floor_db, self.padding, self.max_pause
+        )
+        output = resample(trimmed, sample_rate, self.target_rate)
+        audio = np.clip(np.round(output * 32768.0), -32768, 32767).astype('<i2').tobytes()
+
+        processed = Processed(
+            audio=audio,
+            sample_rate=min(sample_rate, self.target_rate),
+            seconds_in=len(mono) / sample_rate,
+            seconds_out=len(trimmed) / sample_rate,
+            bytes_in=audio_file.size,
+            bytes_out=len(audio),
+        )
+        with self.lock:
+            self._stats['processed'] += 1
+            self._stats['silent'] += not audio
+            self._stats['seconds_in'] += processed.seconds_in
+            self._stats['seconds_out'] += processed.seconds_out
+            self._stats['bytes_in'] += processed.bytes_in
+            self._stats['bytes_out'] += processed.bytes_out
+        return processed
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self._stats)
+        stats['seconds_removed'] = round(stats['seconds_in'] - stats['seconds_out'], 3)
+        stats['bytes_removed'] = stats['bytes_in'] - stats['bytes_out']
+        return stats
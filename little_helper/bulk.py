@@ -0,0 +1,188 @@
+"""
+Bulk ingestion of inventory rows, e.g. when a whole storage room is
+catalogued at once.
+
+Entries come from a list of transcripts or from a file:
+
+    CSV    with a header naming either a "text" (or "transcript") column or
+           "storage", "shelf", "keywords" and optionally "picture" columns.
+           Without a header, one column is a transcript and three or more
+           are storage, shelf, keywords[, picture].
+    JSONL  one entry per line: a JSON string (a transcript) or an object with
+           "text" or with the field names above.
+    text   one transcript per line.
+
+Transcripts go through parse_voice_input and field rows through the same
+validation, and every invalid entry is reported with its line number. The
+valid rows are appended in as few Sheets calls as the chunk limits allow.
+"""
+import csv
+import io
+import json
+
+from django.conf import settings
+
+from . import parser, timing
+
+FIELDS = ('storage', 'shelf', 'keywords')
+TEXT_COLUMNS = ('text', 'transcript')
+FORMATS = ('csv', 'jsonl', 'text')
+
+
+class BulkInputError(ValueError):
+    pass
+
+
+def format_from_name(name):
+    """File format from a file name, defaulting to CSV"""
+    name = (name or '').lower()
+    if name.endswith(('.jsonl', '.ndjson')):
+        return 'jsonl'
+    if name.endswith('.txt'):
+        return 'text'
+    return 'csv'
+
+
+def entries_from_transcripts(transcripts):
+    """(line, entry) pairs for a list of transcripts or entry objects"""
+    if not isinstance(transcripts, list):
+        raise BulkInputError('Expected a list of transcripts')
+    return [(line, entry if isinstance(entry, dict) else {'text': entry}) for line, entry in enumerate(transcripts, 1)]
+
+
+def entries_from_file(file, file_format='csv'):
+    """(line, entry) pairs from a binary CSV, JSONL or text file"""
+    if file_format not in FORMATS:
+        raise BulkInputError(f'Unknown format {file_format!r}, expected one of {", ".join(FORMATS)}')
+    text = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    try:
+        if file_format == 'csv':
+            return list(csv_entries(text))
+        if file_format == 'jsonl':
+            return list(jsonl_entries(text))
+        return [(line, {'text': value.strip()}) for line, value in enumerate(text, 1) if value.strip()]
+    except UnicodeDecodeError:
+        raise BulkInputError('The file is not UTF-8 text')
+    finally:
+        # Leave the underlying file open for its owner
+        text.detach()
+
+
+def csv_entries(text):
+    reader = csv.reader(text)
+    header = None
+    for row in reader:
+        if not any(cell.strip() for cell in row):
+            continue
+        if header is None:
+            names = [cell.strip().lower() for cell in row]
+            if any(name in TEXT_COLUMNS or name in FIELDS for name in names):
+                header = names
+                continue
+            header = []
+        if header:
+            entry = {name: value for name, value in zip(header, row)}
+            text_column = next((name for name in TEXT_COLUMNS if name in entry), None)
+            if text_column:
+                entry = {'text': entry[text_column]}
+        elif len(row) >= 3:
+            entry = dict(zip(FIELDS + ('picture',), row))
+        else:
+            entry = {'text': row[0]}
+        yield reader.line_num, entry
+
+
+def jsonl_entries(text):
+    for line, value in enumerate(text, 1):
+        if not value.strip():
+            continue
+        try:
+            entry = json.loads(value)
+        except ValueError as e:
+            entry = {'error': f'Invalid JSON: {e}'}
+        if isinstance(entry, str):
+            entry = {'text': entry}
+        elif not isinstance(entry, dict):
+            entry = {'error': 'Expected a JSON string or object'}
+        yield line, entry
+
+
+def row_from_entry(entry):
+    """(sheet row, None) for a valid entry, or (None, error message)"""
+    if 'error' in entry:
+        return None, entry['error']
+    if 'text' in entry:
+        text = entry['text']
+        if not isinstance(text, str) or not text.strip():
+            return None, 'Missing text'
+        parsed = parser.parse_voice_input(text)
+        if 'error' in parsed:
+            return None, parsed['error']
+        return [parsed['storage'], parsed['shelf'], parsed['keywords'], ''], None
+    storage, shelf, keywords, picture = (str(entry.get(name) or '').strip() for name in FIELDS + ('picture',))
+    error = parser.validation_error(storage, shelf, keywords)
+    if error:
+        return None, error
+    return [storage, shelf, keywords, picture], None
+
+
+def chunks(rows, max_rows, max_bytes):
+    """Split rows into append calls of at most max_rows rows and about max_bytes of JSON"""
+    chunk = []
+    size = 0
+    for row in rows:
+        row_size = len(json.dumps(row)) + 1
+        if chunk and (len(chunk) >= max_rows or size + row_size > max_bytes):
+            yield chunk
+            chunk = []
+            size = 0
+        chunk.append(row)
+        size += row_size
+    if chunk:
+        yield chunk
+
+
+def ingest(entries, append, dry_run=False, chunk_rows=None, chunk_bytes=None, route=None):
+    """
+    Validate (line, entry) pairs and append the valid rows with append(rows),
+    which returns the 'updates' of the Sheets response. With route(row), rows
+    of different shards go in separate chunks. Stops at the first failed
+    append; the rows not appended are counted in 'not_appended'.
+    """
+    chunk_rows = chunk_rows or settings.BULK_CHUNK_ROWS
+    chunk_bytes = chunk_bytes or settings.BULK_CHUNK_BYTES
+    rows = []
+    errors = []
+    with timing.stage('parse'):
+        for line, entry in entries:
+            row, error = row_from_entry(entry)
+            if error:
+                errors.append({'line': line, 'error': error, 'text': entry.get('text')})
+            else:
+                rows.append(row)
+
+    result = {
+        'received': len(entries),
+        'valid': len(rows),
+        'invalid': len(errors),
+        'errors': errors,
+        'appended': 0,
+        'sheets_calls': 0,
+        'updated_ranges': [],
+    }
+    if dry_run:
+        return result
+    groups = {}
+    for row in rows:
+        groups.setdefault(route(row) if route else None, []).append(row)
+    for chunk in (chunk for group in groups.values() for chunk in chunks(group, chunk_rows, chunk_bytes)):
+        try:
+            updates = append(chunk)
+        except Exception as e:
+            result['append_error'] = str(e)
+            break
+        result['sheets_calls'] += 1
+        result['appended'] += len(chunk)
+        result['updated_ranges'].append(updates.get('updatedRange', ''))
+    result['not_appended'] = len(rows) - result['appended']
+    return result
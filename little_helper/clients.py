@@ -0,0 +1,182 @@
+"""
+Process-wide pool of Google API clients.
+
+Building a SpeechClient (gRPC channel, TLS handshake) or a Sheets service
+(discovery document parsing, HTTP connection) is expensive, so each worker
+builds them once and reuses them for every request.
+
+The Speech client is thread-safe and shared by all threads. The Sheets service
+sits on top of httplib2, which is not thread-safe, so every thread gets its own
+service object that is then reused for all requests served by that thread.
+
+The Google SDKs and the service-account credentials are only loaded when the
+first client is built, so importing the views (every manage.py command, every
+new worker) does not pay for them, and a missing credentials file is reported
+by the request that needs it instead of crashing startup.
+"""
+import json
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+from . import timing
+
+logger = logging.getLogger(__name__)
+
+# Refresh the access token this many seconds before it expires
+CREDENTIALS_REFRESH_MARGIN = int(os.getenv('GOOGLE_CREDENTIALS_REFRESH_MARGIN', '300'))
+
+SCOPES = ['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/cloud-platform']
+
+
+def load_credentials(info_json=None, path=None):
+    """Service-account credentials from a JSON string, or else from the file at path"""
+    from google.oauth2.service_account import Credentials
+    if info_json:
+        return Credentials.from_service_account_info(json.loads(info_json), scopes=SCOPES)
+    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = path
+    return Credentials.from_service_account_file(path, scopes=SCOPES)
+
+
+def default_speech_factory(credentials):
+    from google.cloud import speech_v1
+    return speech_v1.SpeechClient(credentials=credentials)
+
+
+_sheets_discovery_doc = None
+
+
+def default_sheets_factory(credentials):
+    # Parse the bundled discovery document once and build every thread's
+    # service from the cached copy
+    global _sheets_discovery_doc
+    from googleapiclient import discovery_cache
+    from googleapiclient.discovery import build_from_document
+    if _sheets_discovery_doc is None:
+        _sheets_discovery_doc = json.loads(discovery_cache.get_static_doc('sheets', 'v4'))
+    return build_from_document(_sheets_discovery_doc, credentials=credentials)
+
+
+def default_refresh_request():
+    from google.auth.transport.requests import Request
+    return Request()
+
+
+class ClientPool:
+    """Builds Google clients once per worker and hands them out to requests.
+
+    The factories are injectable so the pool can be used with local fakes:
+    each one is called with the credentials and must return a client object.
+    Instead of credentials the pool can be given a credentials_loader, which
+    is called once, when the first client is built.
+    """
+
+    def __init__(self, credentials=None, speech_factory=None, sheets_factory=None,
+                 refresh_request=None, refresh_margin=CREDENTIALS_REFRESH_MARGIN, credentials_loader=None):
+        self.credentials = credentials
+        self.credentials_loader = credentials_loader
+        self.speech_factory = speech_factory or default_speech_factory
+        self.sheets_factory = sheets_factory or default_sheets_factory
+        self.refresh_request = refresh_request or default_refresh_request
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self._speech = None
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._refresh_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'speech': {'hits': 0, 'misses': 0},
+            'sheets': {'hits': 0, 'misses': 0},
+            'credential_refreshes': 0,
+        }
+
+    def speech(self):
+        """Return the shared Speech-to-Text client, building it on first use."""
+        self.refresh_credentials()
+        client = self._speech
+        if client is not None:
+            self._count('speech', 'hits')
+            return client
+        with self._lock:
+            if self._speech is None:
+                self._count('speech', 'misses')
+                self._speech = self.speech_factory(self.credentials)
+            else:
+                self._count('speech', 'hits')
+            return self._speech
+
+    def sheets(self):
+        """Return the Sheets service for the calling thread, building it on first use."""
+        self.refresh_credentials()
+        service = getattr(self._local, 'sheets', None)
+        if service is not None:
+            self._count('sheets', 'hits')
+            return service
+        self._count('sheets', 'misses')
+        service = self.sheets_factory(self.credentials)
+        self._local.sheets = service
+        return service
+
+    def refresh_credentials(self, force=False):
+        """Load the credentials on first use, and refresh the access token if it is missing or about to expire."""
+        if self.credentials_loader is not None:
+            self._load_credentials()
+        if self.credentials is None or not hasattr(self.credentials, 'refresh'):
+            return
+        if not force and not self._needs_refresh():
+            return
+        with self._refresh_lock:
+            # Another thread may have refreshed while we were waiting
+            if not force and not self._needs_refresh():
+                return
+            with timing.stage('credentials'):
+                self.credentials.refresh(self.refresh_request())
+            with self._stats_lock:
+                self._stats['credential_refreshes'] += 1
+
+    def _load_credentials(self):
+        with self._refresh_lock:
+            # Another thread may have loaded them while we were waiting
+            if self.credentials_loader is None:
+                return
+            with timing.stage('credentials'):
+                self.credentials = self.credentials_loader()
+            self.credentials_loader = None
+
+    def _needs_refresh(self):
+        expiry = getattr(self.credentials, 'expiry', None)
+        if not getattr(self.credentials, 'token', None) or expiry is None:
+            return True
+        # google-auth stores expiry as a naive UTC datetime
+        return expiry - self.refresh_margin <= datetime.utcnow()
+
+    def warm(self):
+        """Refresh credentials and build the clients for the calling thread."""
+        self.refresh_credentials()
+        self.speech()
+        self.sheets()
+
+    def warm_in_background(self, warm=None):
+        """Warm the pool in a daemon thread so startup is not delayed; warm replaces self.warm."""
+        def run():
+            try:
+                (warm or self.warm)()
+            except Exception:
+                logger.exception('Failed to warm Google client pool')
+
+        thread = threading.Thread(target=run, name='client-pool-warmup', daemon=True)
+        thread.start()
+        return thread
+
+    def stats(self):
+        with self._stats_lock:
+            return {
+                'speech': dict(self._stats['speech']),
+                'sheets': dict(self._stats['sheets']),
+                'credential_refreshes': self._stats['credential_refreshes'],
+            }
+
+    def _count(self, client, field):
+        with self._stats_lock:
+            self._stats[client][field] += 1
@@ -0,0 +1,57 @@
+"""
+The row being dictated, kept on the server for each browser session.
+
+Every voice turn merges the new transcript into the session's draft, so the
+page does not have to send the whole draft back with each clip. Drafts expire
+DRAFT_TTL seconds after their last change and are cleared once the row is
+uploaded. The storage is the same as for the transcript cache: 'local' keeps
+drafts in the worker process, 'django' in a shared Django cache, which is
+needed when several workers serve the same browser.
+"""
+from django.conf import settings
+
+from .transcript_cache import DjangoCacheBackend, LocalBackend
+
+FIELDS = ('storage', 'shelf', 'keywords')
+
+
+def empty_draft():
+    return dict.fromkeys(FIELDS, '')
+
+
+class DraftStore:
+    """Drafts keyed by the Django session, which is created on the first save"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def session_key(self, request, create=False):
+        session = request.session
+        if session.session_key is None and create:
+            session.save()
+            # Have SessionMiddleware send the cookie of the new session
+            session.modified = True
+        return session.session_key
+
+    def get(self, request):
+        key = self.session_key(request)
+        draft = self.backend.get(key) if key else None
+        return draft or empty_draft()
+
+    def save(self, request, draft):
+        self.backend.set(self.session_key(request, create=True), {field: draft.get(field, '') for field in FIELDS})
+
+    def clear(self, request):
+        key = self.session_key(request)
+        if key:
+            self.backend.delete(key)
+
+
+def backend_from_settings():
+    """Backend chosen by settings.DRAFT_BACKEND: 'local' or 'django'"""
+    name = settings.DRAFT_BACKEND
+    if name == 'local':
+        return LocalBackend(max_entries=settings.DRAFT_MAX_ENTRIES, ttl=settings.DRAFT_TTL)
+    if name == 'django':
+        return DjangoCacheBackend(alias=settings.DRAFT_CACHE_ALIAS, ttl=settings.DRAFT_TTL, prefix='draft:')
+    raise ValueError(f'Unknown DRAFT_BACKEND: {name!r}')
@@ -0,0 +1,375 @@
+"""
+In-process stand-ins for the Google services, for local development, tests
+and benchmarks.
+
+The fake Speech client "recognizes" audio by decoding its bytes as UTF-8, so
+posting b'storage attic shelf A1 keywords box' as the audio file yields that
+transcript. The fake Sheets service keeps rows in memory and answers the
+append, get, clear and batchClear calls made by the views, as well as the
+tab list and addSheet calls of the shard router.
+
+Use them through a client pool:
+
+    fake_client_pool(speech_latency=0.2)
+
+which is ClientPool(None, speech_factory=FakeSpeechClient, sheets_factory=FakeSheetsService)
+with the given latencies and quotas.
+
+FakeImgbbServer answers imgbb uploads on a local port; point
+IMGBB_UPLOAD_URL at its url.
+
+The latency of the fake Speech client can be a FakeLatency, which stalls a
+share of the calls, and setting its `failure` to an exception makes every
+call fail with it until it is cleared.
+
+Each fake takes an optional FakeQuota, which answers calls over its budget,
+and a random share of the others, with 429 Too Many Requests the way the
+real service would.
+"""
+import collections
+import http.server
+import json
+import random
+import re
+import threading
+import time
+from functools import partial
+
+from .clients import ClientPool
+from .sheets import quote_tab
+
+
+class FakeQuota:
+    """Admits at most `limit` calls per `window` seconds and throttles a `throttle_rate` share of the rest"""
+
+    def __init__(self, limit=None, window=60.0, throttle_rate=0.0, retry_after=None, seed=None):
+        self.limit = limit
+        self.window = window
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+        self.admitted = collections.deque()
+        self.accepted = 0
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def admit(self):
+        """True if the call is within the quota, False if it should get a 429"""
+        now = time.monotonic()
+        with self.lock:
+            while self.admitted and self.admitted[0] <= now - self.window:
+                self.admitted.popleft()
+            over_limit = self.limit is not None and len(self.admitted) >= self.limit
+            if over_limit or (self.throttle_rate and self.random.random() < self.throttle_rate):
+                self.rejected += 1
+                return False
+            self.admitted.append(now)
+            self.accepted += 1
+            return True
+
+    def sheets_error(self):
+        headers = {'retry-after': str(self.retry_after)} if self.retry_after is not None else {}
+        return http_error(429, 'RESOURCE_EXHAUSTED', **headers)
+
+
+def http_error(status, reason, message='', **headers):
+    """googleapiclient HttpError the way the Sheets API raises it"""
+    from googleapiclient.errors import HttpError
+    from httplib2 import Response
+    body = {'error': {'code': status, 'status': reason, 'message': message}}
+    return HttpError(Response({'status': status, **headers}), json.dumps(body).encode())
+
+
+class FakeLatency:
+    """Latency of `base` seconds, or `stall` seconds for a `stall_rate` share of calls; change them at any time"""
+
+    def __init__(self, base=0.0, stall=0.0, stall_rate=0.0, seed=None):
+        self.base = base
+        self.stall = stall
+        self.stall_rate = stall_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def __call__(self):
+        with self.lock:
+            stalled = self.stall_rate and self.random.random() < self.stall_rate
+        return self.stall if stalled else self.base
+
+
+class FakeSpeechClient:
+    """Speech-to-Text client returning the audio bytes as the transcript"""
+
+    def __init__(self, credentials=None, latency=0.0, quota=None):
+        self.latency = latency
+        self.quota = quota
+        self.failure = None
+        self.calls = 0
+
+    def recognize(self, config=None, audio=None, timeout=None, **kwargs):
+        from google.api_core import exceptions as google_exceptions
+        from google.cloud import speech_v1
+        self.calls += 1
+        if self.quota is not None and not self.quota.admit():
+            raise google_exceptions.TooManyRequests('Quota exceeded (fake)')
+        latency = self.latency() if callable(self.latency) else self.latency
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise google_exceptions.DeadlineExceeded('Deadline exceeded (fake)')
+        if latency:
+            time.sleep(latency)
+        if self.failure is not None:
+            raise self.failure
+        text = audio.content.decode('utf-8', 'ignore').strip()
+        alternative = speech_v1.SpeechRecognitionAlternative(transcript=text, confidence=1.0)
+        return speech_v1.RecognizeResponse(
+            results=[speech_v1.SpeechRecognitionResult(alternatives=[alternative])] if text else []
+        )
+
+    def streaming_recognize(self, config, requests, **kwargs):
+        """Yield an interim result after every chunk and a final one when the stream ends."""
+        from google.cloud import speech_v1
+        self.calls += 1
+        if self.failure is not None:
+            raise self.failure
+        text = ''
+        for request in requests:
+            text += request.audio_content.decode('utf-8', 'ignore')
+            latency = self.latency() if callable(self.latency) else self.latency
+            if latency:
+                time.sleep(latency)
+            if config.interim_results and text.strip():
+                yield speech_v1.StreamingRecognizeResponse(results=[self._result(text.strip(), False)])
+        if text.strip():
+            yield speech_v1.StreamingRecognizeResponse(results=[self._result(text.strip(), True)])
+
+    def _result(self, text, is_final):
+        from google.cloud import speech_v1
+        alternative = speech_v1.SpeechRecognitionAlternative(transcript=text, confidence=1.0)
+        return speech_v1.StreamingRecognitionResult(alternatives=[alternative], is_final=is_final)
+
+
+class FakeSpreadsheet:
+    """Rows of every tab of a fake spreadsheet, shared by all FakeSheetsService objects.
+
+    Tabs are created on first use, unless strict_tabs is set: then a range in
+    a tab that was not added (addSheet, or listed in `tabs`) fails with a 400,
+    as it does in Sheets. As in Sheets, tab names are matched without regard to case.
+    """
+
+    def __init__(self, tabs=(), strict_tabs=False):
+        self.tabs = {tab: [] for tab in tabs}
+        self.strict_tabs = strict_tabs
+        self.lock = threading.Lock()
+        self.calls = []
+
+    def title(self, tab):
+        """Title of the existing tab that `tab` names, or None"""
+        return next((title for title in self.tabs if title.casefold() == tab.casefold()), None)
+
+    def rows(self, tab):
+        title = self.title(tab)
+        if title is None and self.strict_tabs:
+            raise http_error(400, 'INVALID_ARGUMENT', f'Unable to parse range: {tab}')
+        return self.tabs.setdefault(title or tab, [])
+
+
+default_spreadsheet = FakeSpreadsheet()
+
+RANGE_RE = re.compile(r"^(?:'?(?P<tab>.+?)'?!)?[A-Z]+(?P<first>\d+)?(?::[A-Z]+(?P<last>\d+)?)?$")
+
+
+class FakeRequest:
+    def __init__(self, handler, latency=0.0, quota=None):
+        self.handler = handler
+        self.latency = latency
+        self.quota = quota
+
+    def execute(self, **kwargs):
+        if self.quota is not None and not self.quota.admit():
+            raise self.quota.sheets_error()
+        if self.latency:
+            time.sleep(self.latency)
+        return self.handler()
+
+
+class FakeSpreadsheets:
+    """spreadsheets() of the fake service: tab metadata and addSheet"""
+
+    def __init__(self, service):
+        self.service = service
+        self.spreadsheet = service.spreadsheet
+
+    def values(self):
+        return self.service
+
+    def get(self, spreadsheetId, fields=None, **kwargs):
+        def handler():
+            with self.spreadsheet.lock:
+                self.spreadsheet.calls.append(('metadata',))
+                titles = list(self.spreadsheet.tabs)
+            return {'spreadsheetId': spreadsheetId, 'sheets': [{'properties': {'title': title}} for title in titles]}
+        return self.service._request(handler)
+
+    def batchUpdate(self, spreadsheetId, body, **kwargs):
+        def handler():
+            with self.spreadsheet.lock:
+                for request in body['requests']:
+                    title = request['addSheet']['properties']['title']
+                    self.spreadsheet.calls.append(('addSheet', title))
+                    if self.spreadsheet.title(title) is not None:
+                        raise http_error(400, 'INVALID_ARGUMENT', f'A sheet with the name "{title}" already exists.')
+                    self.spreadsheet.tabs[title] = []
+            return {'spreadsheetId': spreadsheetId, 'replies': [{} for request in body['requests']]}
+        return self.service._request(handler)
+
+
+class FakeSheetsService:
+    """Sheets service whose spreadsheets() and spreadsheets().values() calls work on a FakeSpreadsheet"""
+
+    def __init__(self, credentials=None, spreadsheet=None, latency=0.0, quota=None):
+        self.spreadsheet = spreadsheet or default_spreadsheet
+        self.latency = latency
+        self.quota = quota
+
+    def spreadsheets(self):
+        return FakeSpreadsheets(self)
+
+    def append(self, spreadsheetId, range, valueInputOption=None, body=None, **kwargs):
+        def handler():
+            tab, _, _ = self._parse(range)
+            values = body['values']
+            with self.spreadsheet.lock:
+                rows = self.spreadsheet.rows(tab)
+                self.spreadsheet.calls.append(('append', range, len(values)))
+                first = max([number for number, row in enumerate(rows, 1) if any(row)] or [0]) + 1
+                for offset, row in enumerate(values):
+                    while len(rows) < first + offset:
+                        rows.append([])
+                    rows[first + offset - 1] = list(row)
+            last = first + len(values) - 1
+            return {
+                'spreadsheetId': spreadsheetId,
+                'updates': {
+                    'spreadsheetId': spreadsheetId,
+                    'updatedRange': f'{quote_tab(tab)}!A{first}:D{last}',
+                    'updatedRows': len(values),
+                    'updatedCells': sum(len(row) for row in values),
+                }
+            }
+        return self._request(handler)
+
+    def get(self, spreadsheetId, range, **kwargs):
+        def handler():
+            tab, first, last = self._parse(range)
+            with self.spreadsheet.lock:
+                self.spreadsheet.calls.append(('get', range))
+                rows = [list(row) for row in self.spreadsheet.rows(tab)[first - 1:last]]
+            while rows and not any(rows[-1]):
+                rows.pop()
+            return {'range': range, 'values': rows}
+        return self._request(handler)
+
+    def batchGet(self, spreadsheetId, ranges, **kwargs):
+        def handler():
+            value_ranges = []
+            with self.spreadsheet.lock:
+                self.spreadsheet.calls.append(('batchGet', tuple(ranges)))
+                for a1_range in ranges:
+                    tab, first, last = self._parse(a1_range)
+                    rows = [list(row) for row in self.spreadsheet.rows(tab)[first - 1:last]]
+                    while rows and not any(rows[-1]):
+                        rows.pop()
+                    value_ranges.append({'range': a1_range, 'values': rows} if rows else {'range': a1_range})
+            return {'spreadsheetId': spreadsheetId, 'valueRanges': value_ranges}
+        return self._request(handler)
+
+    def clear(self, spreadsheetId, range, **kwargs):
+        return self.batchClear(spreadsheetId, body={'ranges': [range]})
+
+    def batchClear(self, spreadsheetId, body, **kwargs):
+        def handler():
+            with self.spreadsheet.lock:
+                self.spreadsheet.calls.append(('batchClear', tuple(body['ranges'])))
+                for a1_range in body['ranges']:
+                    tab, first, last = self._parse(a1_range)
+                    rows = self.spreadsheet.rows(tab)
+                    for number in range(first, min(last or len(rows), len(rows)) + 1):
+                        rows[number - 1] = []
+            return {'spreadsheetId': spreadsheetId, 'clearedRanges': body['ranges']}
+        return self._request(handler)
+
+    def _request(self, handler):
+        return FakeRequest(handler, self.latency, self.quota)
+
+    def _parse(self, a1_range):
+        match = RANGE_RE.match(a1_range)
+        if not match:
+            raise ValueError(f'Unsupported range: {a1_range!r}')
+        first = int(match.group('first') or 1)
+        last = int(match.group('last')) if match.group('last') else None
+        if match.group('first') and ':' not in a1_range:
+            last = first
+        return match.group('tab') or 'Sheet1', first, last
+
+
+def fake_client_pool(speech_latency=0.0, sheets_latency=0.0, speech_quota=None, sheets_quota=None):
+    """Client pool of fakes that answer after the given latencies (seconds or a FakeLatency), within optional FakeQuotas"""
+    return ClientPool(
+        None,
+        speech_factory=partial(FakeSpeechClient, latency=speech_latency, quota=speech_quota),
+        sheets_factory=partial(FakeSheetsService, latency=sheets_latency, quota=sheets_quota)
+    )
+
+
+class FakeImgbbHandler(http.server.BaseHTTPRequestHandler):
+    """Reads the upload in chunks and answers like imgbb"""
+
+    def do_POST(self):
+        remaining = int(self.headers['Content-Length'])
+        while remaining:
+            remaining -= len(self.rfile.read(min(remaining, 65536)))
+        quota = self.server.quota
+        if quota is not None and not quota.admit():
+            body = b'{"status_code": 429, "error": {"message": "Rate limit reached (fake)"}}'
+            self.send_response(429)
+            if quota.retry_after is not None:
+                self.send_header('Retry-After', str(quota.retry_after))
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        with self.server.lock:
+            self.server.uploads += 1
+            number = self.server.uploads
+        body = json.dumps({'data': {'url': f'http://imgbb.invalid/{number}.png'}}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FakeImgbbServer(http.server.ThreadingHTTPServer):
+    """imgbb stand-in on 127.0.0.1, served from a daemon thread after start()"""
+
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.0, quota=None):
+        super().__init__(('127.0.0.1', port), FakeImgbbHandler)
+        self.latency = latency
+        self.quota = quota
+        self.uploads = 0
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_port}/upload'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
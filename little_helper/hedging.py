@@ -0,0 +1,131 @@
+"""
+Hedged requests against tail latency.
+
+A hedged call starts the request and, if it has not answered by a deadline,
+sends the same request again and returns whichever answers first:
+
+    hedger.call(lambda: client.recognize(config=config, audio=audio))
+
+The deadline is a percentile (SPEECH_HEDGE_PERCENTILE) of the latencies of
+recent calls, so only the slowest few percent are duplicated. Until enough
+latencies are known the deadline is `initial_delay`. Hedges are also capped
+at `max_ratio` of recent calls, so a service that is slow across the board
+does not get twice the traffic. The slower attempt is not cancelled; its
+latency is still recorded when it finishes.
+
+The first attempt runs on a thread of its own, started with the call, so
+concurrent calls never wait for each other and the deadline counts from the
+moment the request is sent. Only the hedges share the `workers` threads.
+
+Only use it for idempotent calls, like a recognize of the same audio.
+"""
+import collections
+import contextvars
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+
+
+class Hedger:
+    """Runs calls with a hedge sent after a percentile deadline"""
+
+    def __init__(self, percentile=95, window=200, min_samples=20, initial_delay=2.0,
+                 min_delay=0.1, max_ratio=0.1, workers=16, enabled=True):
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.initial_delay = initial_delay
+        self.min_delay = min_delay
+        self.max_ratio = max_ratio
+        self.enabled = enabled
+        self.latencies = collections.deque(maxlen=window)
+        self.recent_hedges = collections.deque(maxlen=window)
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='hedge')
+        self.lock = threading.Lock()
+        self._stats = {'calls': 0, 'hedged': 0, 'hedge_won': 0, 'skipped_over_budget': 0}
+
+    def deadline(self):
+        """Seconds to wait for the first attempt before sending a hedge"""
+        with self.lock:
+            if len(self.latencies) < self.min_samples:
+                return self.initial_delay
+            ordered = sorted(self.latencies)
+        index = min(int(len(ordered) * self.percentile / 100), len(ordered) - 1)
+        return max(ordered[index], self.min_delay)
+
+    def call(self, func):
+        if not self.enabled:
+            return func()
+        deadline = self.deadline()
+        self._count('calls')
+        primary = self._start(func)
+        done, _ = wait([primary], timeout=deadline)
+        if done or not self._may_hedge():
+            self._record_hedge(False)
+            return primary.result()
+
+        self._record_hedge(True)
+        hedge = self._submit(func)
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None:
+                    if future is hedge:
+                        self._count('hedge_won')
+                    return future.result()
+                error = error or future.exception()
+        raise error
+
+    def _start(self, func):
+        """Run the first attempt on a new thread, which is running when this returns"""
+        future = Future()
+        future.set_running_or_notify_cancel()
+        context = contextvars.copy_context()
+
+        def run():
+            try:
+                future.set_result(context.run(self._timed, func))
+            except BaseException as e:
+                future.set_exception(e)
+        threading.Thread(target=run, name='hedge-primary', daemon=True).start()
+        return future
+
+    def _submit(self, func):
+        # Each attempt runs in a copy of the caller's context, so its timing
+        # stages are reported with the request
+        context = contextvars.copy_context()
+        return self.executor.submit(context.run, self._timed, func)
+
+    def _timed(self, func):
+        started = time.perf_counter()
+        result = func()
+        with self.lock:
+            self.latencies.append(time.perf_counter() - started)
+        return result
+
+    def _may_hedge(self):
+        with self.lock:
+            hedges = sum(self.recent_hedges)
+            if hedges < self.max_ratio * max(len(self.recent_hedges), 1):
+                return True
+            self._stats['skipped_over_budget'] += 1
+            return False
+
+    def _record_hedge(self, hedged):
+        with self.lock:
+            self.recent_hedges.append(1 if hedged else 0)
+            if hedged:
+                self._stats['hedged'] += 1
+
+    def _count(self, name):
+        with self.lock:
+            self._stats[name] += 1
+
+    def stats(self):
+        deadline = self.deadline()
+        with self.lock:
+            stats = dict(self._stats)
+        stats['hedge_rate'] = stats['hedged'] / stats['calls'] if stats['calls'] else 0.0
+        stats['deadline_seconds'] = deadline
+        return stats
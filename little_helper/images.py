@@ -0,0 +1,157 @@
+"""
+Preparing photos for the picture cell.
+
+The sheet only shows a photo as an =IMAGE() thumbnail, but phone cameras
+produce multi-megabyte files. Before the upload a photo is turned upright
+according to its EXIF orientation, downscaled to IMAGE_MAX_DIMENSION and
+re-encoded as IMAGE_FORMAT without its metadata (which includes the GPS
+position). Photos are identified by the SHA-256 of the original file, so
+uploading the same photo again reuses the stored URL without calling imgbb.
+The original is read from its (possibly spooled) upload file in chunks and
+is never held in memory as a whole.
+
+Usage:
+
+    image = PreparedImage(uploaded_file)
+    if lookup(image) is None:
+        process(image)
+        ...upload image.upload_file()...
+        remember(image, url)
+    image.report()
+"""
+import hashlib
+import io
+import logging
+import time
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .models import UploadedImage
+
+logger = logging.getLogger(__name__)
+
+# Pillow names of the output formats; anything else falls back to JPEG
+OUTPUT_FORMATS = {'WEBP': 'WEBP', 'JPEG': 'JPEG', 'JPG': 'JPEG'}
+
+
+class PreparedImage:
+    """
+    A photo on its way to imgbb, with the time spent in each step.
+    source is an uploaded file or bytes; data holds the processed photo, if any.
+    """
+
+    def __init__(self, source):
+        if isinstance(source, bytes):
+            source = ContentFile(source)
+        self.source = source
+        self.data = None
+        self.original_bytes = source.size
+        self.content_hash = None
+        self.url = None
+        self.cached = False
+        self.format = None
+        self.size = None
+        self.timings = {}
+
+    @contextmanager
+    def step(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = round((time.perf_counter() - start) * 1000, 2)
+
+    def upload_file(self):
+        """File to send to imgbb: the processed photo, or the original if it was not processed"""
+        return self.source if self.data is None else ContentFile(self.data)
+
+    def uploaded_bytes(self):
+        return self.original_bytes if self.data is None else len(self.data)
+
+    def report(self):
+        uploaded_bytes = 0 if self.cached else self.uploaded_bytes()
+        return {
+            'cached': self.cached,
+            'original_bytes': self.original_bytes,
+            'uploaded_bytes': uploaded_bytes,
+            'bytes_saved': self.original_bytes - uploaded_bytes,
+            'format': self.format,
+            'size': self.size,
+            'timings_ms': self.timings,
+        }
+
+
+def lookup(image):
+    """Hash the photo and return the URL it was uploaded to before, if any."""
+    with image.step('hash'):
+        content_hash = hashlib.sha256()
+        for chunk in image.source.chunks(settings.UPLOAD_CHUNK_SIZE):
+            content_hash.update(chunk)
+        image.content_hash = content_hash.hexdigest()
+    with image.step('cache_lookup'):
+        image.url = UploadedImage.objects.filter(content_hash=image.content_hash).values_list('url', flat=True).first()
+    image.cached = image.url is not None
+    return image.url
+
+
+def process(image):
+    """
+    Set image.data to the upright, downscaled and recompressed photo.
+    Files Pillow cannot read are left as they are for imgbb to judge.
+    """
+    if not settings.IMAGE_PROCESSING:
+        return
+    try:
+        from PIL import Image, ImageOps, UnidentifiedImageError
+    except ImportError:
+        logger.warning('Pillow is not installed, uploading images unprocessed')
+        return
+
+    max_dimension = settings.IMAGE_MAX_DIMENSION
+    output_format = OUTPUT_FORMATS.get(settings.IMAGE_FORMAT, 'JPEG')
+    try:
+        with image.step('decode'):
+            image.source.seek(0)
+            picture = Image.open(image.source)
+            # Lets the JPEG decoder skip detail that the resize would throw away
+            picture.draft('RGB', (max_dimension, max_dimension))
+            picture.load()
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as e:
+        logger.warning('Could not decode image, uploading it unprocessed: %s', e)
+        return
+
+    has_exif = bool(picture.getexif())
+    original_size = picture.size
+    with image.step('orient'):
+        picture = ImageOps.exif_transpose(picture)
+    with image.step('resize'):
+        picture.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        if output_format == 'JPEG' or 'A' not in picture.getbands():
+            picture = picture.convert('RGB')
+        elif picture.mode != 'RGBA':
+            picture = picture.convert('RGBA')
+    with image.step('encode'):
+        output = io.BytesIO()
+        # The metadata is dropped by not passing exif= to save()
+        picture.save(output, output_format, quality=settings.IMAGE_QUALITY, optimize=True)
+        data = output.getvalue()
+
+    # A small photo without metadata can come out larger after re-encoding
+    if len(data) >= image.original_bytes and not has_exif and picture.size == original_size:
+        image.size = list(picture.size)
+        return
+    image.data = data
+    image.format = output_format
+    image.size = list(picture.size)
+
+
+def remember(image, url):
+    """Store the URL the photo was uploaded to."""
+    with image.step('cache_store'):
+        UploadedImage.objects.get_or_create(
+            content_hash=image.content_hash,
+            defaults={'url': url, 'original_bytes': image.original_bytes, 'stored_bytes': image.uploaded_bytes()}
+        )
+    image.url = url
@@ -0,0 +1,129 @@
+"""
+index.html served from memory.
+
+The page is read once and kept together with gzip and (if the Brotli
+package is installed) brotli versions compressed at the highest level. The
+file is stat()ed at most every INDEX_RELOAD_INTERVAL seconds and reloaded
+when it changed, so edits show up without a restart.
+
+Each encoding has a strong ETag derived from the page's SHA-256, and
+conditional requests are answered with 304 Not Modified. The CSS and
+JavaScript are inlined, so they are cached with the page: a short max-age
+plus a long stale-while-revalidate lets a returning phone paint the cached
+page at once while it checks for a newer one in the background.
+"""
+import gzip
+import hashlib
+import os
+import re
+import threading
+import time
+
+from django.conf import settings
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ACCEPT_ENCODING_RE = re.compile(r'\s*([^\s;,]+)\s*(?:;\s*q\s*=\s*([0-9.]+))?')
+
+
+class Variant:
+    """The page in one content encoding"""
+
+    def __init__(self, body, etag, encoding=None):
+        self.body = body
+        self.etag = etag
+        self.encoding = encoding
+
+
+class CachedPage:
+    """A static file kept in memory with its compressed variants, reloaded when it changes on disk"""
+
+    def __init__(self, path, reload_interval=1.0):
+        self.path = path
+        self.reload_interval = reload_interval
+        self.variants = {}
+        self.last_modified = None
+        self._signature = None
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def current(self):
+        """Variants by encoding (None for identity) and the modification time, reloading the file if needed"""
+        now = time.monotonic()
+        if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+            with self._lock:
+                if self._checked_at is None or now - self._checked_at >= self.reload_interval:
+                    self._reload_if_changed()
+                    self._checked_at = now
+        return self.variants, self.last_modified
+
+    def _reload_if_changed(self):
+        stat = os.stat(self.path)
+        signature = (stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+        with open(self.path, 'rb') as file:
+            body = file.read()
+        digest = hashlib.sha256(body).hexdigest()[:32]
+        variants = {None: Variant(body, f'"{digest}"')}
+        variants['gzip'] = Variant(gzip.compress(body, compresslevel=9, mtime=0), f'"{digest}-gzip"', 'gzip')
+        if brotli is not None:
+            variants['br'] = Variant(brotli.compress(body, quality=11), f'"{digest}-br"', 'br')
+        # Only keep a compressed variant if it is actually smaller
+        self.variants = {
+            encoding: variant for encoding, variant in variants.items()
+            if encoding is None or len(variant.body) < len(body)
+        }
+        self.last_modified = int(stat.st_mtime)
+        self._signature = signature
+
+
+def accepted_encodings(header):
+    """Content codings the client accepts, from an Accept-Encoding header"""
+    accepted = set()
+    for coding, quality in ACCEPT_ENCODING_RE.findall(header or ''):
+        try:
+            if quality and float(quality) == 0:
+                continue
+        except ValueError:
+            continue
+        accepted.add(coding.lower())
+    return accepted
+
+
+def choose_variant(variants, accept_encoding):
+    accepted = accepted_encodings(accept_encoding)
+    for encoding in ('br', 'gzip'):
+        if encoding in variants and (encoding in accepted or '*' in accepted):
+            return variants[encoding]
+    return variants[None]
+
+
+def page_response(request, page):
+    """The page for this request: the best encoding the client accepts, or 304 if its copy is current"""
+    variants, last_modified = page.current()
+    variant = choose_variant(variants, request.META.get('HTTP_ACCEPT_ENCODING'))
+
+    response = get_conditional_response(request, etag=variant.etag, last_modified=last_modified)
+    if response is None:
+        response = HttpResponse(variant.body, content_type='text/html; charset=utf-8')
+        if variant.encoding:
+            response['Content-Encoding'] = variant.encoding
+        response['Content-Length'] = str(len(variant.body))
+    response['ETag'] = variant.etag
+    response['Last-Modified'] = http_date(last_modified)
+    response['Cache-Control'] = (
+        f'public, max-age={settings.INDEX_CACHE_MAX_AGE}, '
+        f'stale-while-revalidate={settings.INDEX_STALE_WHILE_REVALIDATE}'
+    )
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
+
+
+index_page = CachedPage(settings.INDEX_HTML_PATH, reload_interval=settings.INDEX_RELOAD_INTERVAL)
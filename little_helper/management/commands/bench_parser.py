@@ -0,0 +1,184 @@
+import random
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from little_helper.parser import KEYWORDS_RE, SHELF_FIELD_RE, STORAGE_RE, parse_many, parse_voice_input
+
+# Pieces the random inputs are built from: field words in every case and
+# inflection, look-alikes, shelf codes, punctuation and unusual whitespace
+FUZZ_PIECES = [
+    'storage', 'Storage', 'STORAGE', 'storages', 'xstorage', 'storage_', 'ſtorage',
+    'shelf', 'Shelf', 'SHELF', 'shelfs', 'bookshelf', 'shelf_', 'shelves',
+    'keyword', 'keywords', 'Keywords', 'KEYWORD', 'Keyword', 'keywordsx', 'key', 'word', 'words',
+    'keywordstorage', 'keywordshelf', 'storageshelf', 'shelfstorage',
+    'A1', 'b5', 'C12', 'A', '7', 'AA1', 'a٣', 'attic', 'small house', 'box', 'cables', 'teddy bear',
+    '.', ',', '?', '!', ';', ':', '-', '_', "'",
+    ' ', ' ', ' ', '  ', '\t', '\n', '\r', '\xa0', ' ',
+]
+# Where any of the three field patterns can start. The patterns have no leading
+# \b and their values cannot run over a newline, so a field may fail at one
+# occurrence of its word and match at a later one: every start is scanned.
+FIELD_START_RE = re.compile(r'(storage\s)|(shelf)|(keywords?\s)', re.IGNORECASE)
+FIELD_PATTERNS = (STORAGE_RE, SHELF_FIELD_RE, KEYWORDS_RE)
+STORAGES = ['terrace', 'basement', 'small house', 'house', 'attic', 'barrack', 'garage']
+ITEMS = ['box', 'electronics', 'cables', 'tools', 'toys', 'clothes', 'books', 'shoes', 'bags', 'teddy bear']
+
+
+def regex_parse_voice_input(text, debug=False):
+    """The original three-regex implementation, kept as the reference for the differential check"""
+    storage = None
+    shelf = None
+    keywords = None
+    storage_match = re.search(r'storage\s+(.*?)(?=\b(shelf|keywords?)\b|[.?!,;]|$)', text, re.IGNORECASE)
+    if storage_match:
+        storage = storage_match.group(1).strip(' .,:;\n\t') or None
+    shelf_match = re.search(r'shelf(?:\s+|[.?!,;])?(.*?)(?=\b(storage|keywords?)\b|[.?!,;]|$)', text, re.IGNORECASE)
+    if shelf_match:
+        shelf = shelf_match.group(1).strip(' .,:;\n\t') or None
+    keyword_match = re.search(r'key(?:word|words)\s+(.*?)(?=\b(storage|shelf)\b|[.?!,;]|$)', text, re.IGNORECASE)
+    if keyword_match:
+        keywords = keyword_match.group(1).strip(' .,:;\n\t') or None
+
+    debug_matches = None
+    if debug:
+        debug_matches = {
+            'storage_match': storage_match.group(0) if storage_match else None,
+            'shelf_match': shelf_match.group(0) if shelf_match else None,
+            'keyword_match': keyword_match.group(0) if keyword_match else None,
+            'text': text,
+            'storage': storage,
+            'shelf': shelf,
+            'keywords': keywords
+        }
+
+    missing = []
+    invalid_values = {}
+
+    if not storage:
+        missing.append('storage')
+    if not shelf:
+        missing.append('shelf')
+    elif not re.match(r'^[A-Z]\d+$', shelf.upper()):
+        invalid_values['shelf'] = shelf
+    if not keywords:
+        missing.append('keywords')
+
+    if missing or invalid_values:
+        error_parts = []
+        if missing:
+            error_parts.append(f'Missing values for: {", ".join(missing)}.')
+        if invalid_values:
+            for field, value in invalid_values.items():
+                if field == 'shelf':
+                    error_parts.append(f'Invalid shelf format: "{value}". Shelf must be like A1, B5 (letter followed by number).')
+        resp = {
+            'error': ' '.join(error_parts),
+            'parsed_text': text
+        }
+        if debug:
+            resp['debug_matches'] = debug_matches
+        return resp
+
+    resp = {
+        'storage': storage,
+        'shelf': shelf,
+        'keywords': keywords,
+        'parsed_text': text
+    }
+    if debug:
+        resp['debug_matches'] = debug_matches
+    return resp
+
+
+def single_scan_matches(text):
+    """
+    The storage, shelf and keywords matches from one pass over the text: a
+    combined alternation finds where each field word starts, and the field
+    pattern is tried there. Gives the same matches as the three searches.
+    """
+    found = [None, None, None]
+    missing = len(found)
+    for start in FIELD_START_RE.finditer(text):
+        field = start.lastindex - 1
+        if found[field] is None:
+            match = FIELD_PATTERNS[field].match(text, start.start())
+            if match:
+                found[field] = match
+                missing -= 1
+                if not missing:
+                    break
+    return found
+
+
+def spans(matches):
+    return [match and match.span(0) + match.span(1) for match in matches]
+
+
+class Command(BaseCommand):
+    help = 'Check the compiled parser and a single-scan matcher against the original regex parser and compare their throughput'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--cases', type=int, default=200000, help='Random inputs for the differential check')
+        parser.add_argument('--transcripts', type=int, default=20000, help='Realistic transcripts for the benchmark')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+
+        mismatches = []
+        for _ in range(options['cases']):
+            text = ''.join(rng.choice(FUZZ_PIECES) for _ in range(rng.randint(0, 12)))
+            for debug in (False, True):
+                expected = regex_parse_voice_input(text, debug)
+                actual = parse_voice_input(text, debug)
+                # Compare the key order too, since it shows in the JSON responses
+                if list(actual.items()) != list(expected.items()):
+                    mismatches.append((text, expected, actual))
+            expected_spans = spans(pattern.search(text) for pattern in FIELD_PATTERNS)
+            if spans(single_scan_matches(text)) != expected_spans:
+                mismatches.append((text, expected_spans, spans(single_scan_matches(text))))
+        self.stdout.write(f"Differential check: {options['cases']} random inputs, {len(mismatches)} mismatches")
+        for text, expected, actual in mismatches[:5]:
+            self.stdout.write(f'  {text!r}\n    regex:    {expected}\n    compiled: {actual}')
+        if mismatches:
+            raise CommandError(f'{len(mismatches)} inputs parse differently from the regex parser')
+
+        transcripts = [self.transcript(rng) for _ in range(options['transcripts'])]
+        regex_rate = self.throughput(lambda: [regex_parse_voice_input(text, True) for text in transcripts], len(transcripts))
+        compiled_rate = self.throughput(lambda: [parse_voice_input(text, True) for text in transcripts], len(transcripts))
+        batch_rate = self.throughput(lambda: parse_many(transcripts, True), len(transcripts))
+        # Matching alone, to compare the three searches of the parser with a single scan
+        searches_rate = self.throughput(
+            lambda: [[pattern.search(text) for pattern in FIELD_PATTERNS] for text in transcripts], len(transcripts)
+        )
+        scan_rate = self.throughput(lambda: [single_scan_matches(text) for text in transcripts], len(transcripts))
+        self.stdout.write(f'regex parser:    {regex_rate:,.0f} transcripts/s')
+        self.stdout.write(f'compiled parser: {compiled_rate:,.0f} transcripts/s ({compiled_rate / regex_rate:.2f}x)')
+        self.stdout.write(f'parse_many:      {batch_rate:,.0f} transcripts/s ({batch_rate / regex_rate:.2f}x)')
+        self.stdout.write(f'three searches:  {searches_rate:,.0f} transcripts/s (matching only)')
+        self.stdout.write(f'single scan:     {scan_rate:,.0f} transcripts/s ({scan_rate / searches_rate:.2f}x)')
+
+    def transcript(self, rng):
+        """A transcript like the ones Speech-to-Text returns, sometimes partial or misordered"""
+        parts = [
+            f'storage {rng.choice(STORAGES)}',
+            f'shelf {rng.choice("ABCD")}{rng.randint(0, 9)}',
+            f'keywords {" ".join(rng.sample(ITEMS, rng.randint(1, 3)))}',
+        ]
+        if rng.random() < 0.2:
+            parts = rng.sample(parts, rng.randint(1, 3))
+        elif rng.random() < 0.2:
+            rng.shuffle(parts)
+        separator = rng.choice([' ', ' ', '. ', ', '])
+        return separator.join(parts)
+
+    def throughput(self, run, count, repeat=3):
+        best = None
+        for _ in range(repeat):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return count / best
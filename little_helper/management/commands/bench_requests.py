@@ -0,0 +1,181 @@
+import io
+import json
+import os
+import platform
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.test import Client
+
+from little_helper import fakes, views
+
+TRANSCRIPTS = [
+    'storage attic shelf A1 keywords box',
+    'Storage small house. Shelf B4. Keywords teddy bear, cables',
+    'shelf C2 storage garage keywords drill charger lamp',
+    'storage basement shelf D7 keywords winter clothes shoes bags',
+]
+PARTIAL_TRANSCRIPTS = ['shelf B2', 'keywords extension cord', 'storage terrace']
+CURRENT_STATE = {'storage': 'attic', 'shelf': 'A1', 'keywords': 'box'}
+
+
+def percentile(timings, p):
+    return timings[min(int(len(timings) * p / 100), len(timings) - 1)]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the request hot paths through the test client, with fakes for Speech, Sheets and imgbb'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=1000, help='Timed requests per path')
+        parser.add_argument('--warmup', type=int, default=100)
+        parser.add_argument('--path', action='append', dest='paths', help='Only run this path (repeatable)')
+        parser.add_argument('--baseline', default=str(settings.BASE_DIR / 'bench_baseline.json'))
+        parser.add_argument('--save-baseline', action='store_true', help='Write the results as the new baseline')
+        parser.add_argument(
+            '--threshold', type=float, default=0.25,
+            help='Fail if a path is this fraction slower (ops/s) than the baseline'
+        )
+
+    def handle(self, *args, **options):
+        if not settings.FAKE_GOOGLE_SERVICES:
+            raise CommandError('Run with FAKE_GOOGLE_SERVICES=true; the benchmark must not call Google')
+
+        cases = self.cases()
+        names = options['paths'] or list(cases)
+        unknown = set(names) - set(cases)
+        if unknown:
+            raise CommandError(f"Unknown path(s): {', '.join(sorted(unknown))}. Choose from {', '.join(cases)}")
+
+        server = fakes.FakeImgbbServer().start()
+        upload_url = views.IMGBB_UPLOAD_URL
+        api_key = os.environ.get('IMGBB_API_KEY')
+        views.IMGBB_UPLOAD_URL = server.url
+        os.environ['IMGBB_API_KEY'] = 'bench'
+        results = {}
+        try:
+            # Rows appended by the upload paths are rolled back afterwards
+            with transaction.atomic():
+                for name in names:
+                    results[name] = self.run(name, cases[name], options['iterations'], options['warmup'])
+                transaction.set_rollback(True)
+        finally:
+            server.shutdown()
+            server.server_close()
+            views.IMGBB_UPLOAD_URL = upload_url
+            if api_key is None:
+                os.environ.pop('IMGBB_API_KEY', None)
+            else:
+                os.environ['IMGBB_API_KEY'] = api_key
+
+        baseline = self.load_baseline(options['baseline'])
+        regressions = []
+        self.stdout.write(f"{'path':<20} {'ops/s':>10} {'p50 ms':>9} {'p99 ms':>9}  vs baseline")
+        for name, result in results.items():
+            line = f"{name:<20} {result['ops_per_sec']:>10,.0f} {result['p50_ms']:>9.3f} {result['p99_ms']:>9.3f}"
+            previous = baseline.get(name)
+            if previous:
+                change = result['ops_per_sec'] / previous['ops_per_sec'] - 1
+                line += f'  {change:+.1%} ops/s, p99 {previous["p99_ms"]:.3f} -> {result["p99_ms"]:.3f} ms'
+                if change < -options['threshold']:
+                    regressions.append(f'{name} is {-change:.1%} slower')
+            self.stdout.write(line)
+
+        if options['save_baseline']:
+            self.save_baseline(options['baseline'], results, options['iterations'])
+            self.stdout.write(f"Saved the baseline to {options['baseline']}")
+        elif regressions:
+            raise CommandError(
+                f"Slower than the baseline by more than {options['threshold']:.0%}: {'; '.join(regressions)}"
+            )
+
+    def cases(self):
+        """Functions making the i-th request of each path and returning its decoded JSON response"""
+        client = Client()
+        png = self.png()
+
+        def upload(data, **kwargs):
+            return client.post('/upload-to-sheet/', data, **kwargs).json()
+
+        def upload_json(payload):
+            return upload(json.dumps(payload), content_type='application/json')
+
+        return {
+            'parse_voice_input': lambda i: {'success': 'error' not in views.parse_voice_input(TRANSCRIPTS[i % len(TRANSCRIPTS)])},
+            'preview_json': lambda i: upload_json({
+                'text': PARTIAL_TRANSCRIPTS[i % len(PARTIAL_TRANSCRIPTS)],
+                'current_state': CURRENT_STATE,
+                'do_upload': False,
+            }),
+            'preview_multipart': lambda i: upload({
+                'text': PARTIAL_TRANSCRIPTS[i % len(PARTIAL_TRANSCRIPTS)],
+                'current_state': json.dumps(CURRENT_STATE),
+                'do_upload': 'false',
+            }),
+            'upload_json': lambda i: upload_json({
+                'text': TRANSCRIPTS[i % len(TRANSCRIPTS)],
+                'current_state': {},
+            }),
+            # Every photo and clip is different, so neither cache answers them
+            'upload_image': lambda i: upload({
+                'text': TRANSCRIPTS[i % len(TRANSCRIPTS)],
+                'current_state': '{}',
+                'image': SimpleUploadedFile('photo.png', png + str(i).encode(), 'image/png'),
+            }),
+            'transcribe': lambda i: client.post('/transcribe/', {
+                'audio': SimpleUploadedFile('clip.webm', f'{TRANSCRIPTS[i % len(TRANSCRIPTS)]} {i}'.encode(), 'audio/webm'),
+            }).json(),
+            'transcribe_and_merge': lambda i: client.post('/transcribe-and-merge/', {
+                'audio': SimpleUploadedFile('clip.webm', f'{PARTIAL_TRANSCRIPTS[i % len(PARTIAL_TRANSCRIPTS)]} {i}'.encode(), 'audio/webm'),
+            }).json(),
+            'transcribe_batch': lambda i: client.post('/transcribe-batch/', {
+                'audio': [
+                    SimpleUploadedFile(f'clip{clip}.webm', f'{TRANSCRIPTS[clip % len(TRANSCRIPTS)]} {i}'.encode(), 'audio/webm')
+                    for clip in range(4)
+                ],
+                'parse': 'true',
+            }).json(),
+        }
+
+    def run(self, name, request, iterations, warmup):
+        for i in range(warmup):
+            request(i)
+        timings = []
+        for i in range(warmup, warmup + iterations):
+            started = time.perf_counter()
+            response = request(i)
+            timings.append((time.perf_counter() - started) * 1000)
+            if not response.get('success'):
+                raise CommandError(f"{name} failed: {response.get('error')}")
+        timings.sort()
+        return {
+            'ops_per_sec': len(timings) / (sum(timings) / 1000),
+            'p50_ms': percentile(timings, 50),
+            'p99_ms': percentile(timings, 99),
+        }
+
+    def png(self):
+        """A small photo; bytes appended after it are ignored by decoders"""
+        from PIL import Image
+        output = io.BytesIO()
+        Image.new('RGB', (64, 48), (200, 120, 40)).save(output, 'PNG')
+        return output.getvalue()
+
+    def load_baseline(self, path):
+        if not os.path.exists(path):
+            return {}
+        with open(path) as f:
+            return json.load(f)['paths']
+
+    def save_baseline(self, path, results, iterations):
+        with open(path, 'w') as f:
+            json.dump({
+                'created_at': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'iterations': iterations,
+                'paths': results,
+            }, f, indent=2)
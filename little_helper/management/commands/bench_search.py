@@ -0,0 +1,71 @@
+import itertools
+import random
+import string
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from little_helper.search import InventoryIndex
+
+STORAGES = ['terrace', 'basement', 'attic', 'small house', 'house', 'barrack', 'garage', 'shed']
+COMMON_WORDS = [
+    'box', 'cable', 'tools', 'toys', 'clothes', 'books', 'furniture', 'kitchen',
+    'shoes', 'bags', 'electronics', 'teddy', 'bear', 'charger', 'lamp', 'drill',
+]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark "where is it?" queries against a synthetic in-memory inventory index'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000)
+        parser.add_argument('--vocabulary', type=int, default=5000, help='Distinct keyword words')
+        parser.add_argument('--queries', type=int, default=5000)
+        parser.add_argument('--budget-ms', type=float, default=1.0, help='Fail if p99 query time exceeds this')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        vocabulary = COMMON_WORDS + [
+            ''.join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 9)))
+            for _ in range(options['vocabulary'])
+        ]
+        # Zipf-like popularity, so a few words appear in many rows
+        cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+        shelves = [f'{letter}{number}' for letter in 'ABCD' for number in range(10)]
+
+        index = InventoryIndex()
+        started = time.perf_counter()
+        for row in range(options['rows']):
+            keywords = ' '.join(rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 3)))
+            index.add(('bench', row + 1), rng.choice(STORAGES), rng.choice(shelves), keywords)
+        build_seconds = time.perf_counter() - started
+
+        queries = []
+        for _ in range(options['queries']):
+            words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(1, 2))
+            if rng.random() < 0.3:
+                # Simulate a transcription error by swapping two letters
+                word = list(words[0])
+                position = rng.randrange(len(word) - 1)
+                word[position], word[position + 1] = word[position + 1], word[position]
+                words[0] = ''.join(word)
+            queries.append('where are the ' + ' '.join(words))
+
+        timings = []
+        for query in queries:
+            started = time.perf_counter()
+            index.search(query)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        def percentile(p):
+            return timings[min(int(len(timings) * p / 100), len(timings) - 1)]
+
+        self.stdout.write(f"Indexed {options['rows']} rows in {build_seconds:.2f}s")
+        self.stdout.write(
+            f"{len(timings)} queries: p50 {percentile(50):.3f} ms, p99 {percentile(99):.3f} ms, "
+            f"max {timings[-1]:.3f} ms, {len(timings) / (sum(timings) / 1000):.0f} queries/s"
+        )
+        if percentile(99) > options['budget_ms']:
+            raise CommandError(f"p99 {percentile(99):.3f} ms is over the {options['budget_ms']} ms budget")
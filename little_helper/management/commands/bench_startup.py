@@ -0,0 +1,83 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Runs in a fresh interpreter for every measurement, so nothing is imported yet
+CHILD = '''
+import json, os, sys, time
+mode, idle = sys.argv[1], float(sys.argv[2])
+started = time.perf_counter()
+import django
+django.setup()
+if mode == 'eager':
+    # What views.py imported and loaded at module level before the SDKs were made lazy
+    from google.cloud import speech_v1
+    from google.oauth2.service_account import Credentials
+    from google.auth.transport.requests import Request
+import little_helper.views
+import_ms = (time.perf_counter() - started) * 1000
+
+started = time.perf_counter()
+import little_helper.wsgi
+boot_ms = (time.perf_counter() - started) * 1000
+
+time.sleep(idle)
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client
+started = time.perf_counter()
+response = Client().post('/transcribe/', {'audio': SimpleUploadedFile('clip.webm', b'storage attic shelf A1', 'audio/webm')})
+first_request_ms = (time.perf_counter() - started) * 1000
+assert response.json()['success'], response.content
+print(json.dumps({'import_ms': import_ms, 'boot_ms': boot_ms, 'first_request_ms': first_request_ms}))
+'''
+
+MODES = (
+    ('eager', 'SDKs imported with the views (before)', False),
+    ('lazy', 'SDKs loaded by the first request', False),
+    ('prewarm', 'SDKs loaded in the background after boot', True),
+)
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the import time of the views and the time to the first transcription, with eager and lazy Google SDKs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per mode')
+        parser.add_argument('--idle', type=float, default=1.0,
+                            help='Seconds between boot and the first request, the time a prewarm has to finish')
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f"{'mode':<9} {'import ms':>10} {'boot ms':>9} {'first request ms':>17}  "
+            f"(median of {options['runs']} runs, first request {options['idle']:g} s after boot)"
+        )
+        for mode, description, prewarm in MODES:
+            runs = [self.measure(mode, prewarm, options['idle']) for _ in range(options['runs'])]
+            medians = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+            self.stdout.write(
+                f"{mode:<9} {medians['import_ms']:>10.1f} {medians['boot_ms']:>9.1f} "
+                f"{medians['first_request_ms']:>17.1f}  {description}"
+            )
+
+    def measure(self, mode, prewarm, idle):
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'little_helper.settings'),
+            # The first request goes to the fake Speech client; only the SDK imports are real
+            FAKE_GOOGLE_SERVICES='true',
+            GOOGLE_CLIENTS_PREWARM='true' if prewarm else 'false',
+            SHEET_WRITE_BEHIND='false',
+            DEBUG='false',
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', CHILD, mode, str(idle)],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        if result.returncode != 0:
+            raise CommandError(f'{mode} run failed:\n{result.stderr[-2000:]}')
+        return json.loads(result.stdout.strip().splitlines()[-1])
@@ -0,0 +1,210 @@
+import json
+import os
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+
+from django.conf import settings
+from django.core.files import File
+from django.core.handlers.wsgi import WSGIHandler
+from django.core.management.base import BaseCommand, CommandError
+from django.core.signals import request_finished, request_started
+from django.db import close_old_connections, connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+
+from little_helper import fakes, views
+from little_helper.uploads import MultipartBody
+
+MB = 1024 * 1024
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+RSS_UNIT = 1 if sys.platform == 'darwin' else 1024
+PROC_STATUS_KB_RE = re.compile(r'^(VmRSS|VmHWM):\s+(\d+) kB$', re.MULTILINE)
+# Writes a noisy photo-sized JPEG: argv is the path, the width and the height
+JPEG_SCRIPT = (
+    "import sys; from PIL import Image; "
+    "Image.effect_noise((int(sys.argv[2]), int(sys.argv[3])), 48).convert('RGB').save(sys.argv[1], 'JPEG', quality=90)"
+)
+
+
+def reset_peak_rss():
+    """
+    Start a new peak RSS measurement and return the current RSS. Linux resets
+    the peak through /proc/self/clear_refs; elsewhere the peak of the whole
+    process is kept, so what a request adds to it is a lower bound.
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as clear_refs:
+            clear_refs.write('5')
+        return proc_status_kb()['VmRSS'] * 1024
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def peak_rss():
+    try:
+        return proc_status_kb()['VmHWM'] * 1024
+    except (OSError, KeyError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * RSS_UNIT
+
+
+def proc_status_kb():
+    with open('/proc/self/status') as status:
+        return {name: int(kb) for name, kb in PROC_STATUS_KB_RE.findall(status.read())}
+
+
+class Command(BaseCommand):
+    help = 'Measure the peak Python memory and the peak RSS growth of handling large audio and image uploads'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--audio-mb', type=float, default=8)
+        parser.add_argument('--image-megapixels', type=float, default=24, help='Size of the JPEG photo, 3:2 like a phone camera')
+        parser.add_argument('--budget-mb', type=float, default=2.0,
+                            help='Fail if the Python memory of a large upload peaks this far above a small one')
+        parser.add_argument('--rss-budget-mb', type=float, default=64.0,
+                            help='Fail if the photo raises the RSS by more than this; '
+                                 'decoding a 24-megapixel photo at full size takes 72 MB')
+
+    def handle(self, *args, **options):
+        if not settings.FAKE_GOOGLE_SERVICES:
+            raise CommandError('Run with FAKE_GOOGLE_SERVICES=true; the benchmark must not call Google')
+        executor = MigrationExecutor(connection)
+        if executor.migration_plan(executor.loader.graph.leaf_nodes()):
+            raise CommandError(
+                'Run python manage.py migrate first, or run the same check on a test database with '
+                'python manage.py test little_helper.tests.test_upload_memory'
+            )
+
+        server = fakes.FakeImgbbServer().start()
+        upload_url = views.IMGBB_UPLOAD_URL
+        api_key = os.environ.get('IMGBB_API_KEY')
+        views.IMGBB_UPLOAD_URL = server.url
+        os.environ['IMGBB_API_KEY'] = 'bench'
+        handler = WSGIHandler()
+        # Like the test client, keep the connection open so the rows written
+        # by the uploads can be rolled back
+        request_started.disconnect(close_old_connections)
+        request_finished.disconnect(close_old_connections)
+
+        # The fake recognizer decodes audio as UTF-8 and ignores invalid bytes, so
+        # padding with 0xff keeps the transcript short however large the file is
+        transcript = b'storage attic shelf A1 keywords box '
+        # Each case uploads a tiny file to warm up imports and clients, a small file to
+        # measure what any upload costs, and the large file. Every file differs, so
+        # none is answered from the transcript or image cache. The small photo is
+        # already at IMAGE_MAX_DIMENSION: encoding the downscaled photo costs the same
+        # for both, and only what grows with the upload counts against the budget.
+        width = int((options['image_megapixels'] * 1e6 * 3 / 2) ** 0.5)
+        small_width = settings.IMAGE_MAX_DIMENSION
+        cases = [
+            ('/transcribe/', {}, 'audio', [
+                lambda: self.audio_file(transcript, len(transcript)),
+                lambda: self.audio_file(transcript, 64 * 1024),
+                lambda: self.audio_file(transcript, int(options['audio_mb'] * MB)),
+            ]),
+            ('/upload-to-sheet/', {'text': 'storage attic shelf A1 keywords box', 'current_state': '{}'}, 'image', [
+                lambda: self.jpeg_file(64, 48),
+                lambda: self.jpeg_file(small_width, small_width * 2 // 3),
+                lambda: self.jpeg_file(width, width * 2 // 3),
+            ]),
+        ]
+        failures = []
+        try:
+            with transaction.atomic():
+                tracemalloc.start()
+                for path, fields, file_field, files in cases:
+                    results = []
+                    for number, make_file in enumerate(files):
+                        with make_file() as upload:
+                            size = os.fstat(upload.fileno()).st_size
+                            results.append((size, *self.post(handler, path, fields, file_field, upload, measure=number > 0)))
+                    small_peak = results[1][1]
+                    size, peak, rss_growth, response = results[2]
+                    # C allocations, like Pillow's decoded pixels, are not traced but show in the RSS
+                    self.stdout.write(
+                        f'{path}: {size / MB:.1f} MB {file_field}, Python peak {peak / MB:.2f} MB '
+                        f'({small_peak / MB:.2f} MB for a small upload), peak RSS grew by {rss_growth / MB:.1f} MB'
+                    )
+                    if not all(result[-1].get('success') for result in results):
+                        failures.append(f'{path} failed: ' + '; '.join(
+                            str(result[-1].get('error')) for result in results if not result[-1].get('success')
+                        ))
+                    elif file_field == 'image' and not response['image']['format']:
+                        failures.append(f'{path}: the photo was not processed, so Pillow could not read it')
+                    elif peak - small_peak > options['budget_mb'] * MB:
+                        failures.append(
+                            f"{path} peaked {(peak - small_peak) / MB:.2f} MB above a small upload, "
+                            f"over the {options['budget_mb']} MB budget"
+                        )
+                    elif file_field == 'image' and rss_growth > options['rss_budget_mb'] * MB:
+                        failures.append(
+                            f"{path} raised the RSS by {rss_growth / MB:.1f} MB, "
+                            f"over the {options['rss_budget_mb']} MB budget"
+                        )
+                tracemalloc.stop()
+                transaction.set_rollback(True)
+        finally:
+            request_started.connect(close_old_connections)
+            request_finished.connect(close_old_connections)
+            server.shutdown()
+            views.IMGBB_UPLOAD_URL = upload_url
+            if api_key is None:
+                os.environ.pop('IMGBB_API_KEY', None)
+            else:
+                os.environ['IMGBB_API_KEY'] = api_key
+        if failures:
+            raise CommandError('; '.join(failures))
+
+    def audio_file(self, head, size):
+        """Temporary file of `size` bytes starting with `head`"""
+        upload = tempfile.TemporaryFile()
+        upload.write(head)
+        padding = b'\xff' * 65536
+        while upload.tell() < size:
+            upload.write(padding[:size - upload.tell()])
+        upload.seek(0)
+        return upload
+
+    def jpeg_file(self, width, height):
+        """Temporary JPEG photo, written by a child process so encoding it does not raise this process's peak RSS"""
+        upload = tempfile.NamedTemporaryFile(suffix='.jpg')
+        subprocess.run([sys.executable, '-c', JPEG_SCRIPT, upload.name, str(width), str(height)], check=True)
+        return upload
+
+    def post(self, handler, path, fields, file_field, upload, measure=False):
+        """
+        POST a multipart request with the upload, streamed from disk, to the WSGI handler.
+        Returns the peak of traced Python memory, how much the request raised the peak RSS
+        (both None without measure) and the JSON response.
+        """
+        with tempfile.TemporaryFile() as request_body:
+            body = MultipartBody(fields, file_field, File(upload, name='upload'))
+            for chunk in body:
+                request_body.write(chunk)
+            request_body.seek(0)
+
+            environ = {
+                'REQUEST_METHOD': 'POST',
+                'PATH_INFO': path,
+                'QUERY_STRING': '',
+                'CONTENT_TYPE': body.headers()['Content-Type'],
+                'CONTENT_LENGTH': str(len(body)),
+                'SERVER_NAME': 'testserver',
+                'SERVER_PORT': '80',
+                'wsgi.input': request_body,
+                'wsgi.url_scheme': 'http',
+            }
+            if measure:
+                tracemalloc.reset_peak()
+                baseline = tracemalloc.get_traced_memory()[0]
+                rss_baseline = reset_peak_rss()
+            response = handler(environ, lambda status, headers: None)
+            content = b''.join(response)
+            response.close()
+        if not measure:
+            return None, None, json.loads(content)
+        peak = tracemalloc.get_traced_memory()[1] - baseline
+        rss_growth = peak_rss() - rss_baseline
+        return peak, rss_growth, json.loads(content)
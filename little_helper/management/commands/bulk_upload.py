@@ -0,0 +1,52 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from little_helper import bulk, views
+
+
+class Command(BaseCommand):
+    help = 'Parse a CSV, JSONL or text file of transcripts or rows and append the valid rows to the sheet in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to ingest, or - for standard input")
+        parser.add_argument('--format', choices=bulk.FORMATS, help='File format (default: from the file name, else CSV)')
+        parser.add_argument('--dry-run', action='store_true', help='Only validate the rows')
+        parser.add_argument('--chunk-rows', type=int, help='Rows per Sheets call (default: BULK_CHUNK_ROWS)')
+        parser.add_argument('--show-errors', type=int, default=20, help='Invalid rows to list')
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or bulk.format_from_name(options['path'])
+        started = time.perf_counter()
+        try:
+            if options['path'] == '-':
+                entries = bulk.entries_from_file(sys.stdin.buffer, file_format)
+            else:
+                with open(options['path'], 'rb') as f:
+                    entries = bulk.entries_from_file(f, file_format)
+        except (OSError, bulk.BulkInputError) as e:
+            raise CommandError(str(e))
+
+        if not options['dry_run'] and views.credentials_missing():
+            raise CommandError(f'Credentials file not found at {views.CREDENTIALS_PATH}')
+
+        result = bulk.ingest(
+            entries, views.append_rows, dry_run=options['dry_run'], chunk_rows=options['chunk_rows'],
+            route=lambda row: views.shard_router.shard_for(row[0])
+        )
+        elapsed = time.perf_counter() - started
+
+        for error in result['errors'][:options['show_errors']]:
+            self.stdout.write(f"line {error['line']}: {error['error']}")
+        if len(result['errors']) > options['show_errors']:
+            self.stdout.write(f"... and {len(result['errors']) - options['show_errors']} more invalid rows")
+        self.stdout.write(
+            f"{result['received']} received, {result['valid']} valid, {result['invalid']} invalid, "
+            f"{result['appended']} appended in {result['sheets_calls']} Sheets calls ({elapsed:.2f}s)"
+        )
+        if 'append_error' in result:
+            raise CommandError(
+                f"Append failed after {result['appended']} rows, {result['not_appended']} not appended: "
+                f"{result['append_error']}"
+            )
@@ -0,0 +1,324 @@
+import hashlib
+import io
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+import requests
+from django.core.management.base import BaseCommand, CommandError
+from django.core.servers.basehttp import ThreadedWSGIServer, WSGIRequestHandler
+from django.core.wsgi import get_wsgi_application
+from django.test.utils import override_settings
+
+from little_helper import fakes, views
+from little_helper.models import AppendedRow, InventoryItem, QueuedRow, UploadedImage
+from little_helper.shards import ShardRouter
+
+ENDPOINTS = ('dictate', 'upload', 'upload_image', 'revert')
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+STORAGES = ['terrace', 'basement', 'small house', 'house', 'attic', 'barrack', 'garage']
+ITEMS = ['box', 'electronics', 'cables', 'tools', 'toys', 'clothes', 'books', 'shoes', 'bags', 'teddy bear']
+# Sheet tab the in-process server writes to, so the load test leaves the real rows alone
+LOADTEST_SHEET_NAME = 'loadtest'
+# A level is saturated once its throughput is within this fraction of the best level
+SATURATION_TOLERANCE = 0.1
+
+
+def percentile(timings, p):
+    return timings[min(int(len(timings) * p / 100), len(timings) - 1)]
+
+
+def merge_preview(state, data):
+    """Take the draft merged on the server into the operator's current fields the way index.html does"""
+    for field in ('storage', 'shelf', 'keywords'):
+        state[field] = data.get(field, '')
+    return state
+
+
+class QuietWSGIRequestHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class Recorder:
+    """Latencies and errors of every request made during one load level"""
+
+    def __init__(self):
+        self.timings = defaultdict(list)
+        self.errors = defaultdict(Counter)
+        self.flows = 0
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, elapsed_ms, error=None):
+        with self.lock:
+            self.timings[endpoint].append(elapsed_ms)
+            if error:
+                self.errors[endpoint][error] += 1
+
+    def flow_done(self):
+        with self.lock:
+            self.flows += 1
+
+
+class Command(BaseCommand):
+    help = (
+        'Simulate concurrent operators going through the index.html flow (transcribe and merge, upload '
+        'with optional photos, occasional revert) and find the concurrency at which throughput saturates'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--clients', default='1,2,4,8,16,32', help='Comma-separated concurrency levels to run')
+        parser.add_argument('--duration', type=float, default=10.0, help='Seconds per concurrency level')
+        parser.add_argument(
+            '--url', help='Load test a running deployment instead of an in-process server with local fakes'
+        )
+        parser.add_argument('--speech-latency', type=float, default=0.5, help='Seconds per fake recognize call')
+        parser.add_argument('--sheets-latency', type=float, default=0.2, help='Seconds per fake Sheets call')
+        parser.add_argument('--imgbb-latency', type=float, default=0.5, help='Seconds per fake imgbb upload')
+        parser.add_argument('--image-rate', type=float, default=0.3, help='Fraction of uploads with a photo')
+        parser.add_argument(
+            '--revert-rate', type=float, default=0.05,
+            help='Fraction of uploads that are reverted; always 0 with --url, which must not revert real rows'
+        )
+        parser.add_argument(
+            '--split-rate', type=float, default=0.3,
+            help='Fraction of entries dictated in two recordings instead of one'
+        )
+        parser.add_argument('--think-time', type=float, default=0.0, help='Seconds an operator pauses between requests')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(level) for level in options['clients'].split(',')]
+        except ValueError:
+            raise CommandError(f"--clients must be comma-separated numbers, not {options['clients']!r}")
+        self.photo = self.make_photo()
+        # Added to the keywords of every entry, so the rows of this run can be told from real ones
+        self.marker = f'loadtest-{uuid.uuid4().hex[:8]}'
+        self.photo_hashes = set()
+
+        if options['url']:
+            self.stdout.write(
+                f"Load testing {options['url']}; its upstream latency is whatever it is configured with "
+                f"(FAKE_SPEECH_LATENCY, FAKE_SHEETS_LATENCY and IMGBB_UPLOAD_URL when it runs with fakes)"
+            )
+            # A revert there would clear, or cancel the queued, rows of real users
+            if options['revert_rate']:
+                self.stdout.write('Not sending reverts to a running deployment')
+                options['revert_rate'] = 0
+            results = self.run_levels(options['url'].rstrip('/'), levels, options)
+        else:
+            results = self.run_in_process(levels, options)
+        self.report(results)
+
+    def run_in_process(self, levels, options):
+        """Serve the app from a threaded WSGI server, as runserver does, with every upstream replaced by a fake"""
+        imgbb = fakes.FakeImgbbServer(latency=options['imgbb_latency']).start()
+        server = ThreadedWSGIServer(('127.0.0.1', 0), QuietWSGIRequestHandler)
+        server.set_app(get_wsgi_application())
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+        saved = views.client_pool, views.IMGBB_UPLOAD_URL, views.shard_router
+        api_key = os.environ.get('IMGBB_API_KEY')
+        views.client_pool = fakes.fake_client_pool(options['speech_latency'], options['sheets_latency'])
+        views.IMGBB_UPLOAD_URL = imgbb.url
+        os.environ['IMGBB_API_KEY'] = 'loadtest'
+        # Every row goes to the loadtest tab, whatever the routing of the deployment
+        views.shard_router = ShardRouter(
+            views.GOOGLE_SHEET_ID, LOADTEST_SHEET_NAME, sheets=saved[2].sheets, call=saved[2].call
+        )
+        self.stdout.write(
+            f"In-process server with fakes: Speech {options['speech_latency']}s, "
+            f"Sheets {options['sheets_latency']}s, imgbb {options['imgbb_latency']}s"
+        )
+        # The views check credentials unless they run with the fakes
+        fake_services = override_settings(FAKE_GOOGLE_SERVICES=True)
+        fake_services.enable()
+        try:
+            return self.run_levels(f'http://127.0.0.1:{server.server_port}', levels, options)
+        finally:
+            fake_services.disable()
+            server.shutdown()
+            server.server_close()
+            imgbb.shutdown()
+            imgbb.server_close()
+            views.client_pool, views.IMGBB_UPLOAD_URL, views.shard_router = saved
+            if api_key is None:
+                os.environ.pop('IMGBB_API_KEY', None)
+            else:
+                os.environ['IMGBB_API_KEY'] = api_key
+            # Remove what the simulated operators stored, and only that: real users may
+            # have uploaded in the meantime
+            AppendedRow.objects.filter(sheet=LOADTEST_SHEET_NAME).delete()
+            InventoryItem.objects.filter(sheet=LOADTEST_SHEET_NAME).delete()
+            QueuedRow.objects.filter(keywords__contains=self.marker).delete()
+            UploadedImage.objects.filter(content_hash__in=self.photo_hashes).delete()
+
+    def run_levels(self, base_url, levels, options):
+        # One flow first, so imports and connections are warm before measuring
+        self.operator(base_url, Recorder(), time.monotonic(), random.Random(options['seed']), options)
+
+        results = []
+        for clients in levels:
+            recorder = Recorder()
+            deadline = time.monotonic() + options['duration']
+            started = time.monotonic()
+            threads = [
+                threading.Thread(
+                    target=self.operator,
+                    args=(base_url, recorder, deadline, random.Random(options['seed'] + number), options)
+                )
+                for number in range(clients)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.monotonic() - started
+            requests_made = sum(len(timings) for timings in recorder.timings.values())
+            results.append({
+                'clients': clients,
+                'recorder': recorder,
+                'flows_per_sec': recorder.flows / elapsed,
+                'requests_per_sec': requests_made / elapsed,
+                'errors': sum(sum(counter.values()) for counter in recorder.errors.values()),
+            })
+            self.report_level(results[-1])
+        return results
+
+    def operator(self, base_url, recorder, deadline, rng, options):
+        """Enter items the way an operator does in index.html until the deadline, finishing the current entry"""
+        session = requests.Session()
+
+        def call(endpoint, path, **kwargs):
+            if options['think_time']:
+                time.sleep(options['think_time'])
+            started = time.perf_counter()
+            try:
+                response = session.post(base_url + path, timeout=60, **kwargs)
+                data = response.json()
+                error = None if data.get('success') else data.get('error') or f'HTTP {response.status_code}'
+            except (requests.RequestException, ValueError) as e:
+                data, error = {}, type(e).__name__
+            recorder.record(endpoint, (time.perf_counter() - started) * 1000, error)
+            return data if error is None else None
+
+        def dictate(text, reset=False):
+            """Transcribe a recording of text and merge it into the draft; the fake recognizer returns the audio as the transcript"""
+            return call('dictate', '/transcribe-and-merge/', data={'reset': 'true' if reset else 'false'}, files={
+                'audio': ('clip.webm', text.encode(), 'audio/webm')
+            })
+
+        entry = 0
+        while True:
+            entry += 1
+            state = {'storage': '', 'shelf': '', 'keywords': '', 'parsed_text': ''}
+            storage = f'storage {rng.choice(STORAGES)}'
+            shelf = f'shelf {rng.choice("ABCD")}{rng.randint(1, 9)}'
+            # A serial number keeps every clip unique, so the transcript cache cannot answer it
+            keywords = f'keywords {" ".join(rng.sample(ITEMS, rng.randint(1, 3)))} {self.marker}-{id(session)}-{entry}'
+            if rng.random() < options['split_rate']:
+                recordings = [f'{storage}. {shelf}', keywords]
+            else:
+                recordings = [f'{storage}. {shelf}. {keywords}']
+            for number, text in enumerate(recordings):
+                # Start from an empty draft even if the previous entry was abandoned
+                preview = dictate(text, reset=number == 0)
+                if preview is None:
+                    break
+                merge_preview(state, preview)
+            else:
+                text = f"Storage {state['storage']}. Shelf {state['shelf']}. Keywords {state['keywords']}"
+                if rng.random() < options['image_rate']:
+                    photo = self.photo + f'{id(session)}-{entry}'.encode()
+                    self.photo_hashes.add(hashlib.sha256(photo).hexdigest())
+                    uploaded = call('upload_image', '/upload-to-sheet/', data={
+                        'text': text,
+                        'current_state': '{}',
+                        'do_upload': 'true',
+                    }, files={'image': ('photo.jpg', photo, 'image/jpeg')})
+                else:
+                    uploaded = call('upload', '/upload-to-sheet/', json={
+                        'text': text,
+                        'current_state': state,
+                        'do_upload': True,
+                    })
+                if uploaded is not None and rng.random() < options['revert_rate']:
+                    call('revert', '/transcribe-and-merge/', files={'audio': ('clip.webm', b'revert', 'audio/webm')})
+                if uploaded is not None:
+                    recorder.flow_done()
+            if time.monotonic() >= deadline:
+                return
+
+    def make_photo(self):
+        """A phone-sized JPEG; bytes appended after it make each upload unique and are ignored by decoders"""
+        from PIL import Image
+        output = io.BytesIO()
+        Image.effect_noise((1600, 1200), 48).convert('RGB').save(output, 'JPEG', quality=90)
+        return output.getvalue()
+
+    def report_level(self, result):
+        recorder = result['recorder']
+        all_timings = sorted(timing for timings in recorder.timings.values() for timing in timings)
+        self.stdout.write(
+            f"{result['clients']:>4} clients: {result['flows_per_sec']:7.2f} entries/s, "
+            f"{result['requests_per_sec']:7.2f} requests/s, {result['errors']} errors"
+            + (f", p50 {percentile(all_timings, 50):.0f} ms, p99 {percentile(all_timings, 99):.0f} ms" if all_timings else '')
+        )
+        for endpoint in ENDPOINTS:
+            timings = sorted(recorder.timings.get(endpoint, []))
+            if not timings:
+                continue
+            self.stdout.write(
+                f"       {endpoint:<13} {len(timings):>6} requests  p50 {percentile(timings, 50):7.0f} ms  "
+                f"p95 {percentile(timings, 95):7.0f} ms  p99 {percentile(timings, 99):7.0f} ms  "
+                f"errors {sum(recorder.errors[endpoint].values())}"
+            )
+            for error, count in recorder.errors[endpoint].most_common(3):
+                self.stdout.write(f'         {count} x {error}')
+
+    def report(self, results):
+        # Failed requests are often the fastest ones, so levels with errors say nothing about saturation
+        errors = sum(result['errors'] for result in results)
+        if errors:
+            raise CommandError(f'{errors} requests failed; not reporting a saturation point (see the errors above)')
+        # Throughput is counted in completed entries, the work the operators came to do
+        best = max(results, key=lambda result: result['flows_per_sec'])
+        saturation = next(
+            result for result in results
+            if result['flows_per_sec'] >= (1 - SATURATION_TOLERANCE) * best['flows_per_sec']
+        )
+        self.stdout.write('')
+        if saturation is results[-1] and len(results) > 1:
+            self.stdout.write(
+                f"Throughput was still rising at {saturation['clients']} clients "
+                f"({saturation['flows_per_sec']:.2f} entries/s); run more clients to find the saturation point"
+            )
+        else:
+            self.stdout.write(
+                f"Saturation point: {saturation['clients']} concurrent clients, "
+                f"{saturation['flows_per_sec']:.2f} entries/s ({saturation['requests_per_sec']:.1f} requests/s); "
+                f"more clients only add latency"
+            )
+
+        self.stdout.write(f"\nLatency histograms at {saturation['clients']} clients:")
+        recorder = saturation['recorder']
+        for endpoint in ENDPOINTS:
+            timings = recorder.timings.get(endpoint)
+            if not timings:
+                continue
+            self.stdout.write(f'  {endpoint} ({len(timings)} requests)')
+            counts = Counter(
+                next((bucket for bucket in HISTOGRAM_BUCKETS_MS if timing <= bucket), None) for timing in timings
+            )
+            widest = max(counts.values())
+            lower = 0
+            for bucket in HISTOGRAM_BUCKETS_MS + (None,):
+                label = f'{lower}-{bucket} ms' if bucket else f'>{lower} ms'
+                count = counts.get(bucket, 0)
+                if count:
+                    self.stdout.write(f"    {label:>14} {count:>6} {'#' * max(1, round(40 * count / widest))}")
+                lower = bucket
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from little_helper import mirror
+from little_helper.models import InventoryItem
+from little_helper.views import shard_router
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the local inventory mirror from scratch by reading every shard of the Google Sheet'
+
+    def handle(self, *args, **options):
+        InventoryItem.objects.filter(sheet__in=shard_router.tabs()).delete()
+        results = mirror.sync_shards(shard_router, full=True)
+        rows = sum(stats['rows_stored'] for stats in results.values())
+        self.stdout.write(self.style.SUCCESS(f"Mirror rebuilt with {rows} rows from {len(results)} tabs"))
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from little_helper import mirror
+from little_helper.views import shard_router
+
+
+class Command(BaseCommand):
+    help = 'Pull rows changed since the last sync from every shard of the Google Sheet into the local inventory mirror'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Rebuild the mirrored rows instead of writing only the changed ones')
+
+    def handle(self, *args, **options):
+        results = mirror.sync_shards(shard_router, full=options['full'])
+        for tab, stats in results.items():
+            self.stdout.write(self.style.SUCCESS(
+                f"Synced {tab}: {stats['rows_read']} read, {stats['rows_stored']} stored, "
+                f"{stats['rows_changed']} changed, {stats['rows_removed']} removed"
+            ))
@@ -0,0 +1,35 @@
+# Generated by Django 3.2.23 on 2026-10-17 17:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('little_helper', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AppendedRow',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheet', models.CharField(max_length=255)),
+                ('row_number', models.PositiveIntegerField()),
+                ('storage', models.CharField(blank=True, max_length=255)),
+                ('shelf', models.CharField(blank=True, max_length=32)),
+                ('keywords', models.TextField(blank=True)),
+                ('picture', models.TextField(blank=True)),
+                ('reverted', models.BooleanField(db_index=True, default=False)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('reverted_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['row_number'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='appendedrow',
+            index=models.Index(fields=['sheet', 'reverted', 'row_number'], name='little_help_sheet_97f20f_idx'),
+        ),
+    ]
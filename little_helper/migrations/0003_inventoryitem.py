@@ -0,0 +1,30 @@
+# Generated by Django 3.2.23 on 2026-10-17 17:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('little_helper', '0002_appendedrow'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventoryItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('sheet', models.CharField(max_length=255)),
+                ('row_number', models.PositiveIntegerField()),
+                ('storage', models.CharField(blank=True, db_index=True, max_length=255)),
+                ('shelf', models.CharField(blank=True, max_length=32)),
+                ('keywords', models.TextField(blank=True)),
+                ('picture', models.TextField(blank=True)),
+                ('synced_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'ordering': ['sheet', 'row_number'],
+                'unique_together': {('sheet', 'row_number')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.23 on 2026-10-17 19:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('little_helper', '0004_uploadedimage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='queuedrow',
+            name='claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
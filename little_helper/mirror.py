@@ -0,0 +1,112 @@
+"""
+Local mirror of the inventory sheet.
+
+Uploads write through to the mirror as soon as the append succeeds, and a sync
+job pulls in changes made directly in the sheet. Sheets cannot list the rows
+changed since a given time, and people edit and delete rows anywhere in the
+sheet, so a sync reads the whole range in one request and compares every row
+with the mirror. Only the rows that were added, changed or cleared are written
+to the database and the search index. A full sync rebuilds the mirrored rows
+of the sheet instead.
+
+With the inventory sharded across tabs (see shards.py), sync_shards reads the
+shards in parallel and stores them one after another.
+"""
+from django.db import transaction
+
+from .models import InventoryItem
+from .search import inventory_index
+from .sheets import quote_tab
+
+
+def upsert_rows(sheet, first_row, values):
+    """Store rows that were written to the sheet starting at first_row."""
+    row_numbers = [first_row + offset for offset in range(len(values))]
+    with transaction.atomic():
+        InventoryItem.objects.filter(sheet=sheet, row_number__in=row_numbers).delete()
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                sheet=sheet, row_number=row_number,
+                storage=row[0], shelf=row[1], keywords=row[2], picture=row[3]
+            )
+            for row_number, row in zip(row_numbers, (_pad(row) for row in values))
+        ])
+    for row_number, row in zip(row_numbers, values):
+        inventory_index.add((sheet, row_number), *_pad(row))
+
+
+def delete_rows(sheet, row_numbers):
+    InventoryItem.objects.filter(sheet=sheet, row_number__in=row_numbers).delete()
+    for row_number in row_numbers:
+        inventory_index.remove((sheet, row_number))
+
+
+def sync(service, spreadsheet_id, sheet, full=False):
+    """
+    Bring the mirror up to date with the sheet.
+    With full=True the mirrored rows are rebuilt, otherwise only the rows that differ are written.
+    Returns counts of rows read, stored, changed and removed.
+    """
+    return store(sheet, read(service, spreadsheet_id, sheet), full)
+
+
+def sync_shards(router, full=False):
+    """sync every shard of a ShardRouter, reading them in parallel. Returns {tab: counts}."""
+    shards = router.shards()
+    values = router.fan_out(lambda shard: router.call(
+        'sheets', read, router.sheets(), shard.spreadsheet_id, shard.tab, stage='sheets_read'
+    ), shards)
+    return {shard.tab: store(shard.tab, values[shard], full) for shard in shards}
+
+
+def read(service, spreadsheet_id, sheet):
+    result = service.spreadsheets().values().get(
+        spreadsheetId=spreadsheet_id,
+        range=f"{quote_tab(sheet)}!A1:D",
+        valueRenderOption='FORMULA'
+    ).execute()
+    return result.get('values', [])
+
+
+def store(sheet, values, full=False):
+    """Make the mirrored rows of a sheet match the rows read, writing only those that differ unless full"""
+    rows = {}
+    for offset, row in enumerate(values):
+        if any(cell for cell in row):
+            rows[1 + offset] = _pad(row)
+
+    with transaction.atomic():
+        existing = {
+            item.row_number: item.values()
+            for item in InventoryItem.objects.filter(sheet=sheet).only('row_number', 'storage', 'shelf', 'keywords', 'picture')
+        }
+        changed = rows if full else {
+            row_number: row for row_number, row in rows.items() if existing.get(row_number) != row
+        }
+        removed = [row_number for row_number in existing if row_number not in rows]
+        stale = InventoryItem.objects.filter(sheet=sheet)
+        if not full:
+            stale = stale.filter(row_number__in=[*changed, *removed])
+        stale.delete()
+        InventoryItem.objects.bulk_create([
+            InventoryItem(
+                sheet=sheet, row_number=row_number,
+                storage=row[0], shelf=row[1], keywords=row[2], picture=row[3]
+            )
+            for row_number, row in changed.items()
+        ], batch_size=500)
+
+    for row_number, row in changed.items():
+        inventory_index.add((sheet, row_number), *row)
+    for row_number in removed:
+        inventory_index.remove((sheet, row_number))
+    return {
+        'rows_read': len(values),
+        'rows_stored': len(rows),
+        'rows_changed': len(changed),
+        'rows_removed': len(removed),
+    }
+
+
+def _pad(row):
+    return [str(cell) for cell in (list(row) + [''] * 4)[:4]]
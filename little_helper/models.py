@@ -0,0 +1,86 @@
+from django.db import models
+
+from .sheets import quote_tab
+
+
+class QueuedRow(models.Model):
+    """A validated row waiting in the write-behind queue for a batched sheet append"""
+    STATUS_PENDING = 'pending'
+    STATUS_SENDING = 'sending'
+    STATUS_SENT = 'sent'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_PENDING, 'Pending'),
+        (STATUS_SENDING, 'Sending'),
+        (STATUS_SENT, 'Sent'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    storage = models.CharField(max_length=255)
+    shelf = models.CharField(max_length=32)
+    keywords = models.TextField()
+    picture = models.TextField(blank=True)
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=STATUS_PENDING, db_index=True)
+    batch = models.CharField(max_length=32, blank=True, db_index=True)
+    claimed_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    updated_range = models.CharField(max_length=64, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['id']
+
+    def values(self):
+        return [self.storage, self.shelf, self.keywords, self.picture]
+
+
+class AppendedRow(models.Model):
+    """Journal entry for a row appended to the sheet, used to revert without reading the sheet"""
+    sheet = models.CharField(max_length=255)
+    row_number = models.PositiveIntegerField()
+    storage = models.CharField(max_length=255, blank=True)
+    shelf = models.CharField(max_length=32, blank=True)
+    keywords = models.TextField(blank=True)
+    picture = models.TextField(blank=True)
+    reverted = models.BooleanField(default=False, db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    reverted_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ['row_number']
+        indexes = [models.Index(fields=['sheet', 'reverted', 'row_number'])]
+
+    def a1_range(self):
+        return f'{quote_tab(self.sheet)}!A{self.row_number}:D{self.row_number}'
+
+    def values(self):
+        return [self.storage, self.shelf, self.keywords, self.picture]
+
+
+class InventoryItem(models.Model):
+    """Local mirror of one sheet row, so reads do not need a round trip to Google"""
+    sheet = models.CharField(max_length=255)
+    row_number = models.PositiveIntegerField()
+    storage = models.CharField(max_length=255, blank=True, db_index=True)
+    shelf = models.CharField(max_length=32, blank=True)
+    keywords = models.TextField(blank=True)
+    picture = models.TextField(blank=True)
+    synced_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['sheet', 'row_number']
+        unique_together = [('sheet', 'row_number')]
+
+    def values(self):
+        return [self.storage, self.shelf, self.keywords, self.picture]
+
+
+class UploadedImage(models.Model):
+    """imgbb URL of an uploaded photo, keyed by the SHA-256 of the original file"""
+    content_hash = models.CharField(max_length=64, unique=True)
+    url = models.URLField(max_length=500)
+    original_bytes = models.PositiveIntegerField()
+    stored_bytes = models.PositiveIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
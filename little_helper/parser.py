@@ -0,0 +1,93 @@
+"""
+Parser for spoken input like "storage attic shelf A1 keywords box".
+
+The field patterns are compiled once at import, the shelf check and the error
+messages live in validation_error() so the views share them, and the debug
+dict is only built when it is asked for. parse_many() parses a batch of
+transcripts, e.g. for bulk imports.
+
+The patterns are the original ones, so the results are exactly the same,
+including which fields are left out of a partial update. The speedup comes
+from compiling them once, not from a new matcher: each field is still found
+by its own search. bench_parser also measures a single scan with a combined
+alternation of the field words, which gives the same matches but is slower
+in CPython because the per-field dispatch runs in Python between matches.
+"""
+import re
+
+STORAGE_RE = re.compile(r'storage\s+(.*?)(?=\b(shelf|keywords?)\b|[.?!,;]|$)', re.IGNORECASE)
+SHELF_FIELD_RE = re.compile(r'shelf(?:\s+|[.?!,;])?(.*?)(?=\b(storage|keywords?)\b|[.?!,;]|$)', re.IGNORECASE)
+KEYWORDS_RE = re.compile(r'key(?:word|words)\s+(.*?)(?=\b(storage|shelf)\b|[.?!,;]|$)', re.IGNORECASE)
+SHELF_RE = re.compile(r'^[A-Z]\d+$')
+STRIP_CHARS = ' .,:;\n\t'
+
+
+def field_value(match):
+    """Stripped value of a field match, or None if there was no match or it is empty"""
+    return match and match.group(1).strip(STRIP_CHARS) or None
+
+
+def validation_error(storage, shelf, keywords):
+    """Error message for missing values or an invalid shelf, or None if the row is complete"""
+    missing = []
+    invalid_shelf = None
+    if not storage:
+        missing.append('storage')
+    if not shelf:
+        missing.append('shelf')
+    elif not SHELF_RE.match(shelf.upper()):
+        invalid_shelf = shelf
+    if not keywords:
+        missing.append('keywords')
+
+    if not missing and invalid_shelf is None:
+        return None
+    error_parts = []
+    if missing:
+        error_parts.append(f'Missing values for: {", ".join(missing)}.')
+    if invalid_shelf is not None:
+        error_parts.append(f'Invalid shelf format: "{invalid_shelf}". Shelf must be like A1, B5 (letter followed by number).')
+    return ' '.join(error_parts)
+
+
+def parse_voice_input(text, debug=False):
+    """
+    Parse the voice input to extract storage, shelf, and keywords.
+    Returns dict with values or error, with the matches under 'debug_matches' if debug is set.
+    """
+    storage_match = STORAGE_RE.search(text)
+    shelf_match = SHELF_FIELD_RE.search(text)
+    keyword_match = KEYWORDS_RE.search(text)
+    storage = field_value(storage_match)
+    shelf = field_value(shelf_match)
+    keywords = field_value(keyword_match)
+
+    error = validation_error(storage, shelf, keywords)
+    if error:
+        resp = {
+            'error': error,
+            'parsed_text': text
+        }
+    else:
+        resp = {
+            'storage': storage,
+            'shelf': shelf,
+            'keywords': keywords,
+            'parsed_text': text
+        }
+    if debug:
+        resp['debug_matches'] = {
+            'storage_match': storage_match.group(0) if storage_match else None,
+            'shelf_match': shelf_match.group(0) if shelf_match else None,
+            'keyword_match': keyword_match.group(0) if keyword_match else None,
+            'text': text,
+            'storage': storage,
+            'shelf': shelf,
+            'keywords': keywords
+        }
+    return resp
+
+
+def parse_many(texts, debug=False):
+    """parse_voice_input for every text, e.g. a batch of transcripts"""
+    return [parse_voice_input(text, debug) for text in texts]
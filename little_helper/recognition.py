@@ -0,0 +1,137 @@
+"""
+RecognitionConfig for Speech-to-Text, built once and cached.
+
+Phrase hints tell the recognizer which words to expect. Besides the command
+words they come from the inventory itself: every storage and shelf in the
+local mirror and the keywords held by most rows, up to SPEECH_MAX_PHRASES,
+with a few defaults for a new, empty inventory. The config is rebuilt when
+that vocabulary changes (at most every SPEECH_CONFIG_REFRESH seconds), so
+requests share one config object instead of building it every time. Uploads
+preprocessed to LINEAR16 (see audio.py) get a config of their own per sample
+rate, built from the same hints.
+
+SPEECH_PROFILE trades alternatives and languages for latency:
+
+    fast      en-US, one alternative (default)
+    accents   en-US plus en-GB, en-AU and en-CA, one alternative
+    thorough  all four languages and three alternatives, as before
+
+Only the first alternative is used, so the extra ones in 'thorough' only
+cost time.
+"""
+import threading
+import time
+
+# Words of the voice commands, hinted with a higher boost than the inventory
+COMMAND_PHRASES = ['storage', 'shelf', 'keyword', 'keywords', 'revert']
+
+# Hints for an inventory that does not have any rows yet
+DEFAULT_STORAGES = [
+    'terrace', 'basement', 'small house', 'house', 'Bracigovo',
+    'barrack', 'basement apartment', 'basement house', 'attic',
+]
+DEFAULT_KEYWORDS = [
+    'box', 'electronics', 'cables', 'tools', 'toys',
+    'clothes', 'books', 'furniture', 'kitchen', 'shoes', 'bags',
+]
+DEFAULT_SHELVES = [f'{letter}{number}' for letter in 'ABCD' for number in range(6)]
+
+PROFILES = {
+    'fast': {'max_alternatives': 1, 'alternative_language_codes': []},
+    'accents': {'max_alternatives': 1, 'alternative_language_codes': ['en-GB', 'en-AU', 'en-CA']},
+    'thorough': {'max_alternatives': 3, 'alternative_language_codes': ['en-GB', 'en-AU', 'en-CA']},
+}
+
+# Speech-to-Text accepts at most 100 characters per phrase
+MAX_PHRASE_LENGTH = 100
+
+
+def phrase_hints(vocabulary, max_phrases):
+    """Storages, then shelves, then keywords, without duplicates and within max_phrases"""
+    phrases = {}
+    for phrase in (
+        vocabulary['storages'] + DEFAULT_STORAGES + vocabulary['shelves'] + DEFAULT_SHELVES
+        + DEFAULT_KEYWORDS + vocabulary['keywords']
+    ):
+        phrase = ' '.join(phrase.split())[:MAX_PHRASE_LENGTH]
+        if phrase:
+            phrases.setdefault(phrase.lower(), phrase)
+        if len(phrases) >= max_phrases:
+            break
+    return list(phrases.values())
+
+
+class RecognitionConfigs:
+    """Builds the RecognitionConfigs of a profile and keeps them until the vocabulary changes.
+
+    `vocabulary(max_keywords)` returns the storages, shelves and keywords of
+    the inventory, and `version()` a value that changes with them.
+    """
+
+    def __init__(self, vocabulary, version, profile='fast', max_phrases=500,
+                 boost=15.0, command_boost=20.0, refresh_interval=60.0):
+        if profile not in PROFILES:
+            raise ValueError(f"Unknown SPEECH_PROFILE {profile!r}, expected one of {', '.join(PROFILES)}")
+        self.vocabulary = vocabulary
+        self.version = version
+        self.profile = profile
+        self.max_phrases = max_phrases
+        self.boost = boost
+        self.command_boost = command_boost
+        self.refresh_interval = refresh_interval
+        self.lock = threading.Lock()
+        self._configs = {}
+        self._phrases = None
+        self._version = None
+        self._checked_at = 0.0
+        self._stats = {'builds': 0, 'phrases': 0}
+
+    def config(self, encoding='WEBM_OPUS', sample_rate_hertz=48000):
+        """
+        The cached config for an audio encoding and sample rate, rebuilt first
+        if the vocabulary changed and the last check is old enough
+        """
+        key = (encoding, sample_rate_hertz)
+        config = self._configs.get(key)
+        if config is not None and time.monotonic() - self._checked_at < self.refresh_interval:
+            return config
+        with self.lock:
+            if self._phrases is None or self.version() != self._version:
+                self._phrases = self.phrases()
+                # A new dict, so that readers without the lock never see a half-updated one
+                self._configs = {}
+            # Checked again after refresh_interval, whether or not it changed
+            self._checked_at = time.monotonic()
+            config = self._configs.get(key)
+            if config is None:
+                config = self.build(self._phrases, encoding, sample_rate_hertz)
+                self._configs = {**self._configs, key: config}
+            return config
+
+    def phrases(self):
+        """Phrase hints for the current vocabulary"""
+        phrases = phrase_hints(self.vocabulary(self.max_phrases), self.max_phrases)
+        # Read after the vocabulary, which may have just been loaded
+        self._version = self.version()
+        self._stats['phrases'] = len(phrases)
+        return phrases
+
+    def build(self, phrases, encoding='WEBM_OPUS', sample_rate_hertz=48000):
+        from google.cloud import speech_v1
+        self._stats['builds'] += 1
+        return speech_v1.RecognitionConfig(
+            encoding=speech_v1.RecognitionConfig.AudioEncoding[encoding],
+            sample_rate_hertz=sample_rate_hertz,
+            language_code='en-US',
+            enable_automatic_punctuation=False,
+            use_enhanced=True,
+            model='latest_short',
+            speech_contexts=[
+                speech_v1.SpeechContext(phrases=COMMAND_PHRASES, boost=self.command_boost),
+                speech_v1.SpeechContext(phrases=phrases, boost=self.boost),
+            ],
+            **PROFILES[self.profile]
+        )
+
+    def stats(self):
+        return {'profile': self.profile, **self._stats}
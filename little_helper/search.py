@@ -0,0 +1,300 @@
+"""
+In-memory search over the inventory keywords.
+
+The index maps every keyword token to the storage/shelf locations that hold
+it, and every token to its trigrams so that misheard words ("cabels") still
+find the right keyword ("cable"). It is loaded once from the local mirror and
+then kept up to date incrementally as rows are appended or reverted, so a
+query never touches the sheet or the database.
+
+The same index supplies the vocabulary of the inventory (storages, shelves and
+the most used keywords) for the phrase hints of speech recognition;
+vocabulary_version changes whenever a word enters or leaves it.
+"""
+import heapq
+import re
+import threading
+import time
+from collections import Counter, OrderedDict, defaultdict
+
+TOKEN_RE = re.compile(r'[a-z0-9]+')
+
+# Words people use when asking where something is, ignored in queries
+STOP_WORDS = {
+    'a', 'an', 'the', 'my', 'our', 'is', 'are', 'where', 'wheres', 'what',
+    'which', 'find', 'located', 'location', 'of', 'for', 'in', 'on', 'at',
+    'i', 'we', 'me', 'can', 'do', 'did', 'put', 'kept', 'keep', 'stored',
+    'store', 'some', 'any', 'please', 'and', 'with', 'to',
+}
+
+# Minimum trigram similarity for a fuzzy match
+FUZZY_THRESHOLD = 0.3
+# Fuzzy matches considered per query term
+FUZZY_CANDIDATES = 3
+# Query terms whose fuzzy matches are remembered, least recently used dropped first
+FUZZY_CACHE_SIZE = 4096
+
+
+def normalize(token):
+    """Lowercase token reduced to a crude singular form."""
+    if len(token) > 4 and token.endswith('ies'):
+        return token[:-3] + 'y'
+    if len(token) > 3 and token.endswith(('xes', 'ches', 'shes', 'sses')):
+        return token[:-2]
+    if len(token) > 3 and token.endswith('s') and not token.endswith('ss'):
+        return token[:-1]
+    return token
+
+
+def tokenize(text):
+    return [normalize(token) for token in TOKEN_RE.findall((text or '').lower())]
+
+
+def trigrams(token):
+    padded = f'  {token} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class InventoryIndex:
+    """Inverted and trigram index over the keywords of the inventory rows.
+
+    Rows are identified by a key (the (sheet, row number) pair of the mirror)
+    and grouped by their (storage, shelf) location.
+    """
+
+    def __init__(self, loader=None, refresh_interval=30.0):
+        self.loader = loader
+        self.refresh_interval = refresh_interval
+        self._ids = {}
+        self._rows = {}
+        self._next_id = 0
+        self._postings = defaultdict(lambda: defaultdict(set))
+        self._trigrams = defaultdict(set)
+        self._gram_counts = {}
+        self._sort_keys = {}
+        self._fuzzy_cache = OrderedDict()
+        self._location_rows = Counter()
+        self.vocabulary_version = 0
+        self._lock = threading.RLock()
+        self._loaded = False
+        self._refreshed_at = 0.0
+        self._watermark = None
+
+    def __len__(self):
+        return len(self._rows)
+
+    def add(self, key, storage, shelf, keywords, picture=''):
+        with self._lock:
+            if key in self._ids:
+                self._remove(key)
+            # Postings hold small integer ids, which are cheaper to compare and
+            # hash than row keys; newer rows get higher ids
+            row_id = self._next_id
+            self._next_id += 1
+            self._ids[key] = row_id
+            location = (storage or '', (shelf or '').upper())
+            if location not in self._sort_keys:
+                self._sort_keys[location] = (location[0].lower(), location[1])
+            self._location_rows[location] += 1
+            if self._location_rows[location] == 1:
+                self.vocabulary_version += 1
+            tokens = {token for token in tokenize(keywords) if token not in STOP_WORDS} or set(tokenize(keywords))
+            self._rows[row_id] = (location, keywords or '', picture or '', tokens)
+            for token in tokens:
+                if token not in self._postings:
+                    grams = trigrams(token)
+                    for gram in grams:
+                        self._trigrams[gram].add(token)
+                    self._gram_counts[token] = len(grams)
+                    self._fuzzy_cache.clear()
+                    self.vocabulary_version += 1
+                self._postings[token][location].add(row_id)
+
+    def remove(self, key):
+        with self._lock:
+            self._remove(key)
+
+    def _remove(self, key):
+        row_id = self._ids.pop(key, None)
+        if row_id is None:
+            return
+        location, _, _, tokens = self._rows.pop(row_id)
+        self._location_rows[location] -= 1
+        if not self._location_rows[location]:
+            del self._location_rows[location]
+            self.vocabulary_version += 1
+        for token in tokens:
+            locations = self._postings[token]
+            locations[location].discard(row_id)
+            if not locations[location]:
+                del locations[location]
+            if not locations:
+                del self._postings[token]
+                for gram in trigrams(token):
+                    self._trigrams[gram].discard(token)
+                del self._gram_counts[token]
+                self._fuzzy_cache.clear()
+                self.vocabulary_version += 1
+
+    def clear(self):
+        with self._lock:
+            self._ids.clear()
+            self._rows.clear()
+            self._postings.clear()
+            self._trigrams.clear()
+            self._gram_counts.clear()
+            self._sort_keys.clear()
+            self._fuzzy_cache.clear()
+            self._location_rows.clear()
+            self.vocabulary_version += 1
+
+    def ensure_loaded(self):
+        """Load the index on first use and pick up rows written by other processes."""
+        if self.loader is None:
+            return
+        if self._loaded and time.monotonic() - self._refreshed_at < self.refresh_interval:
+            return
+        with self._lock:
+            if self._loaded and time.monotonic() - self._refreshed_at < self.refresh_interval:
+                return
+            self._watermark = self.loader(self, self._watermark if self._loaded else None)
+            self._loaded = True
+            self._refreshed_at = time.monotonic()
+
+    def vocabulary(self, max_keywords=None):
+        """Storages and shelves, and the keyword tokens held by most rows, each list most used first"""
+        self.ensure_loaded()
+        with self._lock:
+            storages, shelves = Counter(), Counter()
+            for (storage, shelf), rows in self._location_rows.items():
+                storages[storage] += rows
+                shelves[shelf] += rows
+            keyword_rows = [
+                (sum(len(rows) for rows in locations.values()), token)
+                for token, locations in self._postings.items()
+            ]
+        if max_keywords is not None:
+            keyword_rows = heapq.nlargest(max_keywords, keyword_rows)
+        else:
+            keyword_rows.sort(reverse=True)
+        return {
+            'storages': [storage for storage, _ in storages.most_common() if storage],
+            'shelves': [shelf for shelf, _ in shelves.most_common() if shelf],
+            'keywords': [token for _, token in keyword_rows],
+        }
+
+    def expand(self, term):
+        """Index tokens matching a query term, with a weight for each."""
+        if term in self._postings:
+            return [(term, 1.0)]
+        cached = self._fuzzy_cache.get(term)
+        if cached is not None:
+            self._fuzzy_cache.move_to_end(term)
+            return cached
+        grams = trigrams(term)
+        shared = Counter()
+        for gram in grams:
+            shared.update(self._trigrams.get(gram, ()))
+        # A token sharing fewer than threshold * len(grams) trigrams cannot
+        # reach the threshold, so skip those before computing similarities
+        min_shared = FUZZY_THRESHOLD * len(grams)
+        matches = []
+        for token, count in [item for item in shared.items() if item[1] >= min_shared]:
+            similarity = count / (len(grams) + self._gram_counts[token] - count)
+            if similarity >= FUZZY_THRESHOLD:
+                matches.append((token, similarity))
+        matches.sort(key=lambda match: (-match[1], match[0]))
+        matches = matches[:FUZZY_CANDIDATES]
+        self._fuzzy_cache[term] = matches
+        if len(self._fuzzy_cache) > FUZZY_CACHE_SIZE:
+            self._fuzzy_cache.popitem(last=False)
+        return matches
+
+    def search(self, query, limit=10, items_per_location=5):
+        """
+        Find the storage/shelf locations holding items that match the query.
+        Locations matching more (and closer) query terms rank first.
+        """
+        self.ensure_loaded()
+        terms = [term for term in tokenize(query) if term not in STOP_WORDS]
+        with self._lock:
+            expanded = [self.expand(term) for term in dict.fromkeys(terms)]
+            scores = Counter()
+            for matches in expanded:
+                if len(matches) == 1 and matches[0][1] == 1.0:
+                    # Exact match: add one to every location holding the token
+                    scores.update(self._postings[matches[0][0]].keys())
+                    continue
+                # Fuzzy matches come best first, so each location keeps the
+                # weight of the closest token it holds
+                best = {}
+                for token, weight in matches:
+                    best.update(dict.fromkeys(self._postings[token].keys() - best.keys(), weight))
+                for location, weight in best.items():
+                    scores[location] += weight
+
+            # Order by location first, then by score; the sort is stable so
+            # equal scores keep the location order
+            ranked = sorted(scores, key=self._sort_keys.__getitem__)
+            ranked = sorted(ranked, key=scores.__getitem__, reverse=True)[:limit]
+            term_tokens = [[token for token, _ in matches] for matches in expanded if matches]
+
+            results = []
+            for location in ranked:
+                # Rows matching every query term come first, newest first, then the rest
+                term_rows = []
+                for tokens in term_tokens:
+                    found = [self._postings[token][location] for token in tokens if location in self._postings[token]]
+                    if found:
+                        term_rows.append(found[0] if len(found) == 1 else set().union(*found))
+                if len(term_rows) == 1:
+                    matched_all = matched_any = term_rows[0]
+                else:
+                    matched_all = set.intersection(*term_rows)
+                    matched_any = set.union(*term_rows)
+                top = heapq.nlargest(items_per_location, matched_all)
+                if len(top) < items_per_location:
+                    top += heapq.nlargest(items_per_location - len(top), matched_any - matched_all)
+                items = []
+                for row_id in top:
+                    _, keywords, picture, _ = self._rows[row_id]
+                    items.append({'keywords': keywords, 'picture_url': picture})
+                results.append({
+                    'storage': location[0],
+                    'shelf': location[1],
+                    'score': round(float(scores[location]), 3),
+                    'matches': len(matched_any),
+                    'items': items,
+                })
+            return {'terms': terms, 'locations': results}
+
+
+def load_from_mirror(index, watermark):
+    """
+    Index loader reading the local inventory mirror.
+    A full load when watermark is None, otherwise only rows synced after it.
+    Returns the new watermark.
+    """
+    from django.db.models import Max
+
+    from .models import InventoryItem
+
+    items = InventoryItem.objects.all()
+    if watermark is None:
+        index.clear()
+    else:
+        items = items.filter(synced_at__gt=watermark)
+    newest = watermark
+    for item in items.iterator():
+        index.add((item.sheet, item.row_number), item.storage, item.shelf, item.keywords, item.picture)
+        if newest is None or item.synced_at > newest:
+            newest = item.synced_at
+    # Rows deleted by another process are only noticed through the count
+    if watermark is not None and InventoryItem.objects.count() != len(index):
+        return load_from_mirror(index, None)
+    if newest is None:
+        newest = InventoryItem.objects.aggregate(Max('synced_at'))['synced_at__max']
+    return newest
+
+
+inventory_index = InventoryIndex(loader=load_from_mirror)
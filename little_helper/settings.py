@@ -39,11 +39,13 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'little_helper',
 ]
 
 MIDDLEWARE = [
+    'little_helper.timing.TimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'whitenoise.middleware.WhiteNoiseMiddleware',
+    'little_helper.middleware.WhiteNoiseMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
@@ -126,6 +128,176 @@ STATIC_ROOT = BASE_DIR / 'static'
 # WhiteNoise configuration
 STATICFILES_STORAGE = 'whitenoise.storage.CompressedManifestStaticFilesStorage'
 
+# The Google SDKs and credentials are loaded on first use; with prewarm, a
+# background thread loads them right after the worker boots
+GOOGLE_CLIENTS_PREWARM = os.getenv('GOOGLE_CLIENTS_PREWARM', 'true').lower() in ('true', '1', 'yes')
+
+# Use the in-process fakes from little_helper.fakes instead of the Google
+# Speech and Sheets APIs (local development, load tests, benchmarks)
+FAKE_GOOGLE_SERVICES = os.getenv('FAKE_GOOGLE_SERVICES', 'False').lower() in ('true', '1', 'yes')
+# Seconds the fakes wait before answering each call, to simulate upstream latency
+FAKE_SPEECH_LATENCY = float(os.getenv('FAKE_SPEECH_LATENCY', '0'))
+FAKE_SHEETS_LATENCY = float(os.getenv('FAKE_SHEETS_LATENCY', '0'))
+# Share of fake recognize calls that stall for FAKE_SPEECH_STALL seconds instead
+FAKE_SPEECH_STALL_RATE = float(os.getenv('FAKE_SPEECH_STALL_RATE', '0'))
+FAKE_SPEECH_STALL = float(os.getenv('FAKE_SPEECH_STALL', '3'))
+
+# Concurrent streaming recognition sessions served over the WebSocket
+STREAMING_MAX_SESSIONS = int(os.getenv('STREAMING_MAX_SESSIONS', '16'))
+# Chunks a session buffers for Speech-to-Text before it stops reading the socket
+STREAMING_MAX_BUFFERED_CHUNKS = int(os.getenv('STREAMING_MAX_BUFFERED_CHUNKS', '32'))
+
+# Concurrent upstream calls per worker process for the async views
+ASYNC_SPEECH_CONCURRENCY = int(os.getenv('ASYNC_SPEECH_CONCURRENCY', '8'))
+ASYNC_SHEETS_CONCURRENCY = int(os.getenv('ASYNC_SHEETS_CONCURRENCY', '8'))
+ASYNC_IMGBB_CONCURRENCY = int(os.getenv('ASYNC_IMGBB_CONCURRENCY', '8'))
+ASYNC_HTTP_TIMEOUT = float(os.getenv('ASYNC_HTTP_TIMEOUT', '30'))
+
+# Requests per minute each upstream may receive from one worker process
+# (0 = unlimited, the default with the fakes); calls over the budget wait for
+# up to UPSTREAM_MAX_WAIT seconds and are then refused as overloaded
+UPSTREAM_REQUESTS_PER_MINUTE = {
+    'sheets': int(os.getenv('SHEETS_REQUESTS_PER_MINUTE', '0' if FAKE_GOOGLE_SERVICES else '60')),
+    'speech': int(os.getenv('SPEECH_REQUESTS_PER_MINUTE', '0' if FAKE_GOOGLE_SERVICES else '900')),
+    'imgbb': int(os.getenv('IMGBB_REQUESTS_PER_MINUTE', '0' if FAKE_GOOGLE_SERVICES else '120')),
+}
+# Seconds of budget that may be used in one burst
+UPSTREAM_BURST_SECONDS = float(os.getenv('UPSTREAM_BURST_SECONDS', '10'))
+UPSTREAM_MAX_WAIT = float(os.getenv('UPSTREAM_MAX_WAIT', '5'))
+# Retries of throttled (429), 5xx and connection errors, with jittered
+# exponential backoff starting at UPSTREAM_BACKOFF_BASE seconds
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', '4'))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', '0.5'))
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', '8'))
+# No retry starts later than this many seconds after the first attempt
+UPSTREAM_RETRY_DEADLINE = float(os.getenv('UPSTREAM_RETRY_DEADLINE', '30'))
+
+# A recognize call still running after the SPEECH_HEDGE_PERCENTILE latency of
+# recent calls is sent again and the first answer is used; at most
+# SPEECH_HEDGE_MAX_RATIO of calls are hedged
+SPEECH_HEDGING = os.getenv('SPEECH_HEDGING', 'True').lower() in ('true', '1', 'yes')
+SPEECH_HEDGE_PERCENTILE = float(os.getenv('SPEECH_HEDGE_PERCENTILE', '95'))
+SPEECH_HEDGE_INITIAL_DELAY = float(os.getenv('SPEECH_HEDGE_INITIAL_DELAY', '2.0'))
+SPEECH_HEDGE_MIN_DELAY = float(os.getenv('SPEECH_HEDGE_MIN_DELAY', '0.1'))
+SPEECH_HEDGE_MAX_RATIO = float(os.getenv('SPEECH_HEDGE_MAX_RATIO', '0.1'))
+# Threads for the hedges; the first attempt of every call runs on a thread of its own
+SPEECH_HEDGE_WORKERS = int(os.getenv('SPEECH_HEDGE_WORKERS', '16'))
+# Seconds before a recognize call is abandoned
+SPEECH_TIMEOUT = float(os.getenv('SPEECH_TIMEOUT', '10'))
+# After SPEECH_BREAKER_FAILURES consecutive failures, Speech calls fail fast
+# for SPEECH_BREAKER_RESET seconds before one trial call is let through
+SPEECH_BREAKER_FAILURES = int(os.getenv('SPEECH_BREAKER_FAILURES', '5'))
+SPEECH_BREAKER_RESET = float(os.getenv('SPEECH_BREAKER_RESET', '30'))
+
+# Recognition profile: 'fast' (en-US, one alternative), 'accents' (also
+# en-GB, en-AU and en-CA) or 'thorough' (those languages and 3 alternatives)
+SPEECH_PROFILE = os.getenv('SPEECH_PROFILE', 'fast')
+# Phrase hints taken from the inventory's storages, shelves and most used keywords
+SPEECH_MAX_PHRASES = int(os.getenv('SPEECH_MAX_PHRASES', '500'))
+SPEECH_PHRASE_BOOST = float(os.getenv('SPEECH_PHRASE_BOOST', '15'))
+SPEECH_COMMAND_BOOST = float(os.getenv('SPEECH_COMMAND_BOOST', '20'))
+# Seconds the RecognitionConfig is kept before checking the vocabulary for changes
+SPEECH_CONFIG_REFRESH = float(os.getenv('SPEECH_CONFIG_REFRESH', '60'))
+
+# 16-bit PCM WAV uploads are trimmed of silence and resampled to mono at
+# AUDIO_TARGET_SAMPLE_RATE before recognition (needs numpy); WebM is sent as is
+AUDIO_PREPROCESSING = os.getenv('AUDIO_PREPROCESSING', 'False').lower() in ('true', '1', 'yes')
+AUDIO_TARGET_SAMPLE_RATE = int(os.getenv('AUDIO_TARGET_SAMPLE_RATE', '16000'))
+# Frames quieter than the loudest one by AUDIO_VAD_RANGE_DB, or below
+# AUDIO_VAD_FLOOR_DB (dBFS), are silence
+AUDIO_VAD_RANGE_DB = float(os.getenv('AUDIO_VAD_RANGE_DB', '35'))
+AUDIO_VAD_FLOOR_DB = float(os.getenv('AUDIO_VAD_FLOOR_DB', '-55'))
+# Seconds of silence kept before the first and after the last word, and of each pause (0 keeps pauses)
+AUDIO_TRIM_PADDING = float(os.getenv('AUDIO_TRIM_PADDING', '0.25'))
+AUDIO_MAX_PAUSE = float(os.getenv('AUDIO_MAX_PAUSE', '1.0'))
+
+# Clips accepted by one /transcribe-batch/ request, and the threads that
+# transcribe them (shared by all requests, so Speech sees at most that many)
+TRANSCRIBE_BATCH_MAX_CLIPS = int(os.getenv('TRANSCRIBE_BATCH_MAX_CLIPS', '20'))
+TRANSCRIBE_BATCH_WORKERS = int(os.getenv('TRANSCRIBE_BATCH_WORKERS', '8'))
+
+# Write-behind mode for sheet appends: rows are queued in the local database
+# and a background flusher appends them to the sheet in batches
+SHEET_WRITE_BEHIND = os.getenv('SHEET_WRITE_BEHIND', 'False').lower() in ('true', '1', 'yes')
+SHEET_BATCH_SIZE = int(os.getenv('SHEET_BATCH_SIZE', '50'))
+SHEET_BATCH_MAX_DELAY = float(os.getenv('SHEET_BATCH_MAX_DELAY', '2.0'))
+SHEET_QUEUE_MAX_ATTEMPTS = int(os.getenv('SHEET_QUEUE_MAX_ATTEMPTS', '5'))
+# Seconds after which rows claimed by a flusher that never finished (a crashed
+# worker) are sent again; longer than an append with all its retries
+SHEET_QUEUE_CLAIM_LEASE = float(os.getenv('SHEET_QUEUE_CLAIM_LEASE', '300'))
+
+# Route the rows of each storage to a tab, or a tab of another spreadsheet,
+# instead of one tab for everything: "terrace=terrace,attic=<spreadsheet id>!attic"
+SHEET_ROUTES = os.getenv('SHEET_ROUTES', '')
+# Give every storage without a route a tab named after it
+SHEET_SHARD_BY_STORAGE = os.getenv('SHEET_SHARD_BY_STORAGE', 'False').lower() in ('true', '1', 'yes')
+# Seconds the list of tabs of a spreadsheet is cached
+SHEET_TABS_TTL = float(os.getenv('SHEET_TABS_TTL', '600'))
+# Threads reading the shards in parallel for whole-inventory operations
+SHEET_FAN_OUT_WORKERS = int(os.getenv('SHEET_FAN_OUT_WORKERS', '8'))
+
+# Rows read from the end of the sheet when the revert journal cannot answer
+REVERT_TAIL_WINDOW = int(os.getenv('REVERT_TAIL_WINDOW', '50'))
+# Most entries one revert command may clear
+REVERT_MAX_STEPS = int(os.getenv('REVERT_MAX_STEPS', '10'))
+
+# Photos are downscaled and recompressed before they are uploaded to imgbb;
+# they are only shown as a thumbnail in the picture cell
+IMAGE_PROCESSING = os.getenv('IMAGE_PROCESSING', 'true').lower() in ('true', '1', 'yes')
+IMAGE_MAX_DIMENSION = int(os.getenv('IMAGE_MAX_DIMENSION', '1024'))
+IMAGE_FORMAT = os.getenv('IMAGE_FORMAT', 'WEBP').upper()
+IMAGE_QUALITY = int(os.getenv('IMAGE_QUALITY', '80'))
+
+# Uploads larger than FILE_UPLOAD_MAX_MEMORY_SIZE are spooled to a temporary
+# file, and files larger than their field's limit are rejected while they are
+# received (see little_helper/uploads.py)
+FILE_UPLOAD_MAX_MEMORY_SIZE = int(os.getenv('UPLOAD_SPOOL_THRESHOLD', str(2621440)))
+FILE_UPLOAD_HANDLERS = [
+    'little_helper.uploads.SizeLimitUploadHandler',
+    'django.core.files.uploadhandler.MemoryFileUploadHandler',
+    'django.core.files.uploadhandler.TemporaryFileUploadHandler',
+]
+UPLOAD_FIELD_LIMITS = {
+    'audio': int(os.getenv('UPLOAD_MAX_AUDIO_BYTES', str(10 * 1024 * 1024))),
+    'image': int(os.getenv('UPLOAD_MAX_IMAGE_BYTES', str(32 * 1024 * 1024))),
+    'file': int(os.getenv('BULK_MAX_FILE_BYTES', str(20 * 1024 * 1024))),
+}
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE', '65536'))
+
+# Transcripts of recently posted clips, keyed by a hash of the audio and the
+# recognition config: 'local' (per process), 'django' (the CACHES entry named
+# by TRANSCRIPT_CACHE_ALIAS, shared between workers) or 'none'
+TRANSCRIPT_CACHE_BACKEND = os.getenv('TRANSCRIPT_CACHE_BACKEND', 'local').lower()
+TRANSCRIPT_CACHE_ALIAS = os.getenv('TRANSCRIPT_CACHE_ALIAS', 'default')
+TRANSCRIPT_CACHE_TTL = int(os.getenv('TRANSCRIPT_CACHE_TTL', '3600'))
+TRANSCRIPT_CACHE_MAX_ENTRIES = int(os.getenv('TRANSCRIPT_CACHE_MAX_ENTRIES', '1000'))
+
+# Drafts of the row being dictated, per browser session: 'local' (per
+# process) or 'django' (the CACHES entry named by DRAFT_CACHE_ALIAS, needed
+# with several workers); a draft expires DRAFT_TTL seconds after its last turn
+DRAFT_BACKEND = os.getenv('DRAFT_BACKEND', 'local').lower()
+DRAFT_CACHE_ALIAS = os.getenv('DRAFT_CACHE_ALIAS', 'default')
+DRAFT_TTL = int(os.getenv('DRAFT_TTL', '1800'))
+DRAFT_MAX_ENTRIES = int(os.getenv('DRAFT_MAX_ENTRIES', '1000'))
+
+# Send the time spent in each stage of a request in a Server-Timing header
+# (the /metrics histograms are kept either way)
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'True').lower() in ('true', '1', 'yes')
+
+# index.html is served from memory and re-read when it changes on disk
+INDEX_HTML_PATH = os.getenv('INDEX_HTML_PATH', str(BASE_DIR / 'index.html'))
+# Seconds between checks whether index.html changed
+INDEX_RELOAD_INTERVAL = float(os.getenv('INDEX_RELOAD_INTERVAL', '1'))
+# Browsers use their copy of the page for INDEX_CACHE_MAX_AGE seconds, then
+# show it while revalidating for up to INDEX_STALE_WHILE_REVALIDATE seconds
+INDEX_CACHE_MAX_AGE = int(os.getenv('INDEX_CACHE_MAX_AGE', '60'))
+INDEX_STALE_WHILE_REVALIDATE = int(os.getenv('INDEX_STALE_WHILE_REVALIDATE', '86400'))
+
+# Bulk ingestion appends at most BULK_CHUNK_ROWS rows and about
+# BULK_CHUNK_BYTES of JSON per Sheets call, well inside the API payload limit
+BULK_CHUNK_ROWS = int(os.getenv('BULK_CHUNK_ROWS', '5000'))
+BULK_CHUNK_BYTES = int(os.getenv('BULK_CHUNK_BYTES', str(2 * 1024 * 1024)))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/3.2/ref/settings/#default-auto-field
 
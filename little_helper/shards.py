@@ -0,0 +1,188 @@
+"""
+Routing of inventory rows to shards, a tab (or another spreadsheet) per storage.
+
+By default every row goes to one tab, GOOGLE_SHEET_NAME. SHEET_ROUTES sends
+the rows of a storage to a tab of its own, or to a tab of another spreadsheet:
+
+    SHEET_ROUTES="terrace=terrace, basement=basement, attic=1AbC...xyz!attic"
+
+With SHEET_SHARD_BY_STORAGE, storages without a route get a tab named after
+them in the default spreadsheet. Besides the default and the routed tabs, the
+tabs of that spreadsheet that rows were appended to (the journal) are shards;
+other tabs, like notes kept next to the inventory, are left alone. Each tab
+then only holds one location, so reads of its end stay cheap, and appends for
+different locations do not queue on the same tab.
+
+The journal and the mirror identify a shard by its tab name, so tab names
+must be unique across spreadsheets. Like Sheets, tab names are matched
+without regard to case. The tab list of each spreadsheet is cached
+for SHEET_TABS_TTL seconds, and a missing tab is created by the first append
+that needs it. Reads of the whole inventory call every shard in parallel:
+
+    router.fan_out(lambda shard: read(shard.spreadsheet_id, shard.tab))
+"""
+import collections
+import contextvars
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .upstreams import error_status
+
+Shard = collections.namedtuple('Shard', 'spreadsheet_id tab')
+
+# Characters Sheets does not accept in tab names, plus the quote of A1 ranges
+INVALID_TAB_CHARACTERS = str.maketrans({character: ' ' for character in "[]*?/\\:'"})
+
+
+def normalize_storage(storage):
+    return ' '.join((storage or '').lower().split())
+
+
+def tab_name(storage):
+    """Tab for a storage without a route when sharding by storage"""
+    return ' '.join(normalize_storage(storage).translate(INVALID_TAB_CHARACTERS).split())[:100]
+
+
+def parse_routes(value):
+    """{storage: (spreadsheet_id or None, tab)} from 'storage=tab, storage=spreadsheet_id!tab'"""
+    routes = {}
+    for item in (value or '').split(','):
+        if not item.strip():
+            continue
+        storage, _, target = item.partition('=')
+        spreadsheet_id, _, tab = target.strip().rpartition('!')
+        if not normalize_storage(storage) or not tab.strip():
+            raise ValueError(f'SHEET_ROUTES entries look like storage=tab or storage=spreadsheet_id!tab, not {item.strip()!r}')
+        routes[normalize_storage(storage)] = (spreadsheet_id or None, tab.strip())
+    return routes
+
+
+class ShardRouter:
+    """Maps storages to shards, keeps the tab lists of the spreadsheets and runs calls across shards.
+
+    `sheets` returns the Sheets service of the calling thread and `call` runs
+    an upstream call, with the signature of UpstreamScheduler.call.
+    `known_tabs` returns the tabs rows were appended to.
+    """
+
+    def __init__(self, spreadsheet_id, default_tab, routes=None, by_storage=False,
+                 sheets=None, call=None, known_tabs=None, tabs_ttl=600.0, workers=8):
+        self.default = Shard(spreadsheet_id, default_tab)
+        self.routes = {
+            storage: Shard(route_spreadsheet_id or spreadsheet_id, tab)
+            for storage, (route_spreadsheet_id, tab) in (routes or {}).items()
+        }
+        self.by_storage = by_storage
+        self.sheets = sheets
+        self.call = call
+        self.known_tabs = known_tabs
+        self.tabs_ttl = tabs_ttl
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard-fan-out')
+        self._tabs = {}
+        self.lock = threading.Lock()
+        self.create_lock = threading.Lock()
+        self._stats = {'tab_list_reads': 0, 'tabs_created': 0, 'fan_outs': 0}
+
+    def shard_for(self, storage):
+        """Shard that the rows of a storage go to"""
+        key = normalize_storage(storage)
+        shard = self.routes.get(key)
+        if shard is not None:
+            return shard
+        if self.by_storage and tab_name(key):
+            return Shard(self.default.spreadsheet_id, tab_name(key))
+        return self.default
+
+    def shard_of_tab(self, tab):
+        for shard in self.routes.values():
+            if shard.tab == tab:
+                return shard
+        return Shard(self.default.spreadsheet_id, tab)
+
+    def group(self, rows):
+        """Rows (storage first) grouped by shard, in the order the shards first appear"""
+        groups = {}
+        for row in rows:
+            groups.setdefault(self.shard_for(row[0]), []).append(row)
+        return groups
+
+    def shards(self):
+        """
+        Every shard: the default tab, the routed tabs and, when sharding by storage,
+        the tabs of the default spreadsheet that rows were appended to
+        """
+        shards = dict.fromkeys([self.default, *self.routes.values()])
+        if self.by_storage and self.known_tabs is not None:
+            titles = {title.casefold() for title in self.tab_titles(self.default.spreadsheet_id)}
+            for tab in sorted(set(self.known_tabs())):
+                if tab.casefold() in titles:
+                    shards.setdefault(self.shard_of_tab(tab))
+        return list(shards)
+
+    def tabs(self):
+        return [shard.tab for shard in self.shards()]
+
+    def tab_titles(self, spreadsheet_id, max_age=None):
+        """Titles of the tabs of a spreadsheet, read again once they are older than max_age (default tabs_ttl)"""
+        max_age = self.tabs_ttl if max_age is None else max_age
+        with self.lock:
+            cached = self._tabs.get(spreadsheet_id)
+        if cached is not None and time.monotonic() - cached[1] < max_age:
+            return cached[0]
+        service = self.sheets()
+        result = self.call('sheets', service.spreadsheets().get(
+            spreadsheetId=spreadsheet_id, fields='sheets.properties.title'
+        ).execute, stage='sheets_metadata')
+        titles = frozenset(sheet['properties']['title'] for sheet in result.get('sheets', []))
+        with self.lock:
+            self._tabs[spreadsheet_id] = (titles, time.monotonic())
+            self._stats['tab_list_reads'] += 1
+        return titles
+
+    def has_tab(self, shard, max_age=None):
+        """Whether the spreadsheet of a shard has its tab, whatever the case of the title"""
+        tab = shard.tab.casefold()
+        return any(title.casefold() == tab for title in self.tab_titles(shard.spreadsheet_id, max_age))
+
+    def ensure_tab(self, shard):
+        """Create the tab of a shard if its spreadsheet does not have it yet"""
+        if self.has_tab(shard):
+            return
+        with self.create_lock:
+            # Another thread or worker may have created it since the list was read
+            if self.has_tab(shard, max_age=1.0):
+                return
+            service = self.sheets()
+            try:
+                self.call('sheets', service.spreadsheets().batchUpdate(
+                    spreadsheetId=shard.spreadsheet_id,
+                    body={'requests': [{'addSheet': {'properties': {'title': shard.tab}}}]}
+                ).execute, stage='sheets_create_tab', idempotent=False)
+            except Exception as e:
+                # 400 "already exists" when another worker won the race
+                if error_status(e) != 400 or not self.has_tab(shard, max_age=0):
+                    raise
+                return
+            with self.lock:
+                titles, read_at = self._tabs.get(shard.spreadsheet_id, (frozenset(), time.monotonic()))
+                self._tabs[shard.spreadsheet_id] = (titles | {shard.tab}, read_at)
+                self._stats['tabs_created'] += 1
+
+    def fan_out(self, func, shards=None):
+        """{shard: func(shard)} for every shard, called in parallel; raises the first error"""
+        shards = self.shards() if shards is None else list(shards)
+        with self.lock:
+            self._stats['fan_outs'] += 1
+        if len(shards) == 1:
+            return {shards[0]: func(shards[0])}
+        # Each call runs in a copy of the caller's context, so its timing stages are reported with the request
+        futures = [
+            (shard, self.executor.submit(contextvars.copy_context().run, func, shard))
+            for shard in shards
+        ]
+        return {shard: future.result() for shard, future in futures}
+
+    def stats(self):
+        with self.lock:
+            return dict(self._stats)
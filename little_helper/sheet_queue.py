@@ -0,0 +1,198 @@
+"""
+Write-behind queue for sheet appends.
+
+Validated rows are stored in the local database and a background flusher
+appends them to the sheet in batches, either once SHEET_BATCH_SIZE rows are
+waiting or once the oldest row has waited SHEET_BATCH_MAX_DELAY seconds.
+Because the queue lives in the database, rows survive a restart and are sent
+by the next flusher that starts. Rows claimed by a flusher that died before
+recording the result are claimed again once their claim is `claim_lease`
+seconds old.
+
+Delivery is at least once: an append that reached the sheet but whose answer
+was lost (a timeout, a crash before the rows are marked sent) is sent again,
+and its rows then appear twice in the sheet.
+"""
+import atexit
+import logging
+import threading
+import time
+import uuid
+from datetime import timedelta
+
+from django.db import close_old_connections
+from django.db.models import F, Q
+from django.utils import timezone
+
+from . import timing
+from .models import QueuedRow
+from .sheets import quote_tab, row_range
+
+logger = logging.getLogger(__name__)
+
+
+class SheetWriteQueue:
+    """Durable queue of sheet rows flushed by a background thread.
+
+    `append` is called with a list of rows and must return the `updates` dict
+    of the Sheets append response. With `route`, which maps a row to its
+    shard, a batch is appended with one call per shard.
+    """
+
+    def __init__(self, append, batch_size=50, max_delay=2.0, max_attempts=5, route=None, claim_lease=300.0):
+        self.append = append
+        self.route = route
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_attempts = max_attempts
+        self.claim_lease = claim_lease
+        self._thread = None
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._failures = 0
+        self._retry_at = 0.0
+
+    def enqueue(self, storage, shelf, keywords, picture=''):
+        """Store a row for the next batch and return the QueuedRow."""
+        with timing.stage('queue'):
+            row = QueuedRow.objects.create(storage=storage, shelf=shelf, keywords=keywords, picture=picture)
+        self.start()
+        self._wakeup.set()
+        return row
+
+    def cancel_newest(self, count):
+        """
+        Delete up to `count` of the newest queued rows that were not sent yet,
+        newest first. Stops at a row that was already sent, and at one being
+        sent, which can no longer be cancelled. Returns the deleted rows and
+        whether a row being sent was in the way.
+        """
+        rows = QueuedRow.objects.filter(
+            status__in=(QueuedRow.STATUS_PENDING, QueuedRow.STATUS_SENDING, QueuedRow.STATUS_SENT)
+        ).order_by('-id')[:count]
+        cancelled = []
+        for row in rows:
+            if row.status == QueuedRow.STATUS_SENT:
+                return cancelled, False
+            # Only while still pending, so a flusher that claimed the row in the meantime wins
+            if row.status == QueuedRow.STATUS_SENDING or \
+                    not QueuedRow.objects.filter(id=row.id, status=QueuedRow.STATUS_PENDING).delete()[0]:
+                return cancelled, True
+            cancelled.append(row)
+        return cancelled, False
+
+    def start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name='sheet-write-behind', daemon=True)
+            self._thread.start()
+            atexit.register(self.stop)
+
+    def stop(self, flush=True):
+        """Stop the flusher and, by default, send everything still pending."""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._stopping.set()
+            self._wakeup.set()
+            thread.join()
+        if flush:
+            while self.flush():
+                pass
+
+    def flush(self):
+        """Append one batch of pending rows to the sheet. Returns the number of rows sent."""
+        with self._flush_lock:
+            self.reclaim_expired()
+            token = uuid.uuid4().hex
+            ids = list(
+                QueuedRow.objects.filter(status=QueuedRow.STATUS_PENDING)
+                .values_list('id', flat=True)[:self.batch_size]
+            )
+            if not ids:
+                return 0
+            # Claim the rows so another worker process cannot send them too
+            QueuedRow.objects.filter(id__in=ids, status=QueuedRow.STATUS_PENDING).update(
+                status=QueuedRow.STATUS_SENDING, batch=token, claimed_at=timezone.now()
+            )
+            rows = list(QueuedRow.objects.filter(batch=token, status=QueuedRow.STATUS_SENDING))
+            if not rows:
+                return 0
+
+            groups = {}
+            for row in rows:
+                groups.setdefault(self.route(row.values()) if self.route else None, []).append(row)
+            sent = 0
+            for group in groups.values():
+                try:
+                    updates = self.append([row.values() for row in group])
+                except Exception as e:
+                    self._record_failure(group, e)
+                    continue
+                self._failures = 0
+                self._record_sent(group, updates)
+                sent += len(group)
+            return sent
+
+    def reclaim_expired(self):
+        """Put rows whose claim is older than claim_lease back in the queue. Returns how many."""
+        expired = Q(claimed_at__lt=timezone.now() - timedelta(seconds=self.claim_lease)) | Q(claimed_at__isnull=True)
+        count = QueuedRow.objects.filter(expired, status=QueuedRow.STATUS_SENDING).update(
+            status=QueuedRow.STATUS_PENDING, batch='', claimed_at=None
+        )
+        if count:
+            logger.warning('Write-behind reclaimed %d rows left sending by a flusher that did not finish', count)
+        return count
+
+    def _record_sent(self, rows, updates):
+        sheet, first_row, _ = row_range(updates.get('updatedRange', ''))
+        now = timezone.now()
+        for offset, row in enumerate(rows):
+            row_number = first_row + offset
+            row.status = QueuedRow.STATUS_SENT
+            row.updated_range = f'{quote_tab(sheet)}!A{row_number}:D{row_number}'
+            row.sent_at = now
+            row.error = ''
+        QueuedRow.objects.bulk_update(rows, ['status', 'updated_range', 'sent_at', 'error'])
+
+    def _record_failure(self, rows, error):
+        logger.warning('Write-behind flush of %d rows failed: %s', len(rows), error)
+        ids = [row.id for row in rows]
+        QueuedRow.objects.filter(id__in=ids).update(attempts=F('attempts') + 1, error=str(error), batch='', claimed_at=None)
+        QueuedRow.objects.filter(id__in=ids, attempts__gte=self.max_attempts).update(status=QueuedRow.STATUS_FAILED)
+        QueuedRow.objects.filter(id__in=ids, status=QueuedRow.STATUS_SENDING).update(status=QueuedRow.STATUS_PENDING)
+        self._failures += 1
+        self._retry_at = time.monotonic() + self.max_delay * 2 ** min(self._failures, 6)
+
+    def _next_flush_delay(self):
+        """Seconds until the next batch is due, 0 if it is due now."""
+        retry_in = self._retry_at - time.monotonic()
+        if retry_in > 0:
+            return retry_in
+        pending = QueuedRow.objects.filter(status=QueuedRow.STATUS_PENDING)
+        oldest = pending.values_list('created_at', flat=True).first()
+        if oldest is None:
+            return self.max_delay
+        if pending.count() >= self.batch_size:
+            return 0
+        due_at = oldest + timedelta(seconds=self.max_delay)
+        return max((due_at - timezone.now()).total_seconds(), 0)
+
+    def _run(self):
+        while not self._stopping.is_set():
+            try:
+                delay = self._next_flush_delay()
+                if delay > 0:
+                    self._wakeup.wait(delay)
+                    self._wakeup.clear()
+                    continue
+                self.flush()
+            except Exception:
+                logger.exception('Write-behind flusher error')
+                self._wakeup.wait(self.max_delay)
+            finally:
+                close_old_connections()
@@ -0,0 +1,25 @@
+"""
+Helpers for working with Google Sheets A1 ranges.
+"""
+import re
+
+RANGE_RE = re.compile(r"^(?:'?(?P<sheet>.+?)'?!)?[A-Z]+(?P<first>\d+)(?::[A-Z]+(?P<last>\d+))?$")
+
+
+def row_range(a1_range):
+    """Split a range like 'common!A5:D7' into ('common', 5, 7)."""
+    match = RANGE_RE.match(a1_range or '')
+    if not match:
+        raise ValueError(f'Unsupported range: {a1_range!r}')
+    first = int(match.group('first'))
+    last = int(match.group('last') or first)
+    sheet = match.group('sheet')
+    return sheet.replace("''", "'") if sheet else sheet, first, last
+
+
+def quote_tab(tab):
+    """Tab name as written in an A1 range: quoted unless it is a plain word like 'common'."""
+    # Names that read as a cell reference, like 'A1', must be quoted too
+    if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', tab) and not re.fullmatch(r'[A-Za-z]+[0-9]+', tab):
+        return tab
+    return "'" + tab.replace("'", "''") + "'"
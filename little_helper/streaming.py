@@ -0,0 +1,197 @@
+"""
+Streaming speech recognition over a WebSocket, served by the ASGI application.
+
+The browser sends the MediaRecorder chunks as binary messages while the user
+is still talking, followed by the text message {"event": "stop"}. The chunks
+are forwarded to Speech-to-Text streaming_recognize as they arrive, and every
+interim transcript is sent back together with its parse_voice_input result:
+
+    {"type": "interim", "transcript": "...", "is_final": false, "parsed": {...}}
+
+When the stream ends the server sends one last message and closes the socket:
+
+    {"type": "final", "success": true, "transcript": "...", "parsed": {...}}
+
+A worker serves at most STREAMING_MAX_SESSIONS streams at once; a socket
+opened beyond that is closed with code 1013 (try again later), and the page
+uploads the recording instead. At most STREAMING_MAX_BUFFERED_CHUNKS chunks
+wait for Speech-to-Text; past that the socket is not read until the stream
+catches up, so a slow upstream slows the client down instead of filling
+memory. Streams go through the upstream scheduler and the Speech circuit
+breaker like every other Speech call.
+"""
+import asyncio
+import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from google.cloud import speech_v1
+
+from .upstreams import Overloaded
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of the audio in the chunk queue
+STREAM_END = None
+# Close code for a socket refused because the worker is serving all the streams it can
+CLOSE_TRY_AGAIN_LATER = 1013
+# Seconds between attempts to queue a chunk while the queue is full
+CHUNK_QUEUE_POLL = 0.02
+
+# The gRPC stream blocks a thread for the whole utterance, so sessions get
+# their own pool instead of the loop's default executor
+recognizer_pool = ThreadPoolExecutor(max_workers=settings.STREAMING_MAX_SESSIONS, thread_name_prefix='streaming-recognize')
+# Held from the connection until the recognizer thread is done
+sessions = threading.BoundedSemaphore(settings.STREAMING_MAX_SESSIONS)
+
+
+async def transcribe_stream(scope, receive, send):
+    """ASGI handler for the /ws/transcribe/ WebSocket"""
+    from . import views
+
+    message = await receive()
+    if message['type'] != 'websocket.connect':
+        return
+    await send({'type': 'websocket.accept'})
+    if not sessions.acquire(blocking=False):
+        await send({'type': 'websocket.close', 'code': CLOSE_TRY_AGAIN_LATER})
+        return
+
+    loop = asyncio.get_running_loop()
+    chunks = queue.Queue(maxsize=settings.STREAMING_MAX_BUFFERED_CHUNKS)
+    events = asyncio.Queue()
+
+    def emit(*event):
+        loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def audio_requests():
+        while True:
+            chunk = chunks.get()
+            if chunk is STREAM_END:
+                return
+            yield speech_v1.StreamingRecognizeRequest(audio_content=chunk)
+
+    def stream():
+        streaming_config = speech_v1.StreamingRecognitionConfig(
+            config=views.recognition_config(),
+            interim_results=True
+        )
+        responses = views.client_pool.speech().streaming_recognize(streaming_config, audio_requests())
+        for response in responses:
+            for result in response.results:
+                if result.alternatives:
+                    emit('result', result.alternatives[0].transcript, result.is_final)
+
+    def recognize():
+        try:
+            # The audio is consumed by the first attempt, so the stream is not retried
+            views.speech_breaker.call(views.scheduler.call, 'speech', stream, stage='speech', max_retries=0)
+        except Overloaded as e:
+            logger.warning('Streaming recognition refused: %s', e)
+            emit('error', str(e))
+        except Exception as e:
+            logger.exception('Streaming recognition failed')
+            emit('error', str(e))
+        finally:
+            sessions.release()
+            emit('done')
+
+    loop.run_in_executor(recognizer_pool, recognize)
+    receiver = asyncio.ensure_future(receive_audio(receive, chunks))
+
+    def connected():
+        return not (receiver.done() and not receiver.cancelled() and receiver.result())
+
+    final_parts = []
+    error = None
+    try:
+        while True:
+            event = await events.get()
+            if event[0] == 'done':
+                break
+            if event[0] == 'error':
+                error = event[1]
+                continue
+            _, text, is_final = event
+            if is_final:
+                final_parts.append(text.strip())
+                transcript = ' '.join(final_parts)
+            else:
+                transcript = ' '.join(final_parts + [text.strip()])
+            if not connected():
+                continue
+            await send_json(send, {
+                'type': 'interim',
+                'transcript': transcript,
+                'is_final': is_final,
+                'parsed': views.parse_voice_input(transcript)
+            })
+
+        transcript = ' '.join(final_parts)
+        if not connected():
+            return
+        if error:
+            await send_json(send, {'type': 'final', 'success': False, 'error': error})
+        elif not transcript:
+            await send_json(send, {'type': 'final', 'success': False, 'error': 'Could not transcribe audio'})
+        else:
+            await send_json(send, {
+                'type': 'final',
+                'success': True,
+                'transcript': transcript,
+                'parsed': views.parse_voice_input(transcript)
+            })
+        await send({'type': 'websocket.close', 'code': 1000})
+    finally:
+        end_stream(chunks)
+        receiver.cancel()
+
+
+async def receive_audio(receive, chunks):
+    """
+    Forward binary messages to the chunk queue until the client stops or disconnects.
+    Returns True if the client disconnected.
+    """
+    while True:
+        message = await receive()
+        if message['type'] == 'websocket.disconnect':
+            await put_chunk(chunks, STREAM_END)
+            return True
+        if message.get('bytes'):
+            await put_chunk(chunks, message['bytes'])
+        elif message.get('text'):
+            try:
+                event = json.loads(message['text']).get('event')
+            except (ValueError, AttributeError):
+                event = None
+            if event == 'stop':
+                await put_chunk(chunks, STREAM_END)
+                return False
+
+
+async def put_chunk(chunks, chunk):
+    """Queue a chunk for the recognizer, waiting while the queue is full without blocking the loop"""
+    while True:
+        try:
+            return chunks.put_nowait(chunk)
+        except queue.Full:
+            await asyncio.sleep(CHUNK_QUEUE_POLL)
+
+
+def end_stream(chunks):
+    """Mark the end of the audio at once, dropping chunks the recognizer will not read"""
+    while True:
+        try:
+            return chunks.put_nowait(STREAM_END)
+        except queue.Full:
+            try:
+                chunks.get_nowait()
+            except queue.Empty:
+                pass
+
+
+async def send_json(send, data):
+    await send({'type': 'websocket.send', 'text': json.dumps(data)})
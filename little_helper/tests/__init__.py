@@ -0,0 +1,64 @@
+"""
+Tests, run with `python manage.py test little_helper` on a throwaway database.
+
+Every test that reaches Google or imgbb goes through the in-process fakes of
+little_helper.fakes: FakeServicesMixin sets FAKE_GOOGLE_SERVICES and swaps
+the module-level singletons of the views for the length of a test.
+"""
+from functools import partial
+from unittest import mock
+
+from django.test import override_settings
+
+from little_helper import fakes, views
+from little_helper.clients import ClientPool
+from little_helper.shards import ShardRouter, parse_routes
+from little_helper.transcript_cache import LocalBackend, TranscriptCache
+from little_helper.upstreams import UpstreamScheduler
+
+# Short backoff so retries finish in milliseconds
+BACKOFF = {'backoff_base': 0.01, 'backoff_max': 0.2}
+# Tab of the rows without a route in tests using their own spreadsheet
+DEFAULT_TAB = 'test common'
+
+
+class FakeServicesMixin:
+    """Runs a TestCase against the fakes, with a transcript cache of its own"""
+
+    def setUp(self):
+        super().setUp()
+        settings_override = override_settings(FAKE_GOOGLE_SERVICES=True)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.patch_views(transcript_cache=TranscriptCache(LocalBackend()))
+
+    def patch_views(self, **singletons):
+        """Replace module-level singletons of the views until the end of the test"""
+        for name, value in singletons.items():
+            patcher = mock.patch.object(views, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def use_speech(self, speech, scheduler=None):
+        """Point the views at one fake Speech client, with an unlimited scheduler unless one is given"""
+        self.patch_views(
+            client_pool=ClientPool(None, speech_factory=lambda credentials: speech),
+            scheduler=scheduler or UpstreamScheduler({}),
+        )
+
+    def use_spreadsheet(self, spreadsheet, routes='', by_storage=True, latency=0.0):
+        """Point the views at a fake spreadsheet routed by a new ShardRouter"""
+        client_pool = ClientPool(
+            None,
+            speech_factory=fakes.FakeSpeechClient,
+            sheets_factory=partial(fakes.FakeSheetsService, spreadsheet=spreadsheet, latency=latency)
+        )
+        scheduler = UpstreamScheduler({})
+        self.patch_views(
+            client_pool=client_pool,
+            scheduler=scheduler,
+            shard_router=ShardRouter(
+                views.GOOGLE_SHEET_ID, DEFAULT_TAB, routes=parse_routes(routes), by_storage=by_storage,
+                sheets=client_pool.sheets, call=scheduler.call, known_tabs=views.journaled_tabs
+            ),
+        )
@@ -0,0 +1,114 @@
+import asyncio
+import io
+import json
+import os
+import time
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TransactionTestCase
+from django.test.client import BOUNDARY, MULTIPART_CONTENT, encode_multipart
+
+from little_helper import asgi, fakes
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+async def asgi_request(method, path, body=b'', content_type=None, timeout=10):
+    """Status, headers and body of a request served by the ASGI application"""
+    headers = [(b'host', b'testserver')]
+    if content_type:
+        headers += [(b'content-type', content_type.encode()), (b'content-length', str(len(body)).encode())]
+    communicator = ApplicationCommunicator(asgi.application, {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': method, 'scheme': 'http',
+        'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '', 'headers': headers,
+        'client': ('127.0.0.1', 50000), 'server': ('testserver', 80),
+    })
+    await communicator.send_input({'type': 'http.request', 'body': body, 'more_body': False})
+    start = await communicator.receive_output(timeout)
+    content = b''
+    while True:
+        message = await communicator.receive_output(timeout)
+        content += message.get('body', b'')
+        if not message.get('more_body'):
+            break
+    await communicator.wait(timeout)
+    return start['status'], dict(start['headers']), content
+
+
+def multipart(**data):
+    return encode_multipart(BOUNDARY, data), MULTIPART_CONTENT
+
+
+def clip(text):
+    return SimpleUploadedFile('clip.webm', text.encode(), 'audio/webm')
+
+
+def photo():
+    from PIL import Image
+    image = io.BytesIO()
+    Image.new('RGB', (32, 24), (200, 80, 120)).save(image, 'PNG')
+    return SimpleUploadedFile('photo.png', image.getvalue(), 'image/png')
+
+
+# The views run their upstream calls in other threads, hence a TransactionTestCase
+class AsyncViewsTests(FakeServicesMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(self.spreadsheet, by_storage=False)
+
+    async def transcribe(self, text):
+        body, content_type = multipart(audio=clip(text))
+        return await asgi_request('POST', '/async/transcribe/', body, content_type)
+
+    def test_transcribe(self):
+        status, _, content = async_to_sync(self.transcribe)('storage attic shelf A1')
+        self.assertEqual(status, 200)
+        self.assertEqual(json.loads(content), {'success': True, 'transcript': 'storage attic shelf A1'})
+
+        status, _, _ = async_to_sync(asgi_request)('GET', '/async/transcribe/')
+        self.assertEqual(status, 405)
+
+    def test_concurrent_requests_overlap(self, requests=8, latency=0.3):
+        self.use_speech(fakes.FakeSpeechClient(latency=latency))
+
+        async def run():
+            return await asyncio.gather(*(self.transcribe(f'storage attic shelf A{number}') for number in range(requests)))
+        started = time.perf_counter()
+        responses = async_to_sync(run)()
+        elapsed = time.perf_counter() - started
+        transcripts = sorted(json.loads(content)['transcript'] for _, _, content in responses)
+        self.assertEqual(transcripts, [f'storage attic shelf A{number}' for number in range(requests)])
+        # Served one after the other they would take requests * latency
+        self.assertLess(elapsed, 2 * latency, f'{requests} requests took {elapsed:.2f} s')
+
+    def test_upload_row_with_photo(self):
+        server = fakes.FakeImgbbServer().start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.patch_views(IMGBB_UPLOAD_URL=server.url)
+        patcher = mock.patch.dict(os.environ, {'IMGBB_API_KEY': 'test'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        body, content_type = multipart(
+            text='storage attic shelf A1 keywords box', current_state='{}', image=photo()
+        )
+        status, _, content = async_to_sync(asgi_request)('POST', '/async/upload-to-sheet/', body, content_type)
+        response = json.loads(content)
+        self.assertEqual(status, 200)
+        self.assertTrue(response['success'], response)
+        self.assertTrue(response['picture_url'].startswith('=IMAGE('), response)
+        rows = [row for row in self.spreadsheet.tabs[DEFAULT_TAB] if any(row)]
+        self.assertEqual(rows, [['attic', 'A1', 'box', response['picture_url']]])
+
+        # A preview merges without appending
+        body = json.dumps({'text': 'keywords lamp', 'current_state': {'storage': 'attic', 'shelf': 'A2'}, 'do_upload': False})
+        status, _, content = async_to_sync(asgi_request)('POST', '/async/upload-to-sheet/', body.encode(), 'application/json')
+        response = json.loads(content)
+        self.assertEqual((response['storage'], response['shelf'], response['keywords']), ('attic', 'A2', 'lamp'))
+        self.assertEqual(len([row for row in self.spreadsheet.tabs[DEFAULT_TAB] if any(row)]), 1)
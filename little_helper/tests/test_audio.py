@@ -0,0 +1,145 @@
+import io
+import time
+import wave
+from unittest import skipUnless
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+
+from little_helper import audio, fakes
+from little_helper.audio import AudioPreprocessor
+
+from . import FakeServicesMixin
+
+
+class RecordingSpeechClient(fakes.FakeSpeechClient):
+    """Fake Speech client keeping the config and audio size of every call"""
+
+    def __init__(self, credentials=None):
+        super().__init__(credentials)
+        self.requests = []
+
+    def recognize(self, config=None, audio=None, **kwargs):
+        self.requests.append(('recognize', config, len(audio.content)))
+        return super().recognize(config=config, audio=audio, **kwargs)
+
+    def streaming_recognize(self, config, requests, **kwargs):
+        requests = list(requests)
+        self.requests.append(('stream', config.config, sum(len(request.audio_content) for request in requests)))
+        return super().streaming_recognize(config, requests, **kwargs)
+
+
+def wav_bytes(samples, sample_rate):
+    """16-bit PCM WAV of float samples shaped (frames, channels)"""
+    np = audio.import_numpy()
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(samples.shape[1])
+        wav.setsampwidth(2)
+        wav.setframerate(sample_rate)
+        wav.writeframes((np.clip(samples, -1, 1) * 32767).astype('<i2').tobytes())
+    return buffer.getvalue()
+
+
+def recording(segments, sample_rate=48000, channels=2, seed=0):
+    """Samples of (seconds, speech?) segments: tone bursts for speech over quiet noise, with a different noise per seed"""
+    np = audio.import_numpy()
+    rng = np.random.default_rng(seed)
+    parts = []
+    for seconds, speech in segments:
+        times = np.arange(int(seconds * sample_rate)) / sample_rate
+        part = rng.normal(0, 3e-4, len(times))
+        if speech:
+            # A 220 Hz voice with harmonics, its loudness changing four times a second like syllables
+            voice = sum(np.sin(2 * np.pi * 220 * harmonic * times) / harmonic for harmonic in range(1, 5))
+            part += 0.2 * voice * (0.6 + 0.4 * np.sin(2 * np.pi * 4 * times))
+        parts.append(part)
+    mono = np.concatenate(parts)
+    return np.repeat(mono[:, None], channels, axis=1)
+
+
+def upload(data, name='clip.wav', content_type='audio/wav'):
+    return SimpleUploadedFile(name, data, content_type)
+
+
+def preprocessor():
+    return AudioPreprocessor(enabled=True, padding=0.25, max_pause=1.0)
+
+
+@skipUnless(audio.import_numpy(), 'numpy is not installed')
+class AudioPreprocessorTests(FakeServicesMixin, TestCase):
+
+    def use_preprocessor(self, speech):
+        """Point the views at a new preprocessor and a fake Speech client; returns the preprocessor"""
+        audio_preprocessor = preprocessor()
+        self.use_speech(speech)
+        self.patch_views(audio_preprocessor=audio_preprocessor)
+        return audio_preprocessor
+
+    def test_silence_trimmed_and_pauses_shortened(self):
+        # 1 s of silence, 2 s of speech, a 3 s pause, 1 s of speech and 1.5 s of silence
+        samples = recording([(1, False), (2, True), (3, False), (1, True), (1.5, False)])
+        audio_preprocessor = preprocessor()
+        processed = audio_preprocessor.process(upload(wav_bytes(samples, 48000)))
+        # 0.25 s before, the speech, the pause cut to 1 s, the speech and 0.25 s after
+        self.assertAlmostEqual(processed.seconds_out, 4.5, delta=0.05)
+        self.assertEqual(processed.sample_rate, 16000)
+        self.assertEqual(len(processed.audio), round(processed.seconds_out * 16000) * 2)
+        stats = audio_preprocessor.stats()
+        self.assertEqual(stats['seconds_removed'], round(processed.seconds_in - processed.seconds_out, 3))
+
+    def test_resampled_without_aliasing(self):
+        np = audio.import_numpy()
+        for sample_rate in (48000, 44100):
+            times = np.arange(sample_rate) / sample_rate
+            # 1 kHz is kept; 12 kHz is above the new Nyquist frequency and would fold down to 4 kHz
+            mono = 0.4 * np.sin(2 * np.pi * 1000 * times) + 0.4 * np.sin(2 * np.pi * 12000 * times)
+            output = audio.resample(mono, sample_rate, 16000)
+            self.assertLessEqual(abs(len(output) - 16000), 1)
+            spectrum = np.abs(np.fft.rfft(output[:16000] * np.hanning(16000)))
+            kept, folded = spectrum[1000], spectrum[3900:4100].max()
+            self.assertGreater(20 * np.log10(kept / folded), 50, f'12 kHz folded to 4 kHz at {sample_rate} Hz')
+        self.assertEqual(len(audio.resample(np.zeros(8000), 8000, 16000)), 8000, 'an 8 kHz clip was upsampled')
+
+    def test_wav_uploads_sent_as_linear16(self):
+        speech = RecordingSpeechClient()
+        audio_preprocessor = self.use_preprocessor(speech)
+        wav = wav_bytes(recording([(2, False), (1.5, True), (2, False)], sample_rate=44100, seed=1), 44100)
+        response = self.client.post('/transcribe/', {'audio': upload(wav)}).json()
+        self.client.post('/transcribe/', {'audio': upload(b'storage attic shelf A1', 'clip.webm', 'audio/webm')})
+        metrics = self.client.get('/metrics').content.decode()
+        self.assertTrue(response['success'], response)
+        (_, wav_config, sent), (_, webm_config, _) = speech.requests
+        self.assertEqual(wav_config.encoding.name, 'LINEAR16')
+        self.assertEqual(wav_config.sample_rate_hertz, 16000)
+        self.assertEqual(webm_config.encoding.name, 'WEBM_OPUS')
+        self.assertEqual(webm_config.sample_rate_hertz, 48000)
+        self.assertEqual(list(wav_config.speech_contexts), list(webm_config.speech_contexts), 'configs hint different phrases')
+        # 1.5 s of speech and 0.25 s of padding on either side, give or take a 20 ms frame
+        self.assertAlmostEqual(sent / 2 / 16000, 2.0, delta=0.03)
+        stats = audio_preprocessor.stats()
+        for line in (
+            'little_helper_audio_preprocessed_total{result="processed"} 1',
+            f'little_helper_audio_removed_seconds_total {stats["seconds_removed"]}',
+            f'little_helper_audio_removed_bytes_total {stats["bytes_removed"]}',
+        ):
+            self.assertIn(line, metrics)
+
+    def test_long_uploads_streamed_and_silent_ones_not_sent(self):
+        speech = RecordingSpeechClient()
+        audio_preprocessor = self.use_preprocessor(speech)
+        long = wav_bytes(recording([(70, True)], sample_rate=16000, channels=1, seed=2), 16000)
+        self.client.post('/transcribe/', {'audio': upload(long)})
+        silent = wav_bytes(recording([(3, False)], seed=3) * 0, 48000)
+        response = self.client.post('/transcribe/', {'audio': upload(silent)}).json()
+        self.assertEqual([call for call, *_ in speech.requests], ['stream'])
+        self.assertEqual(speech.requests[0][2], 70 * 16000 * 2)
+        self.assertFalse(response['success'], response)
+        self.assertEqual(audio_preprocessor.stats()['silent'], 1)
+
+    def test_cost_per_minute_of_audio(self, seconds=60):
+        samples = recording([(seconds / 4, True), (seconds / 4, False)] * 2, seed=4)
+        clip = upload(wav_bytes(samples, 48000))
+        started = time.perf_counter()
+        preprocessor().process(clip)
+        self.assertLess(time.perf_counter() - started, 0.5, f'to preprocess {seconds} s of audio')
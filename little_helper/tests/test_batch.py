@@ -0,0 +1,107 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+
+from little_helper import fakes
+
+from . import FakeServicesMixin
+
+
+class DelayedSpeechClient(fakes.FakeSpeechClient):
+    """Fake Speech client taking the seconds given in `delays` for a clip's text, and counting concurrent calls"""
+
+    def __init__(self, delays=None, failures=()):
+        super().__init__()
+        self.delays = delays or {}
+        self.failures = set(failures)
+        self.lock = threading.Lock()
+        self.running = 0
+        self.max_running = 0
+
+    def recognize(self, config=None, audio=None, **kwargs):
+        from google.api_core import exceptions as google_exceptions
+        text = audio.content.decode('utf-8', 'ignore').strip()
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        try:
+            time.sleep(self.delays.get(text, 0.0))
+            if text in self.failures:
+                raise google_exceptions.InvalidArgument('Bad audio (fake)')
+            return super().recognize(config=config, audio=audio, **kwargs)
+        finally:
+            with self.lock:
+                self.running -= 1
+
+
+def texts(count, storage):
+    return [f'storage {storage} shelf A{number} keywords item {number}' for number in range(count)]
+
+
+class TranscribeBatchTests(FakeServicesMixin, TestCase):
+
+    def batch(self, speech, texts, workers=8, **data):
+        """POST the texts as clips to /transcribe-batch/ against a fake Speech client; returns the JSON response"""
+        executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='test-batch')
+        self.addCleanup(executor.shutdown)
+        self.use_speech(speech)
+        self.patch_views(batch_executor=executor)
+        clips = [SimpleUploadedFile(f'clip{number}.webm', text.encode(), 'audio/webm') for number, text in enumerate(texts)]
+        return self.client.post('/transcribe-batch/', {'audio': clips, **data}).json()
+
+    def test_wall_time_close_to_the_slowest_clip(self, count=8, latency=0.3):
+        clips = texts(count, 'attic')
+        # From a tenth of the latency for the first clip up to the full latency for the last
+        delays = {text: latency * (number + 1) / count for number, text in enumerate(clips)}
+        # Not timed: the first request imports the Speech SDK and builds the config
+        self.batch(DelayedSpeechClient(), texts(1, 'warm up'))
+        started = time.perf_counter()
+        response = self.batch(DelayedSpeechClient(delays), clips)
+        elapsed = time.perf_counter() - started
+        self.assertTrue(response['success'], response)
+        self.assertEqual(response['transcribed'], count)
+        self.assertEqual([clip['transcript'] for clip in response['clips']], clips, 'transcripts out of order')
+        self.assertLess(elapsed, latency * 1.5, f'clips taking {latency}s at most and {sum(delays.values()):.2f}s together')
+
+    def test_results_and_errors_in_input_order(self):
+        clips = texts(4, 'cellar')
+        clips[2] = ''
+        # The first clip is the slowest, so it finishes last
+        speech = DelayedSpeechClient({clips[0]: 0.2}, failures=[clips[3]])
+        with override_settings(UPLOAD_FIELD_LIMITS={**settings.UPLOAD_FIELD_LIMITS, 'audio': 200}):
+            response = self.batch(speech, clips[:1] + ['x' * 300] + clips[1:])
+        results = response['clips']
+        self.assertEqual([clip['index'] for clip in results], list(range(5)))
+        self.assertEqual(results[0]['transcript'], clips[0])
+        self.assertIn('larger than the limit', results[1]['error'])
+        self.assertEqual(results[2]['transcript'], clips[1])
+        self.assertEqual(results[3]['error'], 'Could not transcribe audio')
+        self.assertIn('Bad audio', results[4]['error'])
+        self.assertEqual((response['transcribed'], response['failed']), (2, 3))
+
+    def test_transcripts_parsed_on_request(self):
+        clips = texts(2, 'garage') + ['shelf B2 keywords lamp']
+        parsed = [clip['parsed'] for clip in self.batch(DelayedSpeechClient(), clips, parse='true')['clips']]
+        self.assertEqual((parsed[0]['storage'], parsed[0]['shelf']), ('garage', 'A0'))
+        self.assertIn('error', parsed[2])
+        unparsed = self.batch(DelayedSpeechClient(), clips[:1])
+        self.assertNotIn('parsed', unparsed['clips'][0])
+
+    def test_pool_bounds_concurrent_calls(self, workers=3, count=12):
+        clips = texts(count, 'loft')
+        speech = DelayedSpeechClient({text: 0.05 for text in clips})
+        response = self.batch(speech, clips, workers=workers)
+        self.assertEqual(response['transcribed'], count)
+        self.assertEqual(speech.max_running, workers)
+
+    def test_batch_size_limit(self):
+        limit = settings.TRANSCRIBE_BATCH_MAX_CLIPS
+        speech = DelayedSpeechClient()
+        response = self.batch(speech, texts(limit + 1, 'shed'))
+        self.assertFalse(response['success'], response)
+        self.assertEqual(speech.calls, 0)
+        self.assertEqual(self.client.post('/transcribe-batch/', {}).json()['error'], 'No audio file provided')
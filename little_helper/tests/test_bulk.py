@@ -0,0 +1,160 @@
+import io
+import json
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from little_helper import bulk, fakes
+from little_helper.bulk import BulkInputError, entries_from_file, entries_from_transcripts, ingest
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+def entries(content, file_format):
+    return entries_from_file(io.BytesIO(content.encode()), file_format)
+
+
+def validated(content, file_format):
+    """(appended rows, (line, error) of the invalid entries) of a file"""
+    rows = []
+    result = ingest(entries(content, file_format), lambda chunk: rows.extend(chunk) or {})
+    return rows, [(error['line'], error['error']) for error in result['errors']]
+
+
+class EntriesTests(SimpleTestCase):
+
+    def test_csv_with_field_columns(self):
+        rows, errors = validated(
+            'Storage,Shelf,Keywords,Picture\n'
+            'attic,A1,box,\n'
+            '\n'
+            'garage,,drill,\n'
+            'cellar,Z,wine,https://example.com/wine.jpg\n'
+            'shed,b2,rake,\n',
+            'csv'
+        )
+        self.assertEqual(rows, [['attic', 'A1', 'box', ''], ['shed', 'b2', 'rake', '']])
+        self.assertEqual([line for line, _ in errors], [4, 5])
+        self.assertIn('Missing values for: shelf.', errors[0][1])
+        self.assertIn('Invalid shelf format: "Z"', errors[1][1])
+
+    def test_csv_with_a_text_column_or_no_header(self):
+        rows, errors = validated('transcript\nstorage attic shelf A1 keywords box\nstorage attic\n', 'csv')
+        self.assertEqual(rows, [['attic', 'A1', 'box', '']])
+        self.assertEqual([line for line, _ in errors], [3])
+
+        rows, errors = validated('storage attic shelf A1 keywords box\nattic,A2,lamp\n', 'csv')
+        self.assertEqual(rows, [['attic', 'A1', 'box', ''], ['attic', 'A2', 'lamp', '']])
+        self.assertEqual(errors, [])
+
+    def test_jsonl(self):
+        rows, errors = validated(
+            '"storage attic shelf A1 keywords box"\n'
+            '{"storage": "attic", "shelf": "A2", "keywords": "lamp"}\n'
+            '{"text": "storage attic shelf A3 keywords"}\n'
+            '{not json\n'
+            '42\n'
+            '\n'
+            '{"text": ""}\n',
+            'jsonl'
+        )
+        self.assertEqual(rows, [['attic', 'A1', 'box', ''], ['attic', 'A2', 'lamp', '']])
+        self.assertEqual([line for line, _ in errors], [3, 4, 5, 7])
+        self.assertTrue(errors[1][1].startswith('Invalid JSON'), errors)
+        self.assertEqual(errors[2][1], 'Expected a JSON string or object')
+        self.assertEqual(errors[3][1], 'Missing text')
+
+    def test_text_lines(self):
+        rows, errors = validated('storage attic shelf A1 keywords box\n\n  storage attic shelf A2 keywords lamp  \n', 'text')
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(errors, [])
+
+    def test_unreadable_input_is_refused(self):
+        with self.assertRaises(BulkInputError):
+            entries_from_file(io.BytesIO(b'storage \xff\xfe attic'), 'csv')
+        with self.assertRaises(BulkInputError):
+            entries('', 'xlsx')
+        with self.assertRaises(BulkInputError):
+            entries_from_transcripts('storage attic shelf A1 keywords box')
+
+    def test_format_from_name(self):
+        self.assertEqual(
+            [bulk.format_from_name(name) for name in ('rows.JSONL', 'rows.ndjson', 'notes.txt', 'rows.csv', None)],
+            ['jsonl', 'jsonl', 'text', 'csv', 'csv']
+        )
+
+
+class IngestTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def append(self, rows):
+        self.calls.append(len(rows))
+        return {'updatedRange': f'common!A1:D{len(rows)}'}
+
+    def transcripts(self, count):
+        return entries_from_transcripts([f'storage attic shelf A{number} keywords item {number}' for number in range(count)])
+
+    def test_rows_are_appended_in_chunks(self):
+        result = ingest(self.transcripts(25), self.append, chunk_rows=10)
+        self.assertEqual(self.calls, [10, 10, 5])
+        self.assertEqual((result['appended'], result['sheets_calls'], result['not_appended']), (25, 3, 0))
+
+        self.calls.clear()
+        row_bytes = len(json.dumps(['attic', 'A10', 'item 10', ''])) + 1
+        ingest(self.transcripts(25), self.append, chunk_rows=100, chunk_bytes=4 * row_bytes)
+        self.assertEqual(sum(self.calls), 25)
+        self.assertLessEqual(max(self.calls), 4)
+
+    def test_dry_run_only_validates(self):
+        result = ingest(self.transcripts(3) + [(4, {'text': 'shelf A1'})], self.append, dry_run=True)
+        self.assertEqual(self.calls, [])
+        self.assertEqual((result['received'], result['valid'], result['invalid'], result['appended']), (4, 3, 1, 0))
+
+    def test_failed_append_stops_the_ingestion(self):
+        def append(rows):
+            if self.calls:
+                raise ConnectionError('connection reset')
+            return self.append(rows)
+        result = ingest(self.transcripts(25), append, chunk_rows=10)
+        self.assertEqual((result['appended'], result['not_appended'], result['sheets_calls']), (10, 15, 1))
+        self.assertEqual(result['append_error'], 'connection reset')
+
+
+class BulkUploadViewTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(self.spreadsheet, by_storage=False)
+
+    def appends(self):
+        return [call[2] for call in self.spreadsheet.calls if call[0] == 'append']
+
+    @override_settings(BULK_CHUNK_ROWS=4)
+    def test_csv_file(self):
+        lines = ['storage,shelf,keywords'] + [f'test attic,A{number},item {number}' for number in range(10)]
+        lines.insert(3, 'test attic,,no shelf')
+        upload = SimpleUploadedFile('rows.csv', '\n'.join(lines).encode(), 'text/csv')
+        result = self.client.post('/bulk-upload/', {'file': upload}).json()
+        self.assertTrue(result['success'], result)
+        self.assertEqual((result['valid'], result['invalid'], result['appended']), (10, 1, 10))
+        self.assertEqual(result['errors'][0]['line'], 4)
+        self.assertEqual(self.appends(), [4, 4, 2])
+        self.assertEqual(len([row for row in self.spreadsheet.tabs[DEFAULT_TAB] if any(row)]), 10)
+
+    def test_jsonl_dry_run(self):
+        upload = SimpleUploadedFile('rows.txt', b'"storage test attic shelf A1 keywords box"\n{"text": "storage"}\n')
+        result = self.client.post('/bulk-upload/', {'file': upload, 'format': 'jsonl', 'dry_run': 'true'}).json()
+        self.assertEqual((result['valid'], result['invalid'], result['appended']), (1, 1, 0))
+        self.assertEqual(self.appends(), [])
+
+    def test_bad_requests(self):
+        result = self.client.post('/bulk-upload/', json.dumps({'transcripts': []}), content_type='application/json').json()
+        self.assertEqual(result, {'success': False, 'error': 'No rows provided'})
+        result = self.client.post('/bulk-upload/', {'format': 'csv'}).json()
+        self.assertEqual(result, {'success': False, 'error': 'No file provided'})
+        upload = SimpleUploadedFile('rows.csv', b'\xff\xfe\x00a')
+        result = self.client.post('/bulk-upload/', {'file': upload}).json()
+        self.assertEqual(result, {'success': False, 'error': 'The file is not UTF-8 text'})
@@ -0,0 +1,202 @@
+import os
+import subprocess
+import sys
+import threading
+from datetime import datetime, timedelta
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from little_helper import fakes, views
+from little_helper.clients import ClientPool
+from little_helper.upstreams import UpstreamScheduler
+
+from . import FakeServicesMixin
+
+
+class FakeCredentials:
+    """Access token that expires after lifetime seconds, counting its refreshes"""
+
+    def __init__(self, lifetime=3600):
+        self.lifetime = lifetime
+        self.token = None
+        self.expiry = None
+        self.refreshes = 0
+
+    def refresh(self, request):
+        self.refreshes += 1
+        self.token = f'token-{self.refreshes}'
+        self.expiry = datetime.utcnow() + timedelta(seconds=self.lifetime)
+
+
+class ClientPoolTests(SimpleTestCase):
+
+    def setUp(self):
+        self.built = []
+        self.credentials = FakeCredentials()
+        self.pool = ClientPool(
+            self.credentials,
+            speech_factory=lambda credentials: self.build('speech', credentials),
+            sheets_factory=lambda credentials: self.build('sheets', credentials),
+            refresh_request=object,
+            refresh_margin=60
+        )
+
+    def build(self, kind, credentials):
+        self.assertIs(credentials, self.credentials)
+        client = (kind, len(self.built))
+        self.built.append(client)
+        return client
+
+    def test_clients_are_built_once_and_reused(self):
+        speech = self.pool.speech()
+        sheets = self.pool.sheets()
+        for _ in range(5):
+            self.assertIs(self.pool.speech(), speech)
+            self.assertIs(self.pool.sheets(), sheets)
+        self.assertEqual(self.built, [('speech', 0), ('sheets', 1)])
+        self.assertEqual(self.pool.stats(), {
+            'speech': {'hits': 5, 'misses': 1},
+            'sheets': {'hits': 5, 'misses': 1},
+            'credential_refreshes': 1,
+        })
+
+    def test_speech_is_shared_and_sheets_is_per_thread(self):
+        main_speech, main_sheets = self.pool.speech(), self.pool.sheets()
+        seen = {}
+
+        def worker(name):
+            seen[name] = (self.pool.speech(), self.pool.sheets(), self.pool.sheets())
+
+        threads = [threading.Thread(target=worker, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for speech, sheets, sheets_again in seen.values():
+            self.assertIs(speech, main_speech)
+            self.assertIsNot(sheets, main_sheets)
+            self.assertIs(sheets_again, sheets)
+        self.assertIsNot(seen['a'][1], seen['b'][1])
+        self.assertEqual(self.pool.stats()['speech']['misses'], 1)
+        self.assertEqual(self.pool.stats()['sheets']['misses'], 3)
+
+    def test_token_is_refreshed_only_near_expiry(self):
+        self.pool.speech()
+        self.pool.sheets()
+        self.assertEqual(self.credentials.refreshes, 1)
+        # Expires within the margin: the next request refreshes it
+        self.credentials.expiry = datetime.utcnow() + timedelta(seconds=30)
+        self.pool.speech()
+        self.pool.speech()
+        self.assertEqual(self.credentials.refreshes, 2)
+        self.assertEqual(self.pool.stats()['credential_refreshes'], 2)
+        # Refreshing does not rebuild the clients
+        self.assertEqual(len(self.built), 2)
+
+    def test_warm_builds_the_clients_ahead_of_requests(self):
+        self.pool.warm()
+        self.assertEqual(self.built, [('speech', 0), ('sheets', 1)])
+        self.pool.speech()
+        self.pool.sheets()
+        self.assertEqual(len(self.built), 2)
+        self.assertEqual(self.pool.stats()['speech'], {'hits': 1, 'misses': 1})
+
+
+class LazyLoadingTests(SimpleTestCase):
+
+    def test_credentials_are_loaded_once_by_the_first_client(self):
+        loads = []
+
+        def loader():
+            loads.append(threading.current_thread().name)
+            return FakeCredentials()
+        pool = ClientPool(
+            credentials_loader=loader,
+            speech_factory=lambda credentials: object(),
+            sheets_factory=lambda credentials: object(),
+            refresh_request=object
+        )
+        self.assertEqual(loads, [], 'loaded before a client was needed')
+        threads = [threading.Thread(target=pool.sheets) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        pool.speech()
+        self.assertEqual(len(loads), 1)
+        self.assertIsInstance(pool.credentials, FakeCredentials)
+        self.assertEqual(pool.stats()['credential_refreshes'], 1)
+
+    def test_views_import_without_the_google_sdks(self):
+        script = (
+            'import sys, django; django.setup(); import little_helper.views, little_helper.urls; '
+            'print(" ".join(sorted(m for m in sys.modules if m.startswith(("google.", "googleapiclient")))))'
+        )
+        env = dict(
+            os.environ,
+            DJANGO_SETTINGS_MODULE='little_helper.settings',
+            FAKE_GOOGLE_SERVICES='false',
+            SHEET_WRITE_BEHIND='false',
+            DEBUG='false',
+        )
+        result = subprocess.run(
+            [sys.executable, '-c', script], cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+        )
+        self.assertEqual(result.returncode, 0, result.stderr[-2000:])
+        loaded = result.stdout.split()
+        for module in ('google.cloud.speech_v1', 'google.oauth2.service_account', 'google.auth.transport.requests', 'googleapiclient.discovery'):
+            self.assertNotIn(module, loaded)
+
+
+class PrewarmTests(SimpleTestCase):
+
+    def test_warm_in_background_builds_the_clients(self):
+        pool = ClientPool(None, speech_factory=lambda credentials: object(), sheets_factory=lambda credentials: object())
+        pool.warm_in_background().join(5)
+        self.assertEqual(pool.stats()['speech'], {'hits': 0, 'misses': 1})
+        self.assertEqual(pool.stats()['sheets'], {'hits': 0, 'misses': 1})
+        pool.speech()
+        self.assertEqual(pool.stats()['speech'], {'hits': 1, 'misses': 1}, 'the prewarmed Speech client was not reused')
+
+    def test_failed_warm_up_is_logged_not_raised(self):
+        def loader():
+            raise FileNotFoundError('credentials.json')
+        pool = ClientPool(credentials_loader=loader)
+        with self.assertLogs('little_helper.clients', 'ERROR') as logs:
+            pool.warm_in_background().join(5)
+        self.assertIn('Failed to warm Google client pool', logs.output[0])
+
+    def test_prewarm_needs_credentials(self):
+        pool = ClientPool(None, speech_factory=fakes.FakeSpeechClient, sheets_factory=fakes.FakeSheetsService)
+        with mock.patch.object(views, 'client_pool', pool):
+            with override_settings(FAKE_GOOGLE_SERVICES=False), \
+                    mock.patch.object(views, 'GOOGLE_CREDENTIALS_JSON', None), \
+                    mock.patch.object(views, 'CREDENTIALS_PATH', os.path.join(settings.BASE_DIR, 'missing.json')):
+                self.assertIsNone(views.prewarm_in_background())
+            self.assertEqual(pool.stats()['speech']['misses'], 0)
+            with override_settings(FAKE_GOOGLE_SERVICES=True):
+                views.prewarm_in_background().join(5)
+        self.assertEqual(pool.stats()['speech']['misses'], 1)
+        self.assertEqual(pool.stats()['sheets']['misses'], 1)
+
+
+class ClientPoolViewTests(FakeServicesMixin, TestCase):
+
+    def test_requests_reuse_the_pooled_speech_client(self):
+        built = []
+
+        def speech_factory(credentials):
+            built.append(fakes.FakeSpeechClient())
+            return built[-1]
+        self.patch_views(client_pool=ClientPool(None, speech_factory=speech_factory), scheduler=UpstreamScheduler({}))
+        for shelf in ('A1', 'A2', 'A3'):
+            clip = SimpleUploadedFile('clip.webm', f'storage attic shelf {shelf}'.encode(), 'audio/webm')
+            response = self.client.post('/transcribe/', {'audio': clip}).json()
+            self.assertEqual(response['transcript'], f'storage attic shelf {shelf}')
+        self.assertEqual(len(built), 1)
+        self.assertEqual(built[0].calls, 3)
+        stats = self.client.get('/client-pool/').json()
+        self.assertEqual(stats['speech'], {'hits': 2, 'misses': 1})
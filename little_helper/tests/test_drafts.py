@@ -0,0 +1,97 @@
+import json
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import Client, SimpleTestCase, TestCase
+
+from little_helper import drafts, fakes, transcript_cache, views
+from little_helper.transcript_cache import LocalBackend
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+class MergeFieldsTests(SimpleTestCase):
+
+    def test_partial_transcripts_fill_the_draft(self):
+        draft = drafts.empty_draft()
+        for text in ('Storage garage.', 'shelf B3', 'keywords drill and bits'):
+            draft = views.merge_fields(text, draft)
+        self.assertEqual((draft['storage'], draft['shelf'], draft['keywords']), ('garage', 'B3', 'drill and bits'))
+        self.assertEqual(draft['parsed_text'], 'Storage garage. Shelf B3. Keywords drill and bits')
+
+    def test_fields_not_spoken_are_kept(self):
+        current = {'storage': 'garage', 'shelf': 'B3', 'keywords': 'drill'}
+        merged = views.merge_fields('keywords saw', current)
+        self.assertEqual((merged['storage'], merged['shelf'], merged['keywords']), ('garage', 'B3', 'saw'))
+        merged = views.merge_fields('something unrelated', current)
+        self.assertEqual((merged['storage'], merged['shelf'], merged['keywords']), ('garage', 'B3', 'drill'))
+
+    def test_matches_are_used_but_not_reported_without_debug(self):
+        with mock.patch.object(views, 'DEBUG', False):
+            merged = views.merge_fields('storage attic shelf', drafts.empty_draft())
+        self.assertEqual(merged['storage'], 'attic')
+        self.assertEqual(merged['debug_matches'], {})
+        with mock.patch.object(views, 'DEBUG', True):
+            merged = views.merge_fields('storage attic shelf', drafts.empty_draft())
+        self.assertEqual(merged['debug_matches']['storage'], 'attic')
+
+
+class TranscribeAndMergeTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(self.spreadsheet, by_storage=False)
+        self.patch_views(draft_store=drafts.DraftStore(LocalBackend(ttl=60)))
+
+    def say(self, text, client=None, **data):
+        clip = SimpleUploadedFile('clip.webm', text.encode(), 'audio/webm')
+        return (client or self.client).post('/transcribe-and-merge/', {'audio': clip, **data}).json()
+
+    def draft(self, client=None):
+        response = (client or self.client).get('/transcribe-and-merge/').json()
+        return response['storage'], response['shelf'], response['keywords']
+
+    def test_turns_are_merged_into_the_session_draft(self):
+        self.assertEqual(self.say('storage test attic')['storage'], 'test attic')
+        response = self.say('shelf A1')
+        self.assertEqual((response['transcript'], response['storage'], response['shelf']), ('shelf A1', 'test attic', 'A1'))
+        # Text turns merge into the same draft
+        response = self.client.post('/transcribe-and-merge/', json.dumps({'text': 'keywords box'}),
+                                    content_type='application/json').json()
+        self.assertEqual((response['storage'], response['shelf'], response['keywords']), ('test attic', 'A1', 'box'))
+        self.assertEqual(self.draft(), ('test attic', 'A1', 'box'))
+
+        # Another browser has a draft of its own
+        other = Client()
+        self.assertEqual(self.draft(other), ('', '', ''))
+        self.say('storage test cellar', client=other)
+        self.assertEqual(self.draft(), ('test attic', 'A1', 'box'))
+
+        self.say('shelf B2', reset='true')
+        self.assertEqual(self.draft(), ('', 'B2', ''))
+
+    def test_upload_clears_the_draft(self):
+        self.say('storage test attic shelf A1 keywords box')
+        response = self.client.post('/upload-to-sheet/', json.dumps({
+            'text': 'keywords box', 'current_state': {'storage': 'test attic', 'shelf': 'A1'}
+        }), content_type='application/json').json()
+        self.assertTrue(response['success'], response)
+        self.assertEqual(self.draft(), ('', '', ''))
+
+    def test_draft_expires(self):
+        clock = [1000.0]
+        with mock.patch.object(transcript_cache.time, 'monotonic', lambda: clock[0]):
+            self.say('storage test attic')
+            clock[0] += 59
+            self.assertEqual(self.draft()[0], 'test attic')
+            clock[0] += 60
+            self.assertEqual(self.draft(), ('', '', ''))
+
+    def test_spoken_revert_reverts_the_last_row(self):
+        self.client.post('/upload-to-sheet/', json.dumps({
+            'text': 'storage test attic shelf A1 keywords box', 'current_state': {}
+        }), content_type='application/json')
+        response = self.say('revert')
+        self.assertTrue(response['success'], response)
+        self.assertFalse(any(any(row) for row in self.spreadsheet.tabs[DEFAULT_TAB]))
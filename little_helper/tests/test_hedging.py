@@ -0,0 +1,122 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase
+
+from little_helper import fakes, views
+from little_helper.hedging import Hedger
+from little_helper.upstreams import CircuitBreaker, CircuitOpen, UpstreamScheduler
+
+from . import FakeServicesMixin
+
+
+def percentile(timings, p):
+    timings = sorted(timings)
+    return timings[min(int(len(timings) * p / 100), len(timings) - 1)]
+
+
+def recognize(client):
+    from google.cloud import speech_v1
+    audio = speech_v1.RecognitionAudio(content=b'storage attic shelf A1 keywords box')
+    return lambda: client.recognize(config=None, audio=audio)
+
+
+def run(hedger, client, calls, threads=4):
+    """Latencies in ms of concurrent recognize calls"""
+    def timed(i):
+        started = time.perf_counter()
+        hedger.call(recognize(client))
+        return (time.perf_counter() - started) * 1000
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(timed, range(calls)))
+
+
+class HedgerTests(TestCase):
+
+    def test_hedging_cuts_the_p99(self, calls=300, base=0.01, stall=0.5, stall_rate=0.03):
+        client = fakes.FakeSpeechClient(latency=fakes.FakeLatency(base, stall, stall_rate, seed=7))
+        plain = run(Hedger(enabled=False), client, calls)
+        # Before min_samples latencies are known, stalled calls are hedged after initial_delay:
+        # well under stall / 2, or a few early stalls put the p99 right at the bound
+        hedger = Hedger(min_samples=20, initial_delay=stall / 5, max_ratio=0.2)
+        hedged = run(hedger, client, calls)
+        self.assertLess(percentile(hedged, 99), percentile(plain, 99) / 2)
+        self.assertGreater(hedger.stats()['hedge_won'], 0)
+
+    def test_hedges_stay_within_budget(self):
+        # Everything is slow, so every call passes the deadline
+        hedger = Hedger(min_samples=1000, initial_delay=0.005, max_ratio=0.1, window=100)
+        run(hedger, fakes.FakeSpeechClient(latency=0.02), 200)
+        self.assertLessEqual(hedger.stats()['hedge_rate'], 0.12)
+
+    def test_calls_beyond_the_workers_do_not_queue(self, workers=2, calls=8, latency=0.2):
+        # Each call takes 0.2 s, under the 0.3 s deadline, unless it waited for a worker
+        hedger = Hedger(min_samples=1000, initial_delay=0.3, max_ratio=1.0, workers=workers)
+        started = time.perf_counter()
+        run(hedger, fakes.FakeSpeechClient(latency=latency), calls, threads=calls)
+        elapsed = time.perf_counter() - started
+        self.assertEqual(hedger.stats()['hedged'], 0)
+        self.assertLess(elapsed, latency * 2, f'{calls} calls with {workers} workers')
+
+
+class CircuitBreakerTests(FakeServicesMixin, TestCase):
+
+    def test_breaker_opens_fails_fast_and_recovers(self):
+        from google.api_core import exceptions as google_exceptions
+        client = fakes.FakeSpeechClient()
+        breaker = CircuitBreaker('speech', failure_threshold=3, reset_timeout=0.2)
+        client.failure = google_exceptions.ServiceUnavailable('down (fake)')
+        for i in range(3):
+            with self.assertRaises(google_exceptions.ServiceUnavailable):
+                breaker.call(recognize(client))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        calls = client.calls
+        with self.assertRaises(CircuitOpen):
+            breaker.call(recognize(client))
+        self.assertEqual(client.calls, calls, 'the open breaker called the upstream')
+
+        # After the reset timeout one trial goes through; a failure opens the circuit again
+        time.sleep(0.25)
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            breaker.call(recognize(client))
+        self.assertEqual(breaker.state, CircuitBreaker.OPEN)
+
+        client.failure = None
+        time.sleep(0.25)
+        breaker.call(recognize(client))
+        self.assertEqual(breaker.state, CircuitBreaker.CLOSED)
+
+    def test_timed_out_attempts_are_not_retried(self):
+        from google.api_core import exceptions as google_exceptions
+        speech = fakes.FakeSpeechClient(latency=1.0)
+        breaker = CircuitBreaker('speech', failure_threshold=5, reset_timeout=30)
+        self.use_speech(speech, UpstreamScheduler({}, backoff_base=0.01))
+        self.patch_views(
+            speech_breaker=breaker,
+            speech_hedger=Hedger(min_samples=1000, initial_delay=0.05, max_ratio=1.0),
+        )
+        started = time.perf_counter()
+        with self.settings(SPEECH_TIMEOUT=0.2):
+            with self.assertRaises(google_exceptions.DeadlineExceeded):
+                views.recognize_audio(b'storage attic shelf A1')
+        elapsed = time.perf_counter() - started
+        # The first attempt and its hedge, each given up after SPEECH_TIMEOUT
+        self.assertEqual(speech.calls, 2)
+        self.assertLess(elapsed, 0.5)
+        self.assertEqual(breaker.stats()['consecutive_failures'], 2)
+
+    def test_transcribe_answers_503_while_open(self):
+        from google.api_core import exceptions as google_exceptions
+        speech = fakes.FakeSpeechClient()
+        speech.failure = google_exceptions.ServiceUnavailable('down (fake)')
+        self.use_speech(speech, UpstreamScheduler({}, max_retries=0))
+        self.patch_views(speech_breaker=CircuitBreaker('speech', failure_threshold=2, reset_timeout=30))
+        for i in range(3):
+            clip = SimpleUploadedFile('clip.webm', f'storage attic shelf A{i}'.encode(), 'audio/webm')
+            response = self.client.post('/transcribe/', {'audio': clip})
+        self.assertEqual(response.status_code, 503, response.content)
+        self.assertIn('unavailable', response.json()['error'])
+        self.assertTrue(response['Retry-After'])
@@ -0,0 +1,120 @@
+import io
+import os
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from little_helper import fakes, images, views
+from little_helper.models import UploadedImage
+
+from . import FakeServicesMixin
+
+# EXIF tags
+ORIENTATION = 0x0112
+MAKE = 0x010F
+
+
+def photo(size, format='JPEG', orientation=None, color=(200, 80, 120)):
+    """Noisy photo of the given size, with a camera make and the orientation in its EXIF if one is given"""
+    from PIL import Image
+    picture = Image.effect_noise(size, 64).convert('RGB')
+    picture.paste(color, (0, 0, size[0] // 2, size[1] // 2))
+    exif = Image.Exif()
+    if orientation is not None:
+        exif[MAKE] = 'Test camera'
+        exif[ORIENTATION] = orientation
+    output = io.BytesIO()
+    picture.save(output, format, exif=exif.tobytes())
+    return output.getvalue()
+
+
+def opened(data):
+    from PIL import Image
+    return Image.open(io.BytesIO(data))
+
+
+@override_settings(IMAGE_PROCESSING=True, IMAGE_MAX_DIMENSION=64, IMAGE_FORMAT='WEBP', IMAGE_QUALITY=80)
+class ProcessTests(SimpleTestCase):
+
+    def test_large_photo_is_turned_upright_downscaled_and_stripped(self):
+        original = photo((320, 160), orientation=6)
+        image = images.PreparedImage(original)
+        images.process(image)
+        # Orientation 6 is a photo taken with the camera turned 90 degrees
+        self.assertEqual(image.size, [32, 64])
+        self.assertEqual(image.format, 'WEBP')
+        processed = opened(image.data)
+        self.assertEqual((processed.format, processed.size), ('WEBP', (32, 64)))
+        self.assertFalse(processed.getexif(), 'the metadata was uploaded')
+        self.assertLess(image.uploaded_bytes(), len(original))
+        report = image.report()
+        self.assertEqual(report['bytes_saved'], len(original) - len(image.data))
+        self.assertLessEqual({'decode', 'orient', 'resize', 'encode'}, set(report['timings_ms']))
+
+    @override_settings(IMAGE_FORMAT='JPEG')
+    def test_output_format_follows_the_settings(self):
+        image = images.PreparedImage(photo((128, 128), format='PNG'))
+        images.process(image)
+        self.assertEqual(opened(image.data).format, 'JPEG')
+
+    def test_small_photo_that_would_grow_is_kept(self):
+        from PIL import Image
+        output = io.BytesIO()
+        Image.effect_noise((32, 32), 64).save(output, 'JPEG', quality=10)
+        image = images.PreparedImage(output.getvalue())
+        images.process(image)
+        self.assertIsNone(image.data)
+        upload = image.upload_file()
+        upload.seek(0)
+        self.assertEqual(upload.read(), output.getvalue())
+
+    def test_unreadable_file_is_uploaded_as_it_is(self):
+        image = images.PreparedImage(b'not an image')
+        with self.assertLogs('little_helper.images', 'WARNING'):
+            images.process(image)
+        self.assertIsNone(image.data)
+
+    @override_settings(IMAGE_PROCESSING=False)
+    def test_processing_can_be_turned_off(self):
+        image = images.PreparedImage(photo((320, 160)))
+        images.process(image)
+        self.assertIsNone(image.data)
+
+
+@override_settings(IMAGE_PROCESSING=True, IMAGE_MAX_DIMENSION=64)
+class UploadReuseTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.server = fakes.FakeImgbbServer().start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(self.server.shutdown)
+        self.patch_views(IMGBB_UPLOAD_URL=self.server.url)
+        patcher = mock.patch.dict(os.environ, {'IMGBB_API_KEY': 'test'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, data):
+        return views.upload_image(SimpleUploadedFile('photo.jpg', data, 'image/jpeg'))
+
+    def test_same_photo_is_uploaded_once(self):
+        original = photo((320, 160), orientation=6)
+        formula, first = self.upload(original)
+        self.assertTrue(formula.startswith('=IMAGE('), formula)
+        self.assertFalse(first['cached'])
+        self.assertGreater(first['uploaded_bytes'], 0)
+
+        again, second = self.upload(original)
+        self.assertEqual(again, formula)
+        self.assertTrue(second['cached'])
+        self.assertEqual((second['uploaded_bytes'], second['bytes_saved']), (0, len(original)))
+        self.assertEqual(self.server.uploads, 1)
+
+        stored = UploadedImage.objects.get()
+        self.assertEqual((stored.original_bytes, stored.stored_bytes), (len(original), first['uploaded_bytes']))
+
+        # A different photo is uploaded
+        self.upload(photo((320, 160), color=(20, 200, 40)))
+        self.assertEqual(self.server.uploads, 2)
+        self.assertEqual(UploadedImage.objects.count(), 2)
@@ -0,0 +1,97 @@
+import gzip
+import os
+import tempfile
+
+from django.conf import settings
+from django.test import RequestFactory, SimpleTestCase
+
+from little_helper import index_page
+from little_helper.index_page import CachedPage, accepted_encodings, page_response
+
+PAGE = b'<!DOCTYPE html><html><body>' + b'<p>Storage, shelf and keywords</p>' * 200 + b'</body></html>'
+
+
+class IndexPageTests(SimpleTestCase):
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'index.html')
+        self.write(PAGE)
+        self.page = CachedPage(self.path, reload_interval=0)
+
+    def write(self, body, mtime=1_700_000_000):
+        with open(self.path, 'wb') as file:
+            file.write(body)
+        os.utime(self.path, (mtime, mtime))
+
+    def get(self, accept_encoding=None, **headers):
+        if accept_encoding is not None:
+            headers['HTTP_ACCEPT_ENCODING'] = accept_encoding
+        return page_response(RequestFactory().get('/', **headers), self.page)
+
+    def test_accepted_encodings(self):
+        self.assertEqual(accepted_encodings('gzip, deflate, br'), {'gzip', 'deflate', 'br'})
+        self.assertEqual(accepted_encodings('br;q=0, GZIP;q=0.5'), {'gzip'})
+        self.assertEqual(accepted_encodings(''), set())
+
+    def test_encoding_negotiation(self):
+        identity = self.get()
+        self.assertNotIn('Content-Encoding', identity)
+        self.assertEqual(identity.content, PAGE)
+        self.assertEqual(identity['Vary'], 'Accept-Encoding')
+        self.assertEqual(identity['Content-Length'], str(len(PAGE)))
+
+        compressed = self.get('gzip, deflate')
+        self.assertEqual(compressed['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(compressed.content), PAGE)
+        self.assertLess(len(compressed.content), len(PAGE))
+
+        self.assertNotIn('Content-Encoding', self.get('gzip;q=0'))
+        self.assertNotEqual(compressed['ETag'], identity['ETag'])
+        self.assertEqual(
+            identity['Cache-Control'],
+            f'public, max-age={settings.INDEX_CACHE_MAX_AGE}, stale-while-revalidate={settings.INDEX_STALE_WHILE_REVALIDATE}'
+        )
+
+    def test_brotli_is_preferred(self):
+        if index_page.brotli is None:
+            self.skipTest('Brotli is not installed')
+        response = self.get('gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'br')
+        self.assertEqual(index_page.brotli.decompress(response.content), PAGE)
+        self.assertEqual(self.get('*')['Content-Encoding'], 'br')
+        self.assertEqual(self.get('br;q=0, gzip')['Content-Encoding'], 'gzip')
+
+    def test_current_copy_is_not_sent_again(self):
+        first = self.get('gzip')
+        not_modified = self.get('gzip', HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.content, b'')
+        self.assertEqual(not_modified['ETag'], first['ETag'])
+
+        # The ETag of another encoding does not match
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=first['ETag']).status_code, 200)
+        since = self.get(HTTP_IF_MODIFIED_SINCE=first['Last-Modified'])
+        self.assertEqual(since.status_code, 304)
+
+    def test_changed_file_is_reloaded(self):
+        before = self.get('gzip')
+        changed = PAGE.replace(b'keywords', b'pictures')
+        self.write(changed, mtime=1_700_000_100)
+        after = self.get('gzip', HTTP_IF_NONE_MATCH=before['ETag'])
+        self.assertEqual(after.status_code, 200)
+        self.assertEqual(gzip.decompress(after.content), changed)
+        self.assertNotEqual(after['ETag'], before['ETag'])
+
+    def test_small_page_is_sent_uncompressed(self):
+        self.write(b'<p>hi</p>')
+        self.assertNotIn('Content-Encoding', self.get('gzip, br'))
+
+    def test_index_view(self):
+        response = self.client.get('/', HTTP_ACCEPT_ENCODING='gzip')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        with open(settings.INDEX_HTML_PATH, 'rb') as file:
+            self.assertEqual(gzip.decompress(response.content), file.read())
+        self.assertEqual(self.client.get('/', HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
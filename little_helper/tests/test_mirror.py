@@ -0,0 +1,49 @@
+from django.test import TestCase
+
+from little_helper import fakes, mirror
+from little_helper.models import InventoryItem
+
+TAB = 'test mirror'
+
+
+class MirrorSyncTests(TestCase):
+
+    def setUp(self):
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[TAB])
+        self.service = fakes.FakeSheetsService(spreadsheet=self.spreadsheet)
+        self.sheet = self.spreadsheet.tabs[TAB]
+        self.sheet.extend(['attic', f'A{row}', f'item {row}', ''] for row in range(1, 31))
+        self.sync()
+
+    def sync(self, full=False):
+        return mirror.sync(self.service, 'test', TAB, full=full)
+
+    def mirrored(self):
+        return {item.row_number: item.values() for item in InventoryItem.objects.filter(sheet=TAB)}
+
+    def test_rows_appended_to_the_end(self):
+        self.sheet.extend([['cellar', 'B1', 'wine', ''], ['cellar', 'B2', 'cheese', '']])
+        stats = self.sync()
+        self.assertEqual((stats['rows_stored'], stats['rows_changed'], stats['rows_removed']), (32, 2, 0))
+        self.assertEqual(self.mirrored()[32], ['cellar', 'B2', 'cheese', ''])
+
+    def test_rows_edited_or_cleared_in_the_middle(self):
+        untouched = InventoryItem.objects.get(sheet=TAB, row_number=20).synced_at
+        self.sheet[2] = ['attic', 'A3', 'ukulele', '']
+        self.sheet[4] = ['', '', '', '']
+        stats = self.sync()
+        self.assertEqual((stats['rows_changed'], stats['rows_removed']), (1, 1))
+        rows = self.mirrored()
+        self.assertEqual(rows[3], ['attic', 'A3', 'ukulele', ''])
+        self.assertNotIn(5, rows)
+        self.assertEqual(len(rows), 29)
+        self.assertEqual(InventoryItem.objects.get(sheet=TAB, row_number=20).synced_at, untouched)
+        locations = mirror.inventory_index.search('ukulele')['locations']
+        self.assertEqual([(location['shelf'], location['items'][0]['keywords']) for location in locations],
+                         [('A3', 'ukulele')])
+
+    def test_unchanged_sheet_writes_nothing(self):
+        stats = self.sync()
+        self.assertEqual((stats['rows_read'], stats['rows_changed'], stats['rows_removed']), (30, 0, 0))
+        self.assertEqual(self.sync(full=True)['rows_changed'], 30)
+        self.assertEqual(len(self.mirrored()), 30)
@@ -0,0 +1,47 @@
+import random
+
+from django.test import SimpleTestCase
+
+from little_helper.management.commands.bench_parser import FUZZ_PIECES, regex_parse_voice_input
+from little_helper.parser import parse_many, parse_voice_input
+
+
+class ParserTests(SimpleTestCase):
+
+    def assertSameParse(self, text, debug=False):
+        expected = regex_parse_voice_input(text, debug)
+        actual = parse_voice_input(text, debug)
+        # The key order shows in the JSON responses
+        self.assertEqual(list(actual.items()), list(expected.items()), repr(text))
+        return actual
+
+    def test_random_inputs_parse_like_the_regex_parser(self):
+        rng = random.Random(7)
+        texts = [''.join(rng.choice(FUZZ_PIECES) for _ in range(rng.randint(0, 12))) for _ in range(5000)]
+        for text in texts:
+            for debug in (False, True):
+                self.assertSameParse(text, debug)
+        self.assertEqual(parse_many(texts, True), [regex_parse_voice_input(text, True) for text in texts])
+
+    def test_complete_row(self):
+        parsed = self.assertSameParse('Storage small house. Shelf B5. Keywords teddy bear, cables')
+        self.assertEqual(
+            (parsed['storage'], parsed['shelf'], parsed['keywords']), ('small house', 'B5', 'teddy bear')
+        )
+
+    def test_empty_and_partial_text(self):
+        self.assertEqual(self.assertSameParse('')['error'], 'Missing values for: storage, shelf, keywords.')
+        self.assertEqual(self.assertSameParse('storage attic shelf A1')['error'], 'Missing values for: keywords.')
+        self.assertIn('Invalid shelf format: "top"', self.assertSameParse('storage attic shelf top keywords box')['error'])
+
+    def test_repeated_fields_take_the_first(self):
+        parsed = self.assertSameParse('keywords box storage attic shelf A1 keywords lamp keyword drill')
+        self.assertEqual(parsed['keywords'], 'box')
+        self.assertSameParse('storage storage shelf A1 keywords box')
+
+    def test_debug_matches(self):
+        parsed = self.assertSameParse('storage attic, shelf A1. keywords box', debug=True)
+        self.assertEqual(parsed['debug_matches']['storage_match'], 'storage attic')
+        self.assertEqual(parsed['debug_matches']['shelf_match'], 'shelf A1')
+        self.assertEqual(parsed['debug_matches']['keyword_match'], 'keywords box')
+        self.assertIsNone(self.assertSameParse('shelf A1', debug=True)['debug_matches']['storage_match'])
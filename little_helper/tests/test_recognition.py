@@ -0,0 +1,89 @@
+import time
+
+from django.test import SimpleTestCase
+
+from little_helper.recognition import RecognitionConfigs
+from little_helper.search import InventoryIndex
+
+
+def hints(config):
+    return [phrase for context in config.speech_contexts for phrase in context.phrases]
+
+
+def configs(index, **kwargs):
+    return RecognitionConfigs(index.vocabulary, lambda: index.vocabulary_version, **{'refresh_interval': 0, **kwargs})
+
+
+class RecognitionConfigsTests(SimpleTestCase):
+
+    def test_command_and_default_hints_are_separate(self):
+        phrases = hints(configs(InventoryIndex()).config())
+        # The old hard-coded list had "attic" "box" without a comma, which Python joined into "atticbox"
+        self.assertIn('attic', phrases)
+        self.assertIn('box', phrases)
+        self.assertFalse(any('atticbox' in phrase for phrase in phrases), phrases)
+        self.assertEqual(len(phrases), len(set(phrase.lower() for phrase in phrases)), 'duplicate hints')
+
+    def test_hints_come_from_the_inventory(self):
+        index = InventoryIndex()
+        index.add(('test', 1), 'garden shed', 'E7', 'zither and harmonium')
+        index.add(('test', 2), 'garden shed', 'E8', 'zither case')
+        phrases = hints(configs(index).config())
+        for phrase in ('garden shed', 'E7', 'E8', 'zither', 'harmonium'):
+            self.assertIn(phrase, phrases)
+
+        # Only the most used keywords fit within max_phrases
+        many = InventoryIndex()
+        for row in range(300):
+            many.add(('test', row), 'attic', 'A1', f'common{row % 3} rare{row}')
+        limited = configs(many, max_phrases=60).config().speech_contexts[-1].phrases
+        self.assertEqual(len(limited), 60)
+        self.assertLessEqual({'common0', 'common1', 'common2'}, set(limited))
+
+    def test_cached_until_the_vocabulary_changes(self):
+        index = InventoryIndex()
+        index.add(('test', 1), 'attic', 'A1', 'box')
+        cached = configs(index)
+        first = cached.config()
+        self.assertIs(cached.config(), first, 'rebuilt without a change')
+        index.add(('test', 2), 'attic', 'A1', 'box')
+        self.assertIs(cached.config(), first, 'rebuilt for a row with known words')
+        index.add(('test', 3), 'attic', 'A1', 'ukulele')
+        second = cached.config()
+        self.assertIsNot(second, first)
+        self.assertIn('ukulele', hints(second))
+        index.remove(('test', 3))
+        self.assertNotIn('ukulele', hints(cached.config()), 'removed word still hinted')
+
+        slow = configs(index, refresh_interval=60)
+        before = slow.config()
+        index.add(('test', 4), 'attic', 'A1', 'mandolin')
+        self.assertIs(slow.config(), before, 'rebuilt before refresh_interval')
+
+    def test_profiles_trade_languages_for_latency(self):
+        index = InventoryIndex()
+        fast = configs(index, profile='fast').config()
+        thorough = configs(index, profile='thorough').config()
+        self.assertEqual(fast.max_alternatives, 1)
+        self.assertFalse(fast.alternative_language_codes)
+        self.assertEqual(thorough.max_alternatives, 3)
+        self.assertEqual(len(thorough.alternative_language_codes), 3)
+        with self.assertRaises(ValueError):
+            configs(index, profile='unknown')
+
+    def test_cached_config_is_cheaper_per_request(self, calls=200):
+        index = InventoryIndex()
+        for row in range(1000):
+            index.add(('test', row), f'storage {row % 10}', f'A{row % 40}', f'item{row % 400} box')
+        cached = configs(index, refresh_interval=60)
+        cached.config()
+        rebuilt = configs(index)
+
+        def per_call(func):
+            started = time.perf_counter()
+            for _ in range(calls):
+                func()
+            return (time.perf_counter() - started) / calls
+
+        rebuild, hit = per_call(lambda: rebuilt.build(rebuilt.phrases())), per_call(cached.config)
+        self.assertLess(hit * 10, rebuild, f'{hit * 1e6:.1f} us cached, {rebuild * 1e6:.1f} us rebuilt')
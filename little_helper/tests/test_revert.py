@@ -0,0 +1,87 @@
+import json
+
+from asgiref.sync import async_to_sync
+from django.test import AsyncClient, TestCase
+
+from little_helper import fakes
+from little_helper.models import AppendedRow, QueuedRow
+from little_helper.sheet_queue import SheetWriteQueue
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+class RevertTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(self.spreadsheet, by_storage=False)
+
+    def post(self, text, **data):
+        return self.client.post('/upload-to-sheet/', json.dumps({
+            'text': text, 'current_state': {}, **data
+        }), content_type='application/json')
+
+    def rows(self):
+        return [row for row in self.spreadsheet.tabs[DEFAULT_TAB] if any(row)]
+
+    def test_revert_clears_the_journaled_rows(self):
+        self.post('storage attic shelf A1 keywords box')
+        self.post('storage attic shelf A2 keywords lamp')
+        response = self.post('revert two').json()
+        self.assertTrue(response['success'], response)
+        self.assertEqual(response['reverted_rows'], [2, 1])
+        self.assertEqual(self.rows(), [])
+
+    def test_rows_changed_in_the_sheet_are_not_cleared(self):
+        self.post('storage attic shelf A1 keywords box')
+        self.post('storage attic shelf A2 keywords lamp')
+        # Someone sorted the sheet, so row 2 now holds the first entry
+        tab = self.spreadsheet.tabs[DEFAULT_TAB]
+        tab[0], tab[1] = tab[1], tab[0]
+        response = self.post('revert')
+        self.assertEqual(response.status_code, 409, response.content)
+        self.assertEqual(response.json()['changed_rows'], ["'test common'!A2:D2"])
+        self.assertEqual(len(self.rows()), 2, 'a changed row was cleared')
+
+        # The next revert reads the end of the sheet instead of trusting the journal
+        response = self.post('revert').json()
+        self.assertTrue(response['success'], response)
+        self.assertEqual(self.rows(), [['attic', 'A2', 'lamp', '']])
+        self.assertFalse(AppendedRow.objects.filter(row_number=2, reverted=False).exists())
+
+    def test_steps_are_limited(self):
+        self.post('storage attic shelf A1 keywords box')
+        for text, steps in (('revert', 11), ('revert', 'all'), ('revert 50', None)):
+            response = self.post(text, steps=steps)
+            self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(len(self.rows()), 1)
+        self.assertNotIn('get', [call[0] for call in self.spreadsheet.calls], 'the tab was read')
+
+    def test_steps_are_limited_on_the_async_view(self):
+        self.post('storage attic shelf A1 keywords box')
+        response = async_to_sync(AsyncClient().post)('/async/upload-to-sheet/', json.dumps({
+            'text': 'revert', 'current_state': {}, 'steps': 11
+        }), content_type='application/json')
+        self.assertEqual(response.status_code, 400, response.content)
+        self.assertEqual(len(self.rows()), 1)
+
+    def test_queued_rows_are_cancelled_first(self):
+        # The queue is not started: the rows wait as if the flusher had not got to them yet
+        self.patch_views(sheet_queue=SheetWriteQueue(lambda values: None))
+        self.post('storage attic shelf A1 keywords box')
+        queued = [QueuedRow.objects.create(storage='attic', shelf=f'B{number}', keywords='lamp') for number in range(2)]
+        response = self.post('revert three').json()
+        self.assertTrue(response['success'], response)
+        self.assertEqual(response['cancelled_rows'], [queued[1].id, queued[0].id])
+        self.assertEqual(response['reverted_rows'], [1])
+        self.assertFalse(QueuedRow.objects.exists())
+        self.assertEqual(self.rows(), [])
+
+    def test_row_being_sent_is_not_reverted(self):
+        self.patch_views(sheet_queue=SheetWriteQueue(lambda values: None))
+        self.post('storage attic shelf A1 keywords box')
+        QueuedRow.objects.create(storage='attic', shelf='B1', keywords='lamp', status=QueuedRow.STATUS_SENDING)
+        response = self.post('revert')
+        self.assertEqual(response.status_code, 409, response.content)
+        self.assertEqual(len(self.rows()), 1)
@@ -0,0 +1,146 @@
+import json
+from unittest import mock
+
+from django.test import SimpleTestCase, TestCase
+
+from little_helper import fakes, mirror, search
+from little_helper.search import InventoryIndex
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+def locations(result):
+    return [(location['storage'], location['shelf']) for location in result['locations']]
+
+
+class InventoryIndexTests(SimpleTestCase):
+
+    def setUp(self):
+        self.index = InventoryIndex()
+        for key, (storage, shelf, keywords) in enumerate((
+            ('garage', 'B2', 'extension cable reel'),
+            ('attic', 'A1', 'hdmi cable'),
+            ('garage', 'B2', 'hdmi adapter'),
+            ('cellar', 'C1', 'cable ties'),
+            ('attic', 'A2', 'boxes of batteries'),
+        )):
+            self.index.add(('test', key), storage, shelf, keywords)
+
+    def test_locations_matching_more_terms_rank_first(self):
+        result = self.index.search('where is the hdmi cable')
+        self.assertEqual(result['terms'], ['hdmi', 'cable'])
+        # Equal scores are ordered by storage and shelf
+        self.assertEqual(locations(result), [('attic', 'A1'), ('garage', 'B2'), ('cellar', 'C1')])
+        self.assertEqual([location['score'] for location in result['locations']], [2.0, 2.0, 1.0])
+        garage = result['locations'][1]
+        self.assertEqual(garage['matches'], 2)
+        # Newest matching row first
+        self.assertEqual([item['keywords'] for item in garage['items']], ['hdmi adapter', 'extension cable reel'])
+        self.assertEqual(locations(self.index.search('cable', limit=1)), [('attic', 'A1')])
+
+    def test_rows_matching_every_term_come_first(self):
+        self.index.add(('test', 10), 'garage', 'B2', 'hdmi cable')
+        self.index.add(('test', 11), 'garage', 'B2', 'usb cable')
+        items = self.index.search('hdmi cable')['locations'][0]['items']
+        self.assertEqual(items[0]['keywords'], 'hdmi cable')
+
+    def test_plurals_and_stop_words(self):
+        self.assertEqual(locations(self.index.search('where are my box')), [('attic', 'A2')])
+        self.assertEqual(locations(self.index.search('battery')), [('attic', 'A2')])
+        self.assertEqual(self.index.search('where is the')['locations'], [])
+
+    def test_misheard_words_match_by_trigrams(self):
+        fuzzy = self.index.search('cabels')
+        self.assertEqual(len(fuzzy['locations']), 3)
+        self.assertTrue(all(0 < location['score'] < 1 for location in fuzzy['locations']), fuzzy)
+        self.assertEqual([token for token, _ in self.index.expand('hdmy')], ['hdmi'])
+        self.assertEqual(self.index.search('xylophone')['locations'], [])
+        # An exact match outweighs a close one
+        self.index.add(('test', 10), 'shed', 'D1', 'cabel')
+        self.assertEqual(self.index.expand('cabel'), [('cabel', 1.0)])
+
+    def test_rows_are_updated_in_place(self):
+        version = self.index.vocabulary_version
+        self.index.add(('test', 3), 'cellar', 'C1', 'zip ties')
+        self.assertEqual(locations(self.index.search('zip')), [('cellar', 'C1')])
+        self.assertEqual(locations(self.index.search('cable')), [('attic', 'A1'), ('garage', 'B2')])
+        self.assertGreater(self.index.vocabulary_version, version)
+
+        self.index.remove(('test', 1))
+        self.assertEqual(locations(self.index.search('hdmi')), [('garage', 'B2')])
+        self.assertNotIn('A1', self.index.vocabulary()['shelves'])
+        self.index.remove(('test', 2))
+        self.assertEqual(self.index.search('hdmi')['locations'], [])
+        self.assertEqual(self.index.expand('hdmy'), [], 'a removed token is still matched')
+        self.assertEqual(len(self.index), 3)
+
+
+class SearchUpdateTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(self.spreadsheet, by_storage=False)
+        index = InventoryIndex()
+        self.patch_views(inventory_index=index)
+        patcher = mock.patch.object(mirror, 'inventory_index', index)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def upload(self, text):
+        response = self.client.post('/upload-to-sheet/', json.dumps({
+            'text': text, 'current_state': {}
+        }), content_type='application/json').json()
+        self.assertTrue(response['success'], response)
+
+    def search(self, query):
+        return locations(self.client.get('/search/', {'q': query}).json())
+
+    def test_index_follows_appends_and_reverts(self):
+        self.upload('storage test attic shelf A1 keywords hdmi cable')
+        self.upload('storage test garage shelf B2 keywords cable reel')
+        self.assertEqual(self.search('cable'), [('test attic', 'A1'), ('test garage', 'B2')])
+        self.upload('revert')
+        self.assertEqual(self.search('cable'), [('test attic', 'A1')])
+        self.assertEqual(self.search('reel'), [])
+        self.upload('storage test cellar shelf C1 keywords reel')
+        self.assertEqual(self.search('reel'), [('test cellar', 'C1')])
+
+
+class SearchViewTests(FakeServicesMixin, SimpleTestCase):
+
+    def setUp(self):
+        super().setUp()
+        index = InventoryIndex()
+        for row in range(150):
+            index.add(('test', row), 'attic', f'A{row}', 'box')
+        self.patch_views(inventory_index=index)
+
+    def search(self, limit):
+        return self.client.get('/search/', {'q': 'box', 'limit': limit})
+
+    def test_limit_is_clamped(self):
+        for limit, locations in (('0', 1), ('-5', 1), ('3', 3), ('1000', 100)):
+            response = self.search(limit)
+            self.assertEqual(response.status_code, 200, response.content)
+            self.assertEqual(len(response.json()['locations']), locations, limit)
+
+    def test_bad_limit_is_rejected(self):
+        for limit in ('ten', '', '2.5'):
+            response = self.search(limit)
+            self.assertEqual(response.status_code, 400, limit)
+            self.assertFalse(response.json()['success'])
+
+
+class FuzzyCacheTests(SimpleTestCase):
+
+    def test_cache_keeps_the_recently_used_terms(self):
+        index = InventoryIndex()
+        index.add(('test', 1), 'attic', 'A1', 'cable')
+        with mock.patch.object(search, 'FUZZY_CACHE_SIZE', 3):
+            index.search('cabel')
+            for term in ('cabl', 'kable', 'cabble'):
+                index.search(term)
+                index.search('cabel')
+            self.assertEqual(list(index._fuzzy_cache), ['kable', 'cabble', 'cabel'])
+        self.assertEqual(index.search('cabel')['locations'][0]['shelf'], 'A1')
@@ -0,0 +1,119 @@
+import json
+import time
+from functools import partial
+
+from django.test import TransactionTestCase
+
+from little_helper import fakes, mirror, views
+from little_helper.shards import ShardRouter
+from little_helper.upstreams import UpstreamScheduler
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+# The fan-out stores rows from the threads of the mirror, hence a TransactionTestCase
+class ShardTests(FakeServicesMixin, TransactionTestCase):
+
+    def upload(self, text):
+        response = self.client.post('/upload-to-sheet/', json.dumps({
+            'text': text, 'current_state': {}, 'upload': True
+        }), content_type='application/json').json()
+        self.assertTrue(response['success'], response)
+        return response
+
+    def test_rows_go_to_the_tab_of_their_storage(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB], strict_tabs=True)
+        self.use_spreadsheet(spreadsheet, routes='test terrace=test routed')
+        for text in (
+            'storage test terrace shelf A1 keywords box',
+            'storage test attic shelf B2 keywords lamp',
+            'storage test attic shelf B3 keywords drill',
+            'storage test terrace shelf A2 keywords chair',
+        ):
+            self.upload(text)
+        tabs = {tab: len([row for row in rows if any(row)]) for tab, rows in spreadsheet.tabs.items()}
+        self.assertEqual(tabs, {DEFAULT_TAB: 0, 'test routed': 2, 'test attic': 2})
+        created = [call for call in spreadsheet.calls if call[0] == 'addSheet']
+        stats = views.shard_router.stats()
+        self.assertEqual(len(created), 2)
+        self.assertEqual(stats['tabs_created'], 2)
+        self.assertEqual(stats['tab_list_reads'], 1)
+
+    def test_revert_clears_rows_across_shards(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB], strict_tabs=True)
+        self.use_spreadsheet(spreadsheet)
+        self.upload('storage test shed shelf C1 keywords rake')
+        self.upload('storage test cellar shelf D1 keywords wine')
+        self.upload('revert')
+        self.upload('revert')
+        cleared = [call[1] for call in spreadsheet.calls if call[0] == 'batchClear']
+        self.assertEqual(cleared, [("'test cellar'!A1:D1",), ("'test shed'!A1:D1",)])
+        self.assertFalse(any(any(row) for rows in spreadsheet.tabs.values() for row in rows), spreadsheet.tabs)
+
+    def test_bulk_upload_appends_once_per_shard(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB])
+        self.use_spreadsheet(spreadsheet, by_storage=False, routes='test garage=test garage, test loft=test loft')
+        transcripts = [
+            f'storage {storage} shelf A{number} keywords item {number}'
+            for number, storage in enumerate(['test garage', 'test loft', 'test porch'] * 10)
+        ]
+        result = self.client.post('/bulk-upload/', json.dumps({'transcripts': transcripts}),
+                                  content_type='application/json').json()
+        self.assertTrue(result['success'], result)
+        self.assertEqual(result['appended'], 30)
+        self.assertEqual(result['sheets_calls'], 3)
+        tabs = {tab: len(rows) for tab, rows in spreadsheet.tabs.items() if rows}
+        self.assertEqual(tabs, {'test garage': 10, 'test loft': 10, DEFAULT_TAB: 10})
+
+    def test_tab_created_by_another_worker(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB], strict_tabs=True)
+        service = partial(fakes.FakeSheetsService, spreadsheet=spreadsheet)
+        scheduler = UpstreamScheduler({})
+        first, second = (
+            ShardRouter('test', DEFAULT_TAB, by_storage=True, sheets=service, call=scheduler.call)
+            for worker in range(2)
+        )
+        # The second worker read the tab list before the first created the tab
+        second.tab_titles('test')
+        shard = first.shard_for('test basement')
+        first.ensure_tab(shard)
+        second.ensure_tab(shard)
+        created = [call for call in spreadsheet.calls if call[0] == 'addSheet']
+        self.assertEqual(len(created), 2)
+        self.assertEqual(second.stats()['tabs_created'], 0)
+        self.assertIn(shard.tab, second.tab_titles('test'))
+
+    def test_only_tabs_of_the_app_are_shards(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB, 'test notes', 'loadtest'])
+        self.use_spreadsheet(spreadsheet, routes='test terrace=test routed')
+        self.upload('storage test attic shelf A1 keywords box')
+        self.assertEqual(views.shard_router.tabs(), [DEFAULT_TAB, 'test routed', 'test attic'])
+
+    def test_tab_names_ignore_case(self):
+        spreadsheet = fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB, 'Test Attic'], strict_tabs=True)
+        self.use_spreadsheet(spreadsheet)
+        self.upload('storage test attic shelf A1 keywords box')
+        self.assertEqual(spreadsheet.tabs['Test Attic'], [['test attic', 'A1', 'box', '']])
+        self.assertNotIn('addSheet', [call[0] for call in spreadsheet.calls])
+        self.assertEqual(views.shard_router.tabs(), [DEFAULT_TAB, 'test attic'])
+
+        # Created by someone else after the tab list was read: Sheets refuses a title that differs only in case
+        spreadsheet.tabs['Test Cellar'] = []
+        shard = views.shard_router.shard_for('test cellar')
+        views.shard_router.ensure_tab(shard)
+        self.assertEqual([call for call in spreadsheet.calls if call[0] == 'addSheet'], [('addSheet', 'test cellar')])
+        self.assertEqual(views.shard_router.stats()['tabs_created'], 0)
+
+    def test_fan_out_reads_shards_in_parallel(self, count=6, latency=0.1):
+        spreadsheet = fakes.FakeSpreadsheet()
+        routes = ','.join(f'test fan {number}=test fan {number}' for number in range(count))
+        for number in range(count):
+            spreadsheet.rows(f'test fan {number}').extend([f'test fan {number}', 'A1', f'item {row}', ''] for row in range(20))
+        self.use_spreadsheet(spreadsheet, routes=routes, by_storage=False, latency=latency)
+        shards = [shard for shard in views.shard_router.shards() if shard.tab != DEFAULT_TAB]
+        started = time.perf_counter()
+        results = mirror.sync_shards(views.shard_router, full=True)
+        elapsed = time.perf_counter() - started
+        self.assertEqual(len(shards), count)
+        self.assertEqual(sum(stats['rows_stored'] for stats in results.values()), 20 * count, results)
+        self.assertLess(elapsed, latency * count / 2, f'{count + 1} shards at {latency}s per read')
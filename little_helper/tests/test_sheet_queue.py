@@ -0,0 +1,53 @@
+from datetime import timedelta
+
+from django.test import TestCase
+from django.utils import timezone
+
+from little_helper.models import QueuedRow
+from little_helper.sheet_queue import SheetWriteQueue
+
+
+class SheetWriteQueueTests(TestCase):
+
+    def setUp(self):
+        self.appended = []
+        # Not started: the tests flush by hand
+        self.queue = SheetWriteQueue(self.append, claim_lease=60)
+
+    def append(self, values):
+        self.appended.extend(values)
+        first = len(self.appended) - len(values) + 1
+        return {'updatedRange': f'common!A{first}:D{len(self.appended)}'}
+
+    def queued(self, shelf, claimed_seconds_ago=None):
+        row = QueuedRow.objects.create(storage='attic', shelf=shelf, keywords='box')
+        if claimed_seconds_ago is not None:
+            QueuedRow.objects.filter(id=row.id).update(
+                status=QueuedRow.STATUS_SENDING, batch='crashed',
+                claimed_at=timezone.now() - timedelta(seconds=claimed_seconds_ago)
+            )
+        return row
+
+    def test_rows_left_sending_are_sent_after_the_lease(self):
+        stuck = self.queued('A1', claimed_seconds_ago=120)
+        in_flight = self.queued('A2', claimed_seconds_ago=5)
+        self.assertEqual(self.queue.flush(), 1)
+        self.assertEqual(self.appended, [['attic', 'A1', 'box', '']])
+        stuck.refresh_from_db()
+        in_flight.refresh_from_db()
+        self.assertEqual(stuck.status, QueuedRow.STATUS_SENT)
+        self.assertEqual(stuck.updated_range, 'common!A1:D1')
+        self.assertEqual(in_flight.status, QueuedRow.STATUS_SENDING, 'a live claim was taken over')
+
+    def test_failed_append_is_retried_from_pending(self):
+        row = self.queued('A1')
+
+        def failing(values):
+            raise ConnectionError('connection reset')
+        self.queue.append = failing
+        self.assertEqual(self.queue.flush(), 0)
+        row.refresh_from_db()
+        self.assertEqual((row.status, row.attempts, row.claimed_at), (QueuedRow.STATUS_PENDING, 1, None))
+
+        self.queue.append = self.append
+        self.assertEqual(self.queue.flush(), 1)
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import queue
+import threading
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from asgiref.testing import ApplicationCommunicator
+from django.test import SimpleTestCase, TransactionTestCase
+
+from little_helper import fakes, streaming
+from little_helper.upstreams import CircuitBreaker
+
+from . import FakeServicesMixin
+
+
+def stop():
+    return {'type': 'websocket.receive', 'text': json.dumps({'event': 'stop'})}
+
+
+def chunk(data):
+    return {'type': 'websocket.receive', 'bytes': data}
+
+
+# The recognizer thread reads the inventory for the phrase hints, hence a TransactionTestCase
+class TranscribeStreamTests(FakeServicesMixin, TransactionTestCase):
+
+    def session(self, *messages, timeout=5):
+        """Messages sent by the server on /ws/transcribe/ to a client sending `messages`"""
+        async def run():
+            communicator = ApplicationCommunicator(
+                streaming.transcribe_stream, {'type': 'websocket', 'path': '/ws/transcribe/'}
+            )
+            await communicator.send_input({'type': 'websocket.connect'})
+            for message in messages:
+                await communicator.send_input(message)
+            outputs = []
+            while not outputs or outputs[-1]['type'] != 'websocket.close':
+                outputs.append(await communicator.receive_output(timeout))
+            await communicator.wait(timeout)
+            return outputs
+        return async_to_sync(run)()
+
+    def sent_json(self, outputs):
+        return [json.loads(output['text']) for output in outputs if output['type'] == 'websocket.send']
+
+    def test_interim_and_final_transcripts(self):
+        speech = fakes.FakeSpeechClient()
+        self.use_speech(speech)
+        outputs = self.session(chunk(b'storage attic '), chunk(b'shelf A1 '), chunk(b'keywords box'), stop())
+        messages = self.sent_json(outputs)
+        self.assertEqual(outputs[0]['type'], 'websocket.accept')
+        # An interim message after every chunk and for the final result, then the final message
+        self.assertEqual([message['type'] for message in messages], ['interim'] * 4 + ['final'])
+        self.assertEqual(messages[0]['transcript'], 'storage attic')
+        final = messages[-1]
+        self.assertTrue(final['success'], final)
+        self.assertEqual(final['transcript'], 'storage attic shelf A1 keywords box')
+        self.assertEqual(final['parsed']['storage'], 'attic')
+        self.assertEqual(outputs[-1]['code'], 1000)
+        self.assertEqual(speech.calls, 1)
+
+    def test_sessions_over_capacity_are_refused(self):
+        speech = fakes.FakeSpeechClient()
+        self.use_speech(speech)
+        sessions = threading.BoundedSemaphore(1)
+        sessions.acquire()
+        with mock.patch.object(streaming, 'sessions', sessions):
+            outputs = self.session(chunk(b'storage attic'), stop())
+        self.assertEqual([output['type'] for output in outputs], ['websocket.accept', 'websocket.close'])
+        self.assertEqual(outputs[-1]['code'], streaming.CLOSE_TRY_AGAIN_LATER)
+        self.assertEqual(speech.calls, 0)
+
+    def test_open_breaker_stops_streams(self):
+        from google.api_core import exceptions as google_exceptions
+        speech = fakes.FakeSpeechClient()
+        self.use_speech(speech)
+        breaker = CircuitBreaker('speech', failure_threshold=1, reset_timeout=30)
+        with self.assertRaises(google_exceptions.ServiceUnavailable):
+            breaker.call(mock.Mock(side_effect=google_exceptions.ServiceUnavailable('down (fake)')))
+        self.patch_views(speech_breaker=breaker)
+        final = self.sent_json(self.session(chunk(b'storage attic'), stop()))[-1]
+        self.assertFalse(final['success'], final)
+        self.assertIn('unavailable', final['error'])
+        self.assertEqual(speech.calls, 0)
+
+    def test_session_is_released_after_the_stream(self):
+        self.use_speech(fakes.FakeSpeechClient())
+        sessions = threading.BoundedSemaphore(1)
+        with mock.patch.object(streaming, 'sessions', sessions):
+            for text in (b'storage attic', b'storage cellar'):
+                final = self.sent_json(self.session(chunk(text), stop()))[-1]
+                self.assertTrue(final['success'], final)
+
+
+class ChunkQueueTests(SimpleTestCase):
+
+    def test_full_queue_holds_the_reader_back(self):
+        chunks = queue.Queue(maxsize=1)
+        chunks.put(b'first')
+
+        async def run():
+            put = asyncio.ensure_future(streaming.put_chunk(chunks, b'second'))
+            await asyncio.sleep(0.1)
+            waited = not put.done()
+            chunks.get_nowait()
+            await asyncio.wait_for(put, 1)
+            return waited
+
+        self.assertTrue(async_to_sync(run)(), 'the chunk was queued past the limit')
+        self.assertEqual(chunks.get_nowait(), b'second')
+
+    def test_end_of_stream_is_queued_even_when_full(self):
+        chunks = queue.Queue(maxsize=2)
+        chunks.put(b'first')
+        chunks.put(b'second')
+        streaming.end_stream(chunks)
+        self.assertEqual(chunks.queue[-1], streaming.STREAM_END)
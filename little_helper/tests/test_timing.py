@@ -0,0 +1,92 @@
+import json
+import re
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from little_helper import fakes, timing
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+def server_timing_stages(header):
+    """Stage names and milliseconds of a Server-Timing header"""
+    return {
+        name: float(duration)
+        for name, duration in re.findall(r'([\w-]+);dur=([\d.]+)', header)
+    }
+
+
+class TimingTests(SimpleTestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(timing, 'registry', timing.Registry())
+        self.registry = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_repeated_stages_are_summed(self):
+        header = timing.server_timing([('sheets_read', 0.010), ('parse', 0.001), ('sheets_read', 0.005)], 0.020)
+        self.assertEqual(header, 'sheets_read;dur=15.0, parse;dur=1.0, total;dur=20.0')
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = timing.Histogram(buckets=(0.1, 1.0))
+        for seconds in (0.05, 0.1, 0.5, 3.0):
+            histogram.observe(seconds)
+        self.assertEqual(histogram.snapshot(), ([2, 3, 4], 3.65))
+
+    def test_stage_outside_a_request_is_background(self):
+        with timing.stage('flush'):
+            pass
+        rendered = self.registry.render()
+        self.assertIn('little_helper_stage_duration_seconds_count{stage="flush",view="background"} 1', rendered)
+        self.assertIn('# TYPE little_helper_stage_duration_seconds histogram', rendered)
+
+    def test_label_values_are_escaped(self):
+        self.registry.histogram('test_seconds', 'Test', view='say "hi"\\').observe(0.2)
+        self.assertIn('test_seconds_sum{view="say \\"hi\\"\\\\"} 0.2', self.registry.render())
+
+
+class TimingViewsTests(FakeServicesMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(timing, 'registry', timing.Registry())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.use_spreadsheet(fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB]), by_storage=False)
+
+    def transcribe(self, text):
+        return self.client.post('/transcribe/', {'audio': SimpleUploadedFile('clip.webm', text.encode(), 'audio/webm')})
+
+    def test_server_timing_header_lists_the_stages(self):
+        response = self.transcribe('storage attic shelf A1')
+        stages = server_timing_stages(response['Server-Timing'])
+        self.assertLessEqual({'read_upload', 'fingerprint', 'speech', 'total'}, set(stages))
+        self.assertGreaterEqual(stages['total'], stages['speech'])
+
+        response = self.client.post('/upload-to-sheet/', json.dumps({
+            'text': 'storage attic shelf A1 keywords box', 'current_state': {}
+        }), content_type='application/json')
+        self.assertTrue(response.json()['success'], response.content)
+        self.assertLessEqual({'decode', 'parse', 'sheets_append', 'journal'}, set(server_timing_stages(response['Server-Timing'])))
+
+    @override_settings(SERVER_TIMING=False)
+    def test_server_timing_can_be_turned_off(self):
+        self.assertNotIn('Server-Timing', self.transcribe('storage attic shelf A1'))
+
+    def test_metrics(self):
+        self.transcribe('storage attic shelf A1')
+        self.transcribe('storage attic shelf A2')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        metrics = response.content.decode()
+        self.assertIn('little_helper_request_duration_seconds_count{view="transcribe"} 2', metrics)
+        self.assertIn('little_helper_stage_duration_seconds_count{stage="speech",view="transcribe"} 2', metrics)
+        self.assertIn('little_helper_transcript_cache_lookups_total{result="misses"} 2', metrics)
+        self.assertIn('little_helper_upstream_calls_total{service="speech",result="ok"}', metrics)
+        # Every sample line is a name, optional labels and a number
+        for line in metrics.splitlines():
+            if not line.startswith('#'):
+                self.assertRegex(line, r'^[a-z_]+(\{[^}]*\})? [-+\d.e]+$')
@@ -0,0 +1,133 @@
+import threading
+import time
+from unittest import mock
+
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from little_helper import fakes, transcript_cache
+from little_helper.transcript_cache import DjangoCacheBackend, LocalBackend, TranscriptCache, backend_from_settings
+
+from . import FakeServicesMixin
+
+
+class Clock:
+    """Stand-in for time.monotonic that only moves when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LocalBackendTests(SimpleTestCase):
+
+    def setUp(self):
+        self.clock = Clock()
+        patcher = mock.patch.object(transcript_cache.time, 'monotonic', self.clock)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_entries_expire_after_the_ttl(self):
+        backend = LocalBackend(ttl=60)
+        backend.set('clip', 'storage attic')
+        self.clock.now += 59
+        self.assertEqual(backend.get('clip'), 'storage attic')
+        self.clock.now += 1
+        self.assertIsNone(backend.get('clip'))
+        self.assertEqual(len(backend), 0, 'the expired entry was kept')
+
+    def test_least_recently_used_entry_is_evicted(self):
+        backend = LocalBackend(max_entries=2)
+        backend.set('first', 'one')
+        backend.set('second', 'two')
+        backend.get('first')
+        backend.set('third', 'three')
+        self.assertEqual((backend.get('first'), backend.get('second'), backend.get('third')), ('one', None, 'three'))
+
+
+class TranscriptCacheTests(SimpleTestCase):
+
+    def setUp(self):
+        self.calls = []
+
+    def transcribe(self, text):
+        def call():
+            self.calls.append(text)
+            return text
+        return call
+
+    def test_hits_and_misses(self):
+        cache = TranscriptCache(LocalBackend())
+        self.assertEqual(cache.get_or_transcribe('a', self.transcribe('storage attic')), 'storage attic')
+        self.assertEqual(cache.get_or_transcribe('a', self.transcribe('other')), 'storage attic')
+        self.assertEqual(cache.get_or_transcribe('b', self.transcribe('shelf A1')), 'shelf A1')
+        self.assertEqual(self.calls, ['storage attic', 'shelf A1'])
+        stats = cache.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['coalesced']), (1, 2, 0))
+        self.assertEqual((stats['hit_rate'], stats['backend'], stats['entries']), (0.333, 'LocalBackend', 2))
+
+    def test_failed_transcription_is_not_cached(self):
+        cache = TranscriptCache(LocalBackend())
+
+        def failing():
+            raise ConnectionError('connection reset')
+        with self.assertRaises(ConnectionError):
+            cache.get_or_transcribe('a', failing)
+        self.assertEqual(cache.get_or_transcribe('a', self.transcribe('storage attic')), 'storage attic')
+        self.assertEqual(cache.stats()['misses'], 2)
+
+    def test_retry_waits_for_the_transcription_in_flight(self):
+        cache = TranscriptCache(LocalBackend())
+        started = threading.Event()
+
+        def slow():
+            started.set()
+            time.sleep(0.2)
+            return self.transcribe('storage attic')()
+        first = threading.Thread(target=cache.get_or_transcribe, args=('a', slow))
+        first.start()
+        started.wait(5)
+        self.assertEqual(cache.get_or_transcribe('a', self.transcribe('again')), 'storage attic')
+        first.join()
+        self.assertEqual(self.calls, ['storage attic'])
+        self.assertEqual(cache.stats()['coalesced'], 1)
+
+    def test_without_a_backend_every_call_transcribes(self):
+        cache = TranscriptCache(None)
+        cache.get_or_transcribe('a', self.transcribe('one'))
+        cache.get_or_transcribe('a', self.transcribe('two'))
+        self.assertEqual(self.calls, ['one', 'two'])
+        self.assertIsNone(cache.stats()['hit_rate'])
+
+    def test_django_cache_backend(self):
+        cache = TranscriptCache(DjangoCacheBackend(ttl=60))
+        self.addCleanup(cache.backend.delete, 'clip')
+        cache.get_or_transcribe('clip', self.transcribe('storage attic'))
+        self.assertEqual(cache.get_or_transcribe('clip', self.transcribe('other')), 'storage attic')
+        cache.backend.delete('clip')
+        self.assertEqual(cache.get_or_transcribe('clip', self.transcribe('shelf A1')), 'shelf A1')
+        self.assertEqual(self.calls, ['storage attic', 'shelf A1'])
+
+    @override_settings(TRANSCRIPT_CACHE_BACKEND='redis')
+    def test_unknown_backend_is_refused(self):
+        with self.assertRaises(ValueError):
+            backend_from_settings()
+
+
+class TranscribeCacheViewTests(FakeServicesMixin, TestCase):
+
+    def post(self, text):
+        clip = SimpleUploadedFile('clip.webm', text.encode(), 'audio/webm')
+        return self.client.post('/transcribe/', {'audio': clip}).json()
+
+    def test_reposted_clip_is_not_transcribed_again(self):
+        speech = fakes.FakeSpeechClient()
+        self.use_speech(speech)
+        for _ in range(3):
+            self.assertEqual(self.post('storage attic shelf A1')['transcript'], 'storage attic shelf A1')
+        self.assertEqual(self.post('storage attic shelf A2')['transcript'], 'storage attic shelf A2')
+        self.assertEqual(speech.calls, 2)
+        stats = self.client.get('/transcript-cache/').json()
+        self.assertEqual((stats['hits'], stats['misses']), (2, 2))
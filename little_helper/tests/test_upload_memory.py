@@ -0,0 +1,18 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from little_helper import fakes
+
+from . import DEFAULT_TAB, FakeServicesMixin
+
+
+class UploadMemoryTests(FakeServicesMixin, TestCase):
+
+    def test_large_uploads_are_streamed(self):
+        self.use_spreadsheet(fakes.FakeSpreadsheet(tabs=[DEFAULT_TAB]), by_storage=False)
+        # Fails with a CommandError if an upload is held in memory or the photo is decoded at full size
+        output = StringIO()
+        call_command('bench_upload_memory', stdout=output)
+        self.assertIn('/upload-to-sheet/', output.getvalue())
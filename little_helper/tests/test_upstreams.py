@@ -0,0 +1,181 @@
+import atexit
+import io
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, TransactionTestCase
+
+from little_helper import async_views, fakes, views
+from little_helper.sheet_queue import SheetWriteQueue
+from little_helper.upstreams import Overloaded, UpstreamError, UpstreamScheduler
+
+from . import BACKOFF, FakeServicesMixin
+
+
+def sheets_get(service):
+    return service.spreadsheets().values().get(spreadsheetId='test', range='test!A1:D1').execute
+
+
+def failing(attempts, error):
+    """Call appending to attempts and raising error"""
+    def call():
+        attempts.append(1)
+        raise error
+    return call
+
+
+def run_calls(scheduler, service, calls, threads=8):
+    """Results of concurrent Sheets calls, with Overloaded errors in place of the refused ones"""
+    def call(i):
+        try:
+            return scheduler.call('sheets', sheets_get(service))
+        except Overloaded as e:
+            return e
+
+    with ThreadPoolExecutor(threads) as pool:
+        return list(pool.map(call, range(calls)))
+
+
+class UpstreamSchedulerTests(TestCase):
+
+    def test_token_bucket_keeps_under_the_quota(self):
+        # 600/min with a 1 s burst sends at most 20 calls in any second; the upstream allows 25
+        quota = fakes.FakeQuota(limit=25, window=1.0)
+        scheduler = UpstreamScheduler({'sheets': 600}, burst_seconds=1, **BACKOFF)
+        results = run_calls(scheduler, fakes.FakeSheetsService(quota=quota), 40)
+        self.assertEqual(quota.rejected, 0)
+        self.assertFalse(any(isinstance(result, Overloaded) for result in results))
+
+        unlimited_quota = fakes.FakeQuota(limit=25, window=1.0)
+        run_calls(UpstreamScheduler({}, **BACKOFF), fakes.FakeSheetsService(quota=unlimited_quota), 40)
+        self.assertGreater(unlimited_quota.rejected, 0, 'expected 429s without a budget')
+
+    def test_throttled_calls_are_retried(self):
+        quota = fakes.FakeQuota(throttle_rate=0.3, seed=1)
+        scheduler = UpstreamScheduler({'sheets': 6000}, max_retries=8, **BACKOFF)
+        run_calls(scheduler, fakes.FakeSheetsService(quota=quota), 60)
+        stats = scheduler.stats()['sheets']
+        self.assertEqual(stats['ok'], 60)
+        self.assertEqual(stats['retried'], quota.rejected)
+        self.assertLess(stats['rate_per_minute'], 6000, 'the budget did not back off after 429s')
+
+    def test_5xx_retried_only_when_idempotent(self):
+        scheduler = UpstreamScheduler({}, max_retries=3, **BACKOFF)
+        attempts = []
+
+        def unavailable():
+            attempts.append(1)
+            if len(attempts) < 3:
+                raise UpstreamError(503)
+            return 'done'
+
+        self.assertEqual(scheduler.call('sheets', unavailable), 'done')
+        attempts.clear()
+        with self.assertRaises(UpstreamError):
+            scheduler.call('sheets', unavailable, idempotent=False)
+        self.assertEqual(len(attempts), 1, 'a non-idempotent call was retried after a 503')
+
+    def test_own_deadline_is_final(self):
+        from google.api_core import exceptions as google_exceptions
+        scheduler = UpstreamScheduler({}, max_retries=3, **BACKOFF)
+        attempts = []
+        with self.assertRaises(google_exceptions.DeadlineExceeded):
+            scheduler.call('speech', failing(attempts, google_exceptions.DeadlineExceeded('Deadline exceeded')))
+        self.assertEqual(len(attempts), 1, 'a call past its own timeout was retried')
+        # A 504 answered by the upstream is still retried
+        attempts.clear()
+        with self.assertRaises(UpstreamError):
+            scheduler.call('imgbb', failing(attempts, UpstreamError(504)))
+        self.assertEqual(len(attempts), 4)
+
+    def test_retries_stop_at_the_deadline(self):
+        scheduler = UpstreamScheduler({}, max_retries=100, backoff_base=0.05, backoff_max=0.05, deadline=0.3)
+        attempts = []
+        started = time.perf_counter()
+        with self.assertRaises(UpstreamError):
+            scheduler.call('sheets', failing(attempts, UpstreamError(503)))
+        self.assertLess(time.perf_counter() - started, 0.4)
+        self.assertLess(len(attempts), 100)
+
+    def test_wait_beyond_max_wait_is_refused(self):
+        scheduler = UpstreamScheduler({'speech': 60}, burst_seconds=1, max_wait=0.5)
+        scheduler.call('speech', lambda: None)
+        with self.assertRaises(Overloaded) as refused:
+            scheduler.call('speech', lambda: None)
+        self.assertTrue(0.5 < refused.exception.retry_after <= 1.0, refused.exception.retry_after)
+
+
+class OverloadedViewsTests(FakeServicesMixin, TransactionTestCase):
+
+    def test_views_answer_503_or_queue_the_row(self):
+        queue = SheetWriteQueue(lambda values: views.append_rows(values), max_delay=60)
+        # The flusher thread reads the queue, hence a TransactionTestCase; it must not flush at exit
+        self.addCleanup(atexit.unregister, queue.stop)
+        self.addCleanup(queue.stop, flush=False)
+        self.patch_views(
+            client_pool=fakes.fake_client_pool(sheets_quota=fakes.FakeQuota(throttle_rate=1.0)),
+            scheduler=UpstreamScheduler({'speech': 60}, burst_seconds=1, max_wait=0.1, max_retries=2, **BACKOFF),
+            sheet_queue=queue,
+        )
+        clip = lambda shelf: SimpleUploadedFile('clip.webm', f'storage attic shelf {shelf}'.encode(), 'audio/webm')
+        first = self.client.post('/transcribe/', {'audio': clip('A1')})
+        second = self.client.post('/transcribe/', {'audio': clip('A2')})
+        self.assertTrue(first.json()['success'], first.content)
+        self.assertEqual(second.status_code, 503, second.content)
+        self.assertTrue(second.json()['overloaded'])
+        self.assertGreaterEqual(int(second['Retry-After']), 1)
+
+        upload = self.client.post('/upload-to-sheet/', json.dumps({
+            'text': 'storage attic shelf A1 keywords box', 'current_state': {}
+        }), content_type='application/json').json()
+        self.assertTrue(upload['success'] and upload.get('queued'), upload)
+
+    def imgbb(self, quota=None, scheduler=None):
+        server = fakes.FakeImgbbServer(quota=quota).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.patch_views(IMGBB_UPLOAD_URL=server.url, scheduler=scheduler)
+        patcher = mock.patch.dict(os.environ, {'IMGBB_API_KEY': 'test'})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        return server
+
+    def photo(self, shade):
+        from PIL import Image
+        photo = io.BytesIO()
+        Image.new('RGB', (32, 24), (shade * 40, 80, 120)).save(photo, 'PNG')
+        return SimpleUploadedFile('photo.png', photo.getvalue(), 'image/png')
+
+    def test_imgbb_429s_are_retried(self):
+        server = self.imgbb(
+            fakes.FakeQuota(throttle_rate=0.5, retry_after=0, seed=3), UpstreamScheduler({}, max_retries=10, **BACKOFF)
+        )
+        for i in range(5):
+            formula, _ = views.upload_image(self.photo(i))
+            self.assertTrue(formula.startswith('=IMAGE('), formula)
+        self.assertGreater(server.quota.rejected, 0, 'the fake never throttled')
+
+    def test_async_imgbb_uploads_are_scheduled(self):
+        server = self.imgbb(
+            fakes.FakeQuota(throttle_rate=0.5, retry_after=0, seed=3), UpstreamScheduler({}, max_retries=10, **BACKOFF)
+        )
+        upload = async_to_sync(async_views.upload_image_async)
+        for i in range(5):
+            formula, _ = upload(self.photo(i))
+            self.assertTrue(formula.startswith('=IMAGE('), formula)
+        self.assertGreater(server.quota.rejected, 0, 'the fake never throttled')
+        self.assertEqual(views.scheduler.stats()['imgbb']['retried'], server.quota.rejected)
+
+        # One call per second with no burst: the second upload would wait too long
+        server.quota = None
+        scheduler = UpstreamScheduler({'imgbb': 60}, burst_seconds=1, max_wait=0.1)
+        self.patch_views(scheduler=scheduler)
+        upload(self.photo(5))
+        with self.assertRaises(Overloaded):
+            upload(self.photo(6))
+        self.assertEqual(scheduler.stats()['imgbb']['overloaded'], 1)
@@ -0,0 +1,189 @@
+"""
+Per-stage request timing.
+
+Code that talks to an upstream or does noticeable work wraps it in a stage:
+
+    with timing.stage('sheets_append'):
+        service.spreadsheets().values().append(...).execute()
+
+TimingMiddleware collects the stages of each request. It sends them to the
+client in a Server-Timing header, so the browser's network panel shows where
+an upload spent its time, and records them in the in-process histograms that
+/metrics exposes in the Prometheus text format. Stages that run outside a
+request, e.g. the write-behind flush, are recorded under view="background".
+
+A stage costs two perf_counter() calls and a list append, and each request
+takes one lock per histogram it updates, so this can stay on in production.
+"""
+import asyncio
+import bisect
+import contextvars
+import threading
+import time
+
+from django.conf import settings
+
+# Upper bounds in seconds, from a fast parse to a slow upload
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stages of the request being served, shared with the threads it starts
+_current_stages = contextvars.ContextVar('timing_stages', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram of durations in seconds, like a Prometheus histogram"""
+
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, seconds):
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self.lock:
+            self.counts[index] += 1
+            self.sum += seconds
+
+    def snapshot(self):
+        """(cumulative counts per bucket including +Inf, sum)"""
+        with self.lock:
+            counts = list(self.counts)
+            total = self.sum
+        cumulative = []
+        running = 0
+        for count in counts:
+            running += count
+            cumulative.append(running)
+        return cumulative, total
+
+
+class Registry:
+    """Histograms by metric name and label values"""
+
+    def __init__(self):
+        self.histograms = {}
+        self.help = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name, help_text, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(key, Histogram())
+                self.help.setdefault(name, help_text)
+        return histogram
+
+    def render(self):
+        """All histograms in the Prometheus text exposition format"""
+        lines = []
+        by_name = {}
+        for (name, labels), histogram in sorted(self.histograms.items()):
+            by_name.setdefault(name, []).append((labels, histogram))
+        for name, histograms in by_name.items():
+            lines.append(f'# HELP {name} {self.help[name]}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in histograms:
+                cumulative, total = histogram.snapshot()
+                for bound, count in zip(histogram.buckets + ('+Inf',), cumulative):
+                    lines.append(f'{name}_bucket{format_labels(labels + (("le", str(bound)),))} {count}')
+                lines.append(f'{name}_sum{format_labels(labels)} {total}')
+                lines.append(f'{name}_count{format_labels(labels)} {cumulative[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (
+        (key, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels
+    )
+    return '{' + ','.join(f'{key}="{value}"' for key, value in escaped) + '}'
+
+
+registry = Registry()
+
+
+def observe_stage(view, name, seconds):
+    registry.histogram(
+        'little_helper_stage_duration_seconds', 'Time spent in each stage of a request', view=view, stage=name
+    ).observe(seconds)
+
+
+class stage:
+    """Time the enclosed block as a stage of the current request"""
+
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        seconds = time.perf_counter() - self.start
+        stages = _current_stages.get()
+        if stages is None:
+            observe_stage('background', self.name, seconds)
+        else:
+            stages.append((self.name, seconds))
+
+
+def server_timing(stages, total):
+    """Server-Timing header value; a stage that ran more than once is reported with its total time"""
+    durations = {}
+    for name, seconds in stages:
+        durations[name] = durations.get(name, 0.0) + seconds
+    durations['total'] = total
+    return ', '.join(f'{name};dur={seconds * 1000:.1f}' for name, seconds in durations.items())
+
+
+class TimingMiddleware:
+    """Collect the stages of each request into the Server-Timing header and the /metrics histograms"""
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            # Same marker Django's MiddlewareMixin sets, so the handler awaits us
+            self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        stages = []
+        token = _current_stages.set(stages)
+        start = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current_stages.reset(token)
+        return self.finish(request, response, stages, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        stages = []
+        token = _current_stages.set(stages)
+        start = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current_stages.reset(token)
+        return self.finish(request, response, stages, time.perf_counter() - start)
+
+    def finish(self, request, response, stages, total):
+        match = getattr(request, 'resolver_match', None)
+        view = match.url_name if match and match.url_name else 'other'
+        registry.histogram(
+            'little_helper_request_duration_seconds', 'Time to handle a request, including middleware', view=view
+        ).observe(total)
+        for name, seconds in stages:
+            observe_stage(view, name, seconds)
+        if settings.SERVER_TIMING:
+            response['Server-Timing'] = server_timing(stages, total)
+        return response
@@ -0,0 +1,160 @@
+"""
+Cache of transcription results, keyed by a fingerprint of the audio and the
+RecognitionConfig it was transcribed with.
+
+Phones on flaky networks often post the same clip two or three times, and
+every retry would otherwise be a full paid recognize call. A retry that
+arrives while the first request is still being transcribed waits for its
+result instead of starting a second call.
+
+The storage is pluggable:
+
+    LocalBackend       in-process, size-bounded LRU with a TTL (default)
+    DjangoCacheBackend any cache from settings.CACHES, shared between workers
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+# Retries waiting for an in-flight transcription give up after this many seconds
+IN_FLIGHT_TIMEOUT = 60.0
+
+
+def audio_fingerprint(chunks, config):
+    """SHA-256 of the audio (given as byte chunks) and of the serialized RecognitionConfig"""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk)
+    digest.update(b'\0')
+    digest.update(type(config).serialize(config))
+    return digest.hexdigest()
+
+
+class LocalBackend:
+    """In-process LRU of at most max_entries transcripts, each kept for ttl seconds"""
+
+    def __init__(self, max_entries=1000, ttl=3600):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DjangoCacheBackend:
+    """Transcripts stored in a Django cache; its own settings decide eviction"""
+
+    def __init__(self, alias='default', ttl=3600, prefix='transcript:'):
+        from django.core.cache import caches
+        self.cache = caches[alias]
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        return self.cache.get(self.prefix + key)
+
+    def set(self, key, value):
+        self.cache.set(self.prefix + key, value, self.ttl)
+
+    def delete(self, key):
+        self.cache.delete(self.prefix + key)
+
+
+class TranscriptCache:
+    """Transcripts by audio fingerprint, with hit/miss statistics"""
+
+    def __init__(self, backend=None):
+        self.backend = backend
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'coalesced': 0}
+
+    def get_or_transcribe(self, key, transcribe):
+        """Return the cached transcript for key, or call transcribe() and cache its result."""
+        if self.backend is None:
+            return transcribe()
+        transcript = self.backend.get(key)
+        if transcript is not None:
+            self._count('hits')
+            return transcript
+
+        with self._lock:
+            done = self._in_flight.get(key)
+            owner = done is None
+            if owner:
+                done = self._in_flight[key] = threading.Event()
+        if not owner:
+            # The same clip is being transcribed for an earlier request
+            done.wait(IN_FLIGHT_TIMEOUT)
+            transcript = self.backend.get(key)
+            if transcript is not None:
+                self._count('coalesced')
+                return transcript
+
+        self._count('misses')
+        try:
+            transcript = transcribe()
+            self.backend.set(key, transcript)
+            return transcript
+        finally:
+            if owner:
+                with self._lock:
+                    del self._in_flight[key]
+                done.set()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        lookups = stats['hits'] + stats['coalesced'] + stats['misses']
+        stats['hit_rate'] = round((stats['hits'] + stats['coalesced']) / lookups, 3) if lookups else None
+        stats['backend'] = type(self.backend).__name__ if self.backend is not None else None
+        stats['entries'] = len(self.backend) if isinstance(self.backend, LocalBackend) else None
+        return stats
+
+    def _count(self, name):
+        with self._lock:
+            self._stats[name] += 1
+
+
+def backend_from_settings():
+    """Backend chosen by settings.TRANSCRIPT_CACHE_BACKEND: 'local', 'django' or 'none'"""
+    name = settings.TRANSCRIPT_CACHE_BACKEND
+    if name == 'local':
+        return LocalBackend(max_entries=settings.TRANSCRIPT_CACHE_MAX_ENTRIES, ttl=settings.TRANSCRIPT_CACHE_TTL)
+    if name == 'django':
+        return DjangoCacheBackend(alias=settings.TRANSCRIPT_CACHE_ALIAS, ttl=settings.TRANSCRIPT_CACHE_TTL)
+    if name in ('none', ''):
+        return None
+    raise ValueError(f'Unknown TRANSCRIPT_CACHE_BACKEND: {name!r}')
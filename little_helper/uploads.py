@@ -0,0 +1,116 @@
+"""
+Bounded-memory handling of audio and image uploads.
+
+Django keeps uploads up to FILE_UPLOAD_MAX_MEMORY_SIZE in memory and spools
+larger ones to a temporary file. SizeLimitUploadHandler runs in front of the
+built-in handlers and drops a file as soon as it grows past the limit for
+its field in UPLOAD_FIELD_LIMITS, so an oversized upload is never stored.
+The view then reports the error from upload_error(); uploads_in_order()
+keeps the place of a skipped file among several sent in the same field.
+
+Spooled files are read back in chunks: MultipartBody streams a file to
+imgbb while the request is sent, instead of building the request in memory.
+"""
+import uuid
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.uploadhandler import FileUploadHandler, SkipFile
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """Skip files larger than the limit for their field and record why on request.upload_errors"""
+
+    def new_file(self, field_name, *args, **kwargs):
+        super().new_file(field_name, *args, **kwargs)
+        self.limit = settings.UPLOAD_FIELD_LIMITS.get(field_name)
+        self.received = 0
+        # Position of the file among the files of its field
+        if not hasattr(self, 'counts'):
+            self.counts = {}
+        self.position = self.counts.get(field_name, 0)
+        self.counts[field_name] = self.position + 1
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.limit is not None and self.received > self.limit:
+            if not hasattr(self.request, 'upload_errors'):
+                self.request.upload_errors = {}
+            self.request.upload_errors[self.field_name] = (
+                f'The {self.field_name} file is larger than the limit of {format_size(self.limit)}.'
+            )
+            if not hasattr(self.request, 'skipped_uploads'):
+                self.request.skipped_uploads = {}
+            self.request.skipped_uploads.setdefault(self.field_name, []).append(self.position)
+            raise SkipFile()
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+def upload_error(request, field_name):
+    """Error message if the file in field_name was rejected by SizeLimitUploadHandler, otherwise None"""
+    return getattr(request, 'upload_errors', {}).get(field_name)
+
+
+def uploads_in_order(request, field_name):
+    """The files sent in field_name in the order they were sent, with None for each one skipped as too large"""
+    files = request.FILES.getlist(field_name)
+    skipped = set(getattr(request, 'skipped_uploads', {}).get(field_name, ()))
+    remaining = iter(files)
+    return [None if position in skipped else next(remaining) for position in range(len(files) + len(skipped))]
+
+
+def format_size(size):
+    if size >= 1024 * 1024:
+        return f'{round(size / (1024 * 1024), 1):g} MB'
+    return f'{round(size / 1024, 1):g} KB'
+
+
+class MultipartBody:
+    """
+    multipart/form-data request body with one file part, read in chunks
+    while the request is sent. Pass it as data= to requests, or its
+    async_chunks() as content= to httpx, together with headers().
+    """
+
+    def __init__(self, fields, file_field, file, filename='upload', chunk_size=None):
+        if isinstance(file, bytes):
+            file = ContentFile(file)
+        self.file = file
+        self.chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+        self.boundary = uuid.uuid4().hex
+        parts = [
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        ]
+        parts.append(
+            f'--{self.boundary}\r\nContent-Disposition: form-data; name="{file_field}"; filename="{filename}"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode()
+        )
+        self.head = b''.join(parts)
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode()
+
+    def __len__(self):
+        return len(self.head) + self.file.size + len(self.tail)
+
+    def __iter__(self):
+        yield self.head
+        self.file.seek(0)
+        while True:
+            chunk = self.file.read(self.chunk_size)
+            if not chunk:
+                break
+            yield chunk
+        yield self.tail
+
+    async def async_chunks(self):
+        for chunk in self:
+            yield chunk
+
+    def headers(self):
+        return {
+            'Content-Type': f'multipart/form-data; boundary={self.boundary}',
+            'Content-Length': str(len(self)),
+        }
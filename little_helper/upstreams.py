@@ -0,0 +1,394 @@
+"""
+Quota-aware scheduling of calls to Sheets, Speech-to-Text and imgbb.
+
+Every upstream call made by the views goes through one UpstreamScheduler:
+
+    scheduler.call('sheets', request.execute, stage='sheets_append', idempotent=False)
+
+Each service has a token bucket refilled at its requests-per-minute budget,
+with room for UPSTREAM_BURST_SECONDS worth of calls in a burst. A call
+without a token waits for one; if the wait would be longer than max_wait the
+call is refused with Overloaded, so requests fail fast with a clear answer
+instead of piling up behind the quota.
+
+429s, 5xx and connection errors are retried with full-jitter exponential
+backoff, honouring Retry-After. A 429 also halves the bucket's rate, which
+then grows back a little with every successful call, so the budget adapts to
+what the service actually accepts. Calls that are not idempotent, like a
+Sheets append, are only retried after a 429, which Google sends before the
+request is applied. A 429 that outlasts the retries becomes Overloaded.
+
+A call that ran out its own `timeout=` (DeadlineExceeded, a read timeout) is
+not retried: the caller chose how long it may take, and the request may
+still be running upstream. Retries also stop once `deadline` seconds have
+passed since the first attempt.
+
+The buckets are per worker process: divide the project quota by the number
+of workers when setting the budgets. Coroutines (the async views) go through
+the same buckets with call_async, which waits without blocking the event loop:
+
+    await scheduler.call_async('imgbb', post_photo, stage='imgbb')
+
+A CircuitBreaker in front of a service stops calling it after repeated
+failures and answers CircuitOpen (an Overloaded) until a trial call succeeds,
+so a degraded upstream does not hold every worker.
+"""
+import asyncio
+import random
+import threading
+import time
+
+import requests
+
+from . import timing
+
+RETRYABLE_STATUS = frozenset((429, 500, 502, 503, 504))
+RETRYABLE_EXCEPTIONS = (ConnectionError, TimeoutError, requests.ConnectionError, requests.Timeout)
+RESULTS = ('ok', 'retried', 'throttled', 'overloaded', 'failed')
+
+
+class Overloaded(Exception):
+    """An upstream is over its quota; try again after retry_after seconds"""
+
+    def __init__(self, service, retry_after):
+        self.service = service
+        self.retry_after = retry_after
+        super().__init__(f'{service} is busy, please try again in {max(round(retry_after), 1)} s')
+
+
+class CircuitOpen(Overloaded):
+    """The circuit breaker of an unhealthy upstream is refusing calls"""
+
+    def __init__(self, service, retry_after):
+        super().__init__(service, retry_after)
+        self.args = (f'{service} is unavailable, please try again in {max(round(retry_after), 1)} s',)
+
+
+class UpstreamError(Exception):
+    """Retryable HTTP status from an upstream called with plain HTTP (imgbb)"""
+
+    def __init__(self, status, retry_after=None, text=''):
+        self.status = status
+        self.retry_after = retry_after
+        super().__init__(f'Upstream returned HTTP {status}: {text[:200]}')
+
+
+def check_response(response):
+    """Raise UpstreamError for a retryable status of a requests/httpx response, else return the response"""
+    if response.status_code in RETRYABLE_STATUS:
+        raise UpstreamError(response.status_code, parse_retry_after(response.headers.get('retry-after')), response.text)
+    return response
+
+
+def parse_retry_after(value):
+    try:
+        return max(float(value), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def error_status(error):
+    """HTTP status of an upstream error, or None"""
+    if isinstance(error, UpstreamError):
+        return error.status
+    # googleapiclient.errors.HttpError
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None) is not None:
+        return int(resp.status)
+    # google.api_core.exceptions.GoogleAPICallError
+    code = getattr(error, 'code', None)
+    return code if isinstance(code, int) else None
+
+
+def is_upstream_failure(error):
+    """Whether an error says the upstream is unhealthy, as opposed to a bad request or our own refusal"""
+    if isinstance(error, Overloaded):
+        return False
+    status = error_status(error)
+    if status is not None:
+        return status in RETRYABLE_STATUS
+    return isinstance(error, RETRYABLE_EXCEPTIONS)
+
+
+def is_deadline_exceeded(error):
+    """Whether a call ended because its own timeout ran out, rather than the upstream answering"""
+    if isinstance(error, requests.ConnectTimeout):
+        # Nothing was sent yet
+        return False
+    if isinstance(error, (TimeoutError, requests.Timeout)):
+        return True
+    # google.api_core.exceptions.DeadlineExceeded; a 504 answered over HTTP has a response
+    return getattr(error, 'code', None) == 504 and getattr(error, 'resp', None) is None \
+        and not isinstance(error, UpstreamError)
+
+
+def error_retry_after(error):
+    if isinstance(error, UpstreamError):
+        return error.retry_after
+    resp = getattr(error, 'resp', None)
+    if resp is not None and hasattr(resp, 'get'):
+        return parse_retry_after(resp.get('retry-after'))
+    return None
+
+
+class TokenBucket:
+    """Requests-per-minute budget whose rate backs off after a 429 and recovers with successful calls"""
+
+    def __init__(self, per_minute, burst_seconds=10.0):
+        self.max_rate = per_minute / 60.0
+        self.min_rate = self.max_rate / 10
+        self.rate = self.max_rate
+        self.capacity = max(1.0, self.max_rate * burst_seconds)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def reserve(self, max_wait):
+        """
+        Take a token and return the seconds to wait before using it, or None
+        without taking one if that would be longer than max_wait. Tokens go
+        negative while callers wait, which queues them in arrival order.
+        """
+        with self.lock:
+            self._refill()
+            wait = max(1 - self.tokens, 0) / self.rate
+            if wait > max_wait:
+                return None
+            self.tokens -= 1
+            return wait
+
+    def retry_after(self):
+        """Seconds until a token would be free"""
+        with self.lock:
+            self._refill()
+            return max(1 - self.tokens, 0) / self.rate
+
+    def throttled(self):
+        with self.lock:
+            self._refill()
+            self.rate = max(self.rate / 2, self.min_rate)
+            # The burst allowance is what got us throttled
+            self.tokens = min(self.tokens, 0.0)
+
+    def succeeded(self):
+        if self.rate < self.max_rate:
+            with self.lock:
+                self._refill()
+                self.rate = min(self.rate + self.max_rate / 20, self.max_rate)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class UpstreamScheduler:
+    """Rate limits and retries calls per upstream service.
+
+    requests_per_minute maps a service name to its budget; services that are
+    missing or have a budget of 0 are not rate limited but still retried.
+    """
+
+    def __init__(self, requests_per_minute, burst_seconds=10.0, max_wait=5.0,
+                 max_retries=4, backoff_base=0.5, backoff_max=8.0, deadline=30.0, sleep=time.sleep):
+        self.buckets = {
+            service: TokenBucket(per_minute, burst_seconds)
+            for service, per_minute in requests_per_minute.items() if per_minute
+        }
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.deadline = deadline
+        self.sleep = sleep
+        self._stats_lock = threading.Lock()
+        self._stats = {}
+
+    def call(self, service, func, *args, stage=None, idempotent=True, max_retries=None, **kwargs):
+        """
+        Call func(*args, **kwargs) within the service's budget and retry it on
+        retryable errors. stage names the timing stage of each attempt.
+        Raises Overloaded when the budget or the upstream cannot take the call.
+        """
+        bucket = self.buckets.get(service)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._reserve(service, bucket)
+            if wait:
+                with timing.stage(f'{service}_wait'):
+                    self.sleep(wait)
+            try:
+                if stage:
+                    with timing.stage(stage):
+                        result = func(*args, **kwargs)
+                else:
+                    result = func(*args, **kwargs)
+            except Exception as e:
+                delay = self._failed(service, bucket, e, attempt, max_retries, idempotent, started)
+                with timing.stage(f'{service}_backoff'):
+                    self.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(service, bucket)
+            return result
+
+    async def call_async(self, service, func, *args, stage=None, idempotent=True, max_retries=None, **kwargs):
+        """call() for a coroutine function: await func(*args, **kwargs), waiting with asyncio.sleep"""
+        bucket = self.buckets.get(service)
+        max_retries = self.max_retries if max_retries is None else max_retries
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            wait = self._reserve(service, bucket)
+            if wait:
+                with timing.stage(f'{service}_wait'):
+                    await asyncio.sleep(wait)
+            try:
+                if stage:
+                    with timing.stage(stage):
+                        result = await func(*args, **kwargs)
+                else:
+                    result = await func(*args, **kwargs)
+            except Exception as e:
+                delay = self._failed(service, bucket, e, attempt, max_retries, idempotent, started)
+                with timing.stage(f'{service}_backoff'):
+                    await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self._succeeded(service, bucket)
+            return result
+
+    def _reserve(self, service, bucket):
+        """Seconds to wait for a token of the service, or raise Overloaded if that would take too long"""
+        if bucket is None:
+            return 0
+        wait = bucket.reserve(self.max_wait)
+        if wait is None:
+            self._count(service, 'overloaded')
+            raise Overloaded(service, bucket.retry_after())
+        return wait
+
+    def _failed(self, service, bucket, error, attempt, max_retries, idempotent, started):
+        """Seconds to back off before retrying a failed call; re-raises the error (or Overloaded) otherwise"""
+        status = error_status(error)
+        if status == 429 and bucket is not None:
+            bucket.throttled()
+        delay = self._retry_delay(error, status, attempt, max_retries, idempotent, time.monotonic() - started)
+        if delay is None:
+            if status == 429:
+                self._count(service, 'throttled')
+                retry_after = error_retry_after(error) or (bucket.retry_after() if bucket else self.backoff_max)
+                raise Overloaded(service, retry_after) from error
+            self._count(service, 'failed')
+            raise error
+        self._count(service, 'retried')
+        return delay
+
+    def _succeeded(self, service, bucket):
+        if bucket is not None:
+            bucket.succeeded()
+        self._count(service, 'ok')
+
+    def _retry_delay(self, error, status, attempt, max_retries, idempotent, elapsed):
+        """Seconds to sleep before retrying, or None if the error must not be retried"""
+        retryable = status == 429 or idempotent and (
+            status in RETRYABLE_STATUS or isinstance(error, RETRYABLE_EXCEPTIONS)
+        ) and not is_deadline_exceeded(error)
+        if not retryable or attempt >= max_retries:
+            return None
+        retry_after = error_retry_after(error)
+        if retry_after is not None:
+            # Asked to wait longer than we would back off: give up now instead
+            delay = retry_after if retry_after <= self.backoff_max else None
+        else:
+            # Full jitter: uniform between 0 and the exponential ceiling
+            delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if delay is None or elapsed + delay > self.deadline:
+            return None
+        return delay
+
+    def stats(self):
+        """Calls by service and result, and each bucket's current rate per minute"""
+        with self._stats_lock:
+            stats = {service: dict(counts) for service, counts in self._stats.items()}
+        for service, bucket in self.buckets.items():
+            stats.setdefault(service, dict.fromkeys(RESULTS, 0))['rate_per_minute'] = round(bucket.rate * 60, 2)
+        return stats
+
+    def _count(self, service, result):
+        with self._stats_lock:
+            counts = self._stats.get(service)
+            if counts is None:
+                counts = self._stats[service] = dict.fromkeys(RESULTS, 0)
+            counts[result] += 1
+
+
+class CircuitBreaker:
+    """Fails calls fast while an upstream is unhealthy.
+
+    After failure_threshold consecutive upstream failures the circuit opens
+    and calls raise CircuitOpen for reset_timeout seconds. Then one trial call
+    is let through (half-open): if it succeeds the circuit closes, otherwise
+    it opens again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+    STATES = (CLOSED, HALF_OPEN, OPEN)
+
+    def __init__(self, service, failure_threshold=5, reset_timeout=30.0):
+        self.service = service
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self.trial_running = False
+        self.lock = threading.Lock()
+        self._stats = {'opened': 0, 'rejected': 0}
+
+    def call(self, func, *args, **kwargs):
+        trial = self._before_call()
+        try:
+            result = func(*args, **kwargs)
+        except Exception as e:
+            self._after_call(trial, failed=is_upstream_failure(e))
+            raise
+        self._after_call(trial, failed=False)
+        return result
+
+    def _before_call(self):
+        """Raise CircuitOpen if the call must not go through; True if it is the half-open trial"""
+        with self.lock:
+            if self.state == self.CLOSED:
+                return False
+            remaining = self.opened_at + self.reset_timeout - time.monotonic()
+            if self.state == self.OPEN and remaining <= 0:
+                self.state = self.HALF_OPEN
+            if self.state == self.HALF_OPEN and not self.trial_running:
+                self.trial_running = True
+                return True
+            self._stats['rejected'] += 1
+            raise CircuitOpen(self.service, max(remaining, 1.0))
+
+    def _after_call(self, trial, failed):
+        with self.lock:
+            if trial:
+                self.trial_running = False
+            if not failed:
+                self.failures = 0
+                if trial:
+                    self.state = self.CLOSED
+                return
+            self.failures += 1
+            if trial or (self.state == self.CLOSED and self.failures >= self.failure_threshold):
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+                self._stats['opened'] += 1
+
+    def stats(self):
+        with self.lock:
+            return {'state': self.state, 'consecutive_failures': self.failures, **self._stats}
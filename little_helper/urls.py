@@ -18,7 +18,7 @@ from django.urls import path
 from django.views.generic import TemplateView
 
 # Local imports
-from . import views
+from . import async_views, views
 
 # API endpoints
 urlpatterns = [
@@ -26,4 +26,16 @@ urlpatterns = [
     path('', views.index, name='index'),
     path('transcribe/', views.transcribe, name='transcribe'),
     path('upload-to-sheet/', views.upload_to_sheet, name='upload_to_sheet'),
+    path('transcribe-and-merge/', views.transcribe_and_merge, name='transcribe_and_merge'),
+    path('transcribe-batch/', views.transcribe_batch, name='transcribe_batch'),
+    path('bulk-upload/', views.bulk_upload, name='bulk_upload'),
+    path('async/transcribe/', async_views.transcribe_async, name='transcribe_async'),
+    path('async/upload-to-sheet/', async_views.upload_to_sheet_async, name='upload_to_sheet_async'),
+    path('client-pool/', views.client_pool_stats, name='client_pool_stats'),
+    path('transcript-cache/', views.transcript_cache_stats, name='transcript_cache_stats'),
+    path('metrics', views.metrics, name='metrics'),
+    path('queued-rows/<int:row_id>/', views.queued_row_status, name='queued_row_status'),
+    path('inventory/', views.inventory, name='inventory'),
+    path('search/', views.search, name='search'),
+    path('search/voice/', views.voice_search, name='voice_search'),
 ]
@@ -2,36 +2,157 @@ from django.shortcuts import render
 from django.http import HttpResponse, JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.http import require_http_methods
+import contextvars
 import json
+import math
 import os
 from datetime import datetime
-from google.cloud import speech_v1
-from google.oauth2.service_account import Credentials
-from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 from io import BytesIO
 import string
-import re
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from .audio import AudioPreprocessor
+from .clients import ClientPool, load_credentials
+from .index_page import index_page, page_response
+from . import bulk, drafts, images, mirror, parser, timing
+from .models import AppendedRow, InventoryItem, QueuedRow
+from .recognition import RecognitionConfigs
+from .search import inventory_index
+from .sheet_queue import SheetWriteQueue
+from .shards import ShardRouter, parse_routes
+from .sheets import quote_tab, row_range
+from .transcript_cache import TranscriptCache, audio_fingerprint, backend_from_settings
+from .uploads import MultipartBody, upload_error, uploads_in_order
+from .hedging import Hedger
+from .upstreams import RESULTS, CircuitBreaker, Overloaded, UpstreamScheduler, check_response
 
 # Configuration
 GOOGLE_SHEET_ID = '1YjT7Etx4xtzvkOchAy6rWT7p17pINBLZG29lIePnoN4'
 GOOGLE_SHEET_NAME = 'common'
+IMGBB_UPLOAD_URL = os.getenv('IMGBB_UPLOAD_URL', 'https://api.imgbb.com/1/upload')
+# Audio per streaming_recognize request when a large upload is streamed from disk
+SPEECH_STREAM_CHUNK_SIZE = 16 * 1024
+# Longest audio recognize accepts; longer preprocessed audio is streamed
+SPEECH_SYNC_MAX_SECONDS = 55
+# Most locations a search answers with
+SEARCH_MAX_LIMIT = 100
 # Set DEBUG to True for development, False for production
 DEBUG = os.getenv('DEBUG', 'True').lower() in ('true', '1', 'yes')
 
-# Get credentials
+# Credentials, loaded by the client pool when the first Google client is built
 CREDENTIALS_PATH = os.getenv('GOOGLE_CREDENTIALS_PATH', os.path.join(os.path.dirname(__file__), '..', 'credentials.json'))
 GOOGLE_CREDENTIALS_JSON = os.getenv('GOOGLE_CREDENTIALS_JSON')
 
-if GOOGLE_CREDENTIALS_JSON:
-    import json
-    creds = Credentials.from_service_account_info(json.loads(GOOGLE_CREDENTIALS_JSON), scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/cloud-platform'])
+# Google clients are built once per worker and shared by all requests; the
+# SDKs and the credentials are loaded with the first client (or the prewarm)
+if settings.FAKE_GOOGLE_SERVICES:
+    from . import fakes
+    speech_latency = settings.FAKE_SPEECH_LATENCY
+    if settings.FAKE_SPEECH_STALL_RATE:
+        speech_latency = fakes.FakeLatency(speech_latency, settings.FAKE_SPEECH_STALL, settings.FAKE_SPEECH_STALL_RATE)
+    client_pool = fakes.fake_client_pool(speech_latency, settings.FAKE_SHEETS_LATENCY)
 else:
-    os.environ['GOOGLE_APPLICATION_CREDENTIALS'] = CREDENTIALS_PATH
-    creds = Credentials.from_service_account_file(
-        CREDENTIALS_PATH,
-        scopes=['https://www.googleapis.com/auth/spreadsheets', 'https://www.googleapis.com/auth/cloud-platform']
-    )
+    client_pool = ClientPool(credentials_loader=partial(load_credentials, GOOGLE_CREDENTIALS_JSON, CREDENTIALS_PATH))
+
+# Every Sheets, Speech and imgbb call goes through the scheduler, which keeps
+# within each service's requests-per-minute budget and retries throttled calls
+scheduler = UpstreamScheduler(
+    settings.UPSTREAM_REQUESTS_PER_MINUTE,
+    burst_seconds=settings.UPSTREAM_BURST_SECONDS,
+    max_wait=settings.UPSTREAM_MAX_WAIT,
+    max_retries=settings.UPSTREAM_MAX_RETRIES,
+    backoff_base=settings.UPSTREAM_BACKOFF_BASE,
+    backoff_max=settings.UPSTREAM_BACKOFF_MAX,
+    deadline=settings.UPSTREAM_RETRY_DEADLINE
+)
+
+# Slow recognize calls are hedged, and Speech calls fail fast while the service is unhealthy
+speech_hedger = Hedger(
+    percentile=settings.SPEECH_HEDGE_PERCENTILE,
+    initial_delay=settings.SPEECH_HEDGE_INITIAL_DELAY,
+    min_delay=settings.SPEECH_HEDGE_MIN_DELAY,
+    max_ratio=settings.SPEECH_HEDGE_MAX_RATIO,
+    workers=settings.SPEECH_HEDGE_WORKERS,
+    enabled=settings.SPEECH_HEDGING
+)
+speech_breaker = CircuitBreaker(
+    'speech', failure_threshold=settings.SPEECH_BREAKER_FAILURES, reset_timeout=settings.SPEECH_BREAKER_RESET
+)
+
+# RecognitionConfig with phrase hints from the inventory, rebuilt when its vocabulary changes
+recognition_configs = RecognitionConfigs(
+    inventory_index.vocabulary,
+    lambda: inventory_index.vocabulary_version,
+    profile=settings.SPEECH_PROFILE,
+    max_phrases=settings.SPEECH_MAX_PHRASES,
+    boost=settings.SPEECH_PHRASE_BOOST,
+    command_boost=settings.SPEECH_COMMAND_BOOST,
+    refresh_interval=settings.SPEECH_CONFIG_REFRESH
+)
+
+# Silence trimming and resampling of WAV uploads
+audio_preprocessor = AudioPreprocessor(
+    enabled=settings.AUDIO_PREPROCESSING,
+    target_rate=settings.AUDIO_TARGET_SAMPLE_RATE,
+    range_db=settings.AUDIO_VAD_RANGE_DB,
+    floor_db=settings.AUDIO_VAD_FLOOR_DB,
+    padding=settings.AUDIO_TRIM_PADDING,
+    max_pause=settings.AUDIO_MAX_PAUSE
+)
+
+# Threads transcribing the clips of /transcribe-batch/ requests
+batch_executor = ThreadPoolExecutor(max_workers=settings.TRANSCRIBE_BATCH_WORKERS, thread_name_prefix='transcribe-batch')
+
+# Transcripts of recently posted clips, so retried uploads are not transcribed again
+transcript_cache = TranscriptCache(backend_from_settings())
+
+# Drafts of the row being dictated, per browser session
+draft_store = drafts.DraftStore(drafts.backend_from_settings())
+
+def journaled_tabs():
+    """Tabs the journal has rows of, i.e. the tabs this app appended to"""
+    return AppendedRow.objects.order_by().values_list('sheet', flat=True).distinct()
+
+# Tab (or spreadsheet) that the rows of each storage go to
+shard_router = ShardRouter(
+    GOOGLE_SHEET_ID, GOOGLE_SHEET_NAME,
+    routes=parse_routes(settings.SHEET_ROUTES),
+    by_storage=settings.SHEET_SHARD_BY_STORAGE,
+    sheets=lambda: client_pool.sheets(),
+    call=lambda *args, **kwargs: scheduler.call(*args, **kwargs),
+    known_tabs=journaled_tabs,
+    tabs_ttl=settings.SHEET_TABS_TTL,
+    workers=settings.SHEET_FAN_OUT_WORKERS
+)
+
+# Write-behind queue used when settings.SHEET_WRITE_BEHIND is enabled
+sheet_queue = SheetWriteQueue(
+    lambda values: append_rows(values),
+    route=lambda values: shard_router.shard_for(values[0]),
+    batch_size=settings.SHEET_BATCH_SIZE,
+    max_delay=settings.SHEET_BATCH_MAX_DELAY,
+    max_attempts=settings.SHEET_QUEUE_MAX_ATTEMPTS,
+    claim_lease=settings.SHEET_QUEUE_CLAIM_LEASE
+)
+
+def credentials_missing():
+    return not settings.FAKE_GOOGLE_SERVICES and not GOOGLE_CREDENTIALS_JSON and not os.path.exists(CREDENTIALS_PATH)
+
+def prewarm():
+    """Load the Speech SDK and the credentials and build the pooled clients, ahead of the first request"""
+    recognition_config()
+    client_pool.warm()
+
+def prewarm_in_background():
+    """Prewarm in a daemon thread after the worker has booted; without credentials there is nothing to load"""
+    if credentials_missing():
+        return None
+    return client_pool.warm_in_background(prewarm)
 
 def parse_voice_input(text):
     """
@@ -39,138 +160,255 @@ def parse_voice_input(text):
     Looks for keywords 'storage', 'shelf', 'keywords' and takes all words after each until a dot (.) or the next keyword.
     Returns dict with values or error.
     """
-    # Use regex to extract fields: match after keyword up to next keyword or end, non-greedy
-    storage = None
-    shelf = None
-    keywords = None
-    # Storage: after 'storage' up to 'shelf', 'keyword(s)', punctuation, or end
-    storage_match = re.search(r'storage\s+(.*?)(?=\b(shelf|keywords?)\b|[.?!,;]|$)', text, re.IGNORECASE)
-    if storage_match:
-        storage = storage_match.group(1).strip(' .,:;\n\t') or None
-    # Shelf: after 'shelf' (optionally followed by punctuation or end), up to next keyword, punctuation, or end
-    shelf_match = re.search(r'shelf(?:\s+|[.?!,;])?(.*?)(?=\b(storage|keywords?)\b|[.?!,;]|$)', text, re.IGNORECASE)
-    if shelf_match:
-        shelf = shelf_match.group(1).strip(' .,:;\n\t') or None
-    # Keywords: after 'keyword' or 'keywords' up to 'storage', 'shelf', punctuation, or end
-    keyword_match = re.search(r'key(?:word|words)\s+(.*?)(?=\b(storage|shelf)\b|[.?!,;]|$)', text, re.IGNORECASE)
-    if keyword_match:
-        keywords = keyword_match.group(1).strip(' .,:;\n\t') or None
-
-    # Add debug info for _match variables
-    debug_matches = None
-    if DEBUG:
-        debug_matches = {
-            'storage_match': storage_match.group(0) if storage_match else None,
-            'shelf_match': shelf_match.group(0) if shelf_match else None,
-            'keyword_match': keyword_match.group(0) if keyword_match else None,
-            'text': text,
-            'storage': storage,
-            'shelf': shelf,
-            'keywords': keywords
-        }
+    return parser.parse_voice_input(text, debug=DEBUG)
+
+def parse_many(texts):
+    """parse_voice_input for a batch of transcripts"""
+    return parser.parse_many(texts, debug=DEBUG)
+
+def client_pool_stats(request):
+    """Report how often requests reused a pooled Google client"""
+    return JsonResponse({
+        'success': True,
+        **client_pool.stats()
+    })
+
+def transcript_cache_stats(request):
+    """Report how often a transcription was answered from the transcript cache"""
+    return JsonResponse({
+        'success': True,
+        **transcript_cache.stats()
+    })
+
+def metrics(request):
+    """Stage and request timings, client pool, transcript cache, upstream, hedging, breaker, config, audio and shard counters in the Prometheus text format"""
+    pool = client_pool.stats()
+    cache = transcript_cache.stats()
+    lines = [
+        '# HELP little_helper_client_pool_requests_total Google client requests, by whether a pooled client was reused',
+        '# TYPE little_helper_client_pool_requests_total counter',
+    ]
+    for client in ('speech', 'sheets'):
+        lines.append(f'little_helper_client_pool_requests_total{{client="{client}",result="hit"}} {pool[client]["hits"]}')
+        lines.append(f'little_helper_client_pool_requests_total{{client="{client}",result="miss"}} {pool[client]["misses"]}')
+    lines += [
+        '# HELP little_helper_credential_refreshes_total Google access token refreshes',
+        '# TYPE little_helper_credential_refreshes_total counter',
+        f'little_helper_credential_refreshes_total {pool["credential_refreshes"]}',
+        '# HELP little_helper_transcript_cache_lookups_total Transcript cache lookups, by result',
+        '# TYPE little_helper_transcript_cache_lookups_total counter',
+    ]
+    for result in ('hits', 'misses', 'coalesced'):
+        lines.append(f'little_helper_transcript_cache_lookups_total{{result="{result}"}} {cache[result]}')
+    upstream = scheduler.stats()
+    lines += [
+        '# HELP little_helper_upstream_calls_total Upstream calls by service and result (retried counts each retry)',
+        '# TYPE little_helper_upstream_calls_total counter',
+    ]
+    for service, counts in upstream.items():
+        for result in RESULTS:
+            lines.append(f'little_helper_upstream_calls_total{{service="{service}",result="{result}"}} {counts[result]}')
+    lines += [
+        '# HELP little_helper_upstream_rate_per_minute Current request budget of each rate-limited upstream',
+        '# TYPE little_helper_upstream_rate_per_minute gauge',
+    ]
+    for service, counts in upstream.items():
+        if 'rate_per_minute' in counts:
+            lines.append(f'little_helper_upstream_rate_per_minute{{service="{service}"}} {counts["rate_per_minute"]}')
+    hedges = speech_hedger.stats()
+    breaker = speech_breaker.stats()
+    lines += [
+        '# HELP little_helper_speech_recognize_total Recognize calls, and how many were hedged or answered by the hedge',
+        '# TYPE little_helper_speech_recognize_total counter',
+        f'little_helper_speech_recognize_total{{result="all"}} {hedges["calls"]}',
+        f'little_helper_speech_recognize_total{{result="hedged"}} {hedges["hedged"]}',
+        f'little_helper_speech_recognize_total{{result="hedge_won"}} {hedges["hedge_won"]}',
+        f'little_helper_speech_recognize_total{{result="hedge_over_budget"}} {hedges["skipped_over_budget"]}',
+        '# HELP little_helper_speech_hedge_deadline_seconds Time a recognize call runs before it is hedged',
+        '# TYPE little_helper_speech_hedge_deadline_seconds gauge',
+        f'little_helper_speech_hedge_deadline_seconds {hedges["deadline_seconds"]}',
+        '# HELP little_helper_circuit_breaker_state 1 for the current state of each circuit breaker',
+        '# TYPE little_helper_circuit_breaker_state gauge',
+    ]
+    for state in CircuitBreaker.STATES:
+        lines.append(f'little_helper_circuit_breaker_state{{service="speech",state="{state}"}} {int(breaker["state"] == state)}')
+    lines += [
+        '# HELP little_helper_circuit_breaker_events_total Times a circuit breaker opened or refused a call',
+        '# TYPE little_helper_circuit_breaker_events_total counter',
+        f'little_helper_circuit_breaker_events_total{{service="speech",event="opened"}} {breaker["opened"]}',
+        f'little_helper_circuit_breaker_events_total{{service="speech",event="rejected"}} {breaker["rejected"]}',
+    ]
+    configs = recognition_configs.stats()
+    lines += [
+        '# HELP little_helper_speech_config_builds_total Times the RecognitionConfig was built',
+        '# TYPE little_helper_speech_config_builds_total counter',
+        f'little_helper_speech_config_builds_total{{profile="{configs["profile"]}"}} {configs["builds"]}',
+        '# HELP little_helper_speech_phrase_hints Phrase hints taken from the inventory in the current RecognitionConfig',
+        '# TYPE little_helper_speech_phrase_hints gauge',
+        f'little_helper_speech_phrase_hints {configs["phrases"]}',
+    ]
+    audio = audio_preprocessor.stats()
+    lines += [
+        '# HELP little_helper_audio_preprocessed_total WAV uploads trimmed and resampled, skipped (no numpy) or found silent',
+        '# TYPE little_helper_audio_preprocessed_total counter',
+        f'little_helper_audio_preprocessed_total{{result="processed"}} {audio["processed"]}',
+        f'little_helper_audio_preprocessed_total{{result="skipped"}} {audio["skipped"]}',
+        f'little_helper_audio_preprocessed_total{{result="silent"}} {audio["silent"]}',
+        '# HELP little_helper_audio_removed_seconds_total Seconds of silence not sent to Speech-to-Text',
+        '# TYPE little_helper_audio_removed_seconds_total counter',
+        f'little_helper_audio_removed_seconds_total {audio["seconds_removed"]}',
+        '# HELP little_helper_audio_removed_bytes_total Upload bytes not sent to Speech-to-Text after trimming and resampling',
+        '# TYPE little_helper_audio_removed_bytes_total counter',
+        f'little_helper_audio_removed_bytes_total {audio["bytes_removed"]}',
+    ]
+    shards = shard_router.stats()
+    lines += [
+        '# HELP little_helper_sheet_shard_events_total Tab list reads, tabs created and reads fanned out across shards',
+        '# TYPE little_helper_sheet_shard_events_total counter',
+        f'little_helper_sheet_shard_events_total{{event="tab_list_read"}} {shards["tab_list_reads"]}',
+        f'little_helper_sheet_shard_events_total{{event="tab_created"}} {shards["tabs_created"]}',
+        f'little_helper_sheet_shard_events_total{{event="fan_out"}} {shards["fan_outs"]}',
+    ]
+    return HttpResponse(
+        '\n'.join(lines) + '\n' + timing.registry.render(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
+
+REVERT_STEP_WORDS = {
+    'one': 1, 'two': 2, 'three': 3, 'four': 4, 'five': 5,
+    'six': 6, 'seven': 7, 'eight': 8, 'nine': 9, 'ten': 10
+}
+
+def revert_steps(words):
+    """Number of entries to revert, e.g. 'revert 3' or 'revert three'. Defaults to 1."""
+    index = words.index('revert')
+    for word in words[index + 1:index + 3]:
+        if word.isdigit() and int(word) > 0:
+            return int(word)
+        if word in REVERT_STEP_WORDS:
+            return REVERT_STEP_WORDS[word]
+    return 1
+
+def index(request):
+    """index.html from the in-memory cache, compressed and with validators for conditional requests"""
+    return page_response(request, index_page)
+
+def recognition_config(encoding='WEBM_OPUS', sample_rate_hertz=48000):
+    """RecognitionConfig shared by the upload and streaming transcription paths, cached until the vocabulary changes"""
+    return recognition_configs.config(encoding, sample_rate_hertz)
+
+def recognize_audio(audio_content, config=None):
+    """Transcribe raw audio bytes with Google Cloud Speech-to-Text and return the transcript"""
+    from google.cloud import speech_v1
+    # Get the pooled Speech-to-Text client
+    client = client_pool.speech()
+    
+    # Configure audio
+    audio = speech_v1.RecognitionAudio(content=audio_content)
+    config = config or recognition_config()
     
-    missing = []
-    invalid_values = {}
+    # Perform transcription, sending it again if it is slower than usual. The hedge
+    # is the only second try, and every attempt that fails counts against the breaker
+    def attempt():
+        return speech_breaker.call(
+            scheduler.call, 'speech', client.recognize, config=config, audio=audio,
+            timeout=settings.SPEECH_TIMEOUT, stage='speech', max_retries=0
+        )
+    response = speech_hedger.call(attempt)
     
-    if not storage:
-        missing.append('storage')
-    if not shelf:
-        missing.append('shelf')
-    elif not re.match(r'^[A-Z]\d+$', shelf.upper()):
-        invalid_values['shelf'] = shelf
-    if not keywords:
-        missing.append('keywords')
+    # Extract transcript
+    transcript = ""
+    for result in response.results:
+        if result.alternatives:
+            transcript += result.alternatives[0].transcript + " "
     
-    if missing or invalid_values:
-        error_parts = []
-        if missing:
-            error_parts.append(f'Missing values for: {", ".join(missing)}.')
-        if invalid_values:
-            for field, value in invalid_values.items():
-                if field == 'shelf':
-                    error_parts.append(f'Invalid shelf format: "{value}". Shelf must be like A1, B5 (letter followed by number).')
-        resp = {
-            'error': ' '.join(error_parts),
-            'parsed_text': text
-        }
-        if DEBUG:
-            resp['debug_matches'] = debug_matches
-        return resp
-
-    resp = {
-        'storage': storage,
-        'shelf': shelf,
-        'keywords': keywords,
-        'parsed_text': text
-    }
-    if DEBUG:
-        resp['debug_matches'] = debug_matches
-    return resp
+    return transcript.strip()
 
-def index(request):
-    with open('index.html', 'r') as file:
-        html_content = file.read()
-    return HttpResponse(html_content)
+def recognize_audio_chunks(chunks, config=None):
+    """Transcribe audio given as byte chunks with streaming_recognize, holding one chunk in memory at a time"""
+    from google.cloud import speech_v1
+    client = client_pool.speech()
+    streaming_config = speech_v1.StreamingRecognitionConfig(config=config or recognition_config())
+    audio_requests = (speech_v1.StreamingRecognizeRequest(audio_content=chunk) for chunk in chunks)
+
+    def stream():
+        transcript = ""
+        for response in client.streaming_recognize(streaming_config, audio_requests):
+            for result in response.results:
+                if result.is_final and result.alternatives:
+                    transcript += result.alternatives[0].transcript + " "
+        return transcript.strip()
+
+    # The chunks are consumed by the first attempt, so the stream is not retried
+    return speech_breaker.call(scheduler.call, 'speech', stream, stage='speech', max_retries=0)
+
+def recognize_upload(audio_file):
+    """
+    Transcribe an uploaded audio file; files spooled to disk are streamed instead of read into memory.
+    A clip that was transcribed before with the same config is answered from the transcript cache.
+    """
+    wav = audio_preprocessor.wav_format(audio_file)
+    if wav is None:
+        config = recognition_config()
+    else:
+        # Preprocessed WAV is sent as raw LINEAR16 mono at the output rate
+        config = recognition_config('LINEAR16', audio_preprocessor.output_rate(wav))
+    with timing.stage('fingerprint'):
+        key = audio_fingerprint(audio_file.chunks(settings.UPLOAD_CHUNK_SIZE), config)
+
+    def transcribe():
+        if wav is not None:
+            return recognize_preprocessed(audio_file, config)
+        if audio_file.multiple_chunks(settings.FILE_UPLOAD_MAX_MEMORY_SIZE):
+            return recognize_audio_chunks(audio_file.chunks(SPEECH_STREAM_CHUNK_SIZE), config)
+        audio_file.seek(0)
+        return recognize_audio(audio_file.read(), config)
+
+    return transcript_cache.get_or_transcribe(key, transcribe)
+
+def recognize_preprocessed(audio_file, config):
+    """Trim and resample a WAV upload, then transcribe what is left; nothing is sent for a silent clip"""
+    with timing.stage('preprocess'):
+        processed = audio_preprocessor.process(audio_file)
+    audio = processed.audio
+    if not audio:
+        return ''
+    # Two bytes per LINEAR16 sample
+    if len(audio) > SPEECH_SYNC_MAX_SECONDS * processed.sample_rate * 2:
+        return recognize_audio_chunks(
+            (audio[start:start + SPEECH_STREAM_CHUNK_SIZE] for start in range(0, len(audio), SPEECH_STREAM_CHUNK_SIZE)),
+            config
+        )
+    return recognize_audio(audio, config)
+
+def audio_upload_error(request):
+    """Error response if the audio upload is missing or too large, otherwise None"""
+    with timing.stage('read_upload'):
+        audio_file = request.FILES.get('audio')
+    error = upload_error(request, 'audio')
+    if error:
+        return JsonResponse({
+            'success': False,
+            'error': error
+        })
+    if not audio_file:
+        return JsonResponse({
+            'success': False,
+            'error': 'No audio file provided'
+        })
+    return None
 
 @csrf_exempt
 @require_http_methods(["POST"])
 def transcribe(request):
     """Convert audio to text using Google Cloud Speech-to-Text"""
     try:
-        audio_file = request.FILES.get('audio')
-        if not audio_file:
-            return JsonResponse({
-                'success': False,
-                'error': 'No audio file provided'
-            })
-        
-        # Read audio data
-        audio_content = audio_file.read()
+        error_response = audio_upload_error(request)
+        if error_response:
+            return error_response
         
-        # Initialize Speech-to-Text client
-        client = speech_v1.SpeechClient(credentials=creds)
-        
-        # Configure audio
-        audio = speech_v1.RecognitionAudio(content=audio_content)
-        config = speech_v1.RecognitionConfig(
-            encoding=speech_v1.RecognitionConfig.AudioEncoding.WEBM_OPUS,
-            sample_rate_hertz=48000,
-            language_code="en-US",
-            enable_automatic_punctuation=False,
-            use_enhanced=True,
-            model="latest_short",
-            max_alternatives=3,
-            alternative_language_codes=["en-GB", "en-AU", "en-CA"],
-            speech_contexts=[
-                speech_v1.SpeechContext(
-                    phrases=[
-                        "storage", "shelf", "keyword", "keywords", "revert",
-                        "terrace", "basement", "small house", "house", "Bracigovo",
-                        "barrack", "basement apartment", "basement house", "attic"
-
-                        "box", "electronics", "cables", "tools", "toys",
-                        "clothes", "books", "furniture", "kitchen", "shoes", "bags",
-                        
-                         "A0", "A1", "A2", "A3", "A4", "A5",
-                            "B0", "B1", "B2", "B3", "B4", "B5",
-                            "C0", "C1", "C2", "C3", "C4", "C5",
-                            "D0", "D1", "D2", "D3", "D4", "D5",
-                    ],
-                    boost=15.0
-                )
-            ]
-        )
-        
-        # Perform transcription
-        response = client.recognize(config=config, audio=audio)
-        
-        # Extract transcript
-        transcript = ""
-        for result in response.results:
-            if result.alternatives:
-                transcript += result.alternatives[0].transcript + " "
-        
-        transcript = transcript.strip()
+        # Perform transcription, streaming large files from disk
+        transcript = recognize_upload(request.FILES['audio'])
         
         if not transcript:
             return JsonResponse({
@@ -183,6 +421,8 @@ def transcribe(request):
             'transcript': transcript
         })
         
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return JsonResponse({
             'success': False,
@@ -191,21 +431,312 @@ def transcribe(request):
 
 @csrf_exempt
 @require_http_methods(["POST"])
-def upload_to_sheet(request):
-    """Upload transcribed text to Google Sheets or revert last entry, or just parse and merge fields if requested. Optionally upload an image to the 'picture' cell."""
+def transcribe_batch(request):
+    """
+    Transcribe the 'audio' clips of one multipart request concurrently, e.g. entries recorded offline and synced later.
+    With 'parse' each transcript is also parsed. Results and errors are returned per clip, in the order the clips were sent.
+    """
+    try:
+        with timing.stage('read_upload'):
+            clips = uploads_in_order(request, 'audio')
+        if not clips:
+            return JsonResponse({
+                'success': False,
+                'error': 'No audio file provided'
+            })
+        if len(clips) > settings.TRANSCRIBE_BATCH_MAX_CLIPS:
+            return JsonResponse({
+                'success': False,
+                'error': f'At most {settings.TRANSCRIBE_BATCH_MAX_CLIPS} clips can be sent at once, not {len(clips)}'
+            })
+        parse = request.POST.get('parse', 'false').lower() in ('true', '1', 'yes')
+
+        # Built here, so the workers do not each wait for the vocabulary to load
+        recognition_config()
+        # Each clip runs in a copy of the request's context, so its timing stages are reported with the request
+        futures = [
+            None if clip is None else batch_executor.submit(contextvars.copy_context().run, recognize_upload, clip)
+            for clip in clips
+        ]
+        results = [batch_clip_result(request, position, clip, future) for position, (clip, future) in enumerate(zip(clips, futures))]
+
+        if parse:
+            transcribed = [result for result in results if result['success']]
+            for result, parsed in zip(transcribed, parse_many([result['transcript'] for result in transcribed])):
+                result['parsed'] = parsed
+
+        return JsonResponse({
+            'success': True,
+            'transcribed': sum(result['success'] for result in results),
+            'failed': sum(not result['success'] for result in results),
+            'clips': results
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+def batch_clip_result(request, position, clip, future):
+    """Transcript or error of one clip of a batch, waiting for its transcription"""
+    if future is None:
+        return {
+            'index': position,
+            'success': False,
+            'error': upload_error(request, 'audio')
+        }
+    result = {'index': position, 'name': clip.name, 'success': False}
+    try:
+        transcript = future.result()
+    except Overloaded as e:
+        result.update(error=str(e), overloaded=True, retry_after=max(math.ceil(e.retry_after), 1))
+    except Exception as e:
+        result['error'] = str(e)
+    else:
+        if transcript:
+            result.update(success=True, transcript=transcript)
+        else:
+            result['error'] = 'Could not transcribe audio'
+    return result
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def transcribe_and_merge(request):
+    """
+    Transcribe a clip (or take the text of one), parse it and merge it into this session's draft in one request.
+    POST multipart 'audio' or JSON/form 'text'; 'reset' starts a new draft first. GET returns the current draft.
+    """
     try:
+        if request.method == 'GET':
+            return JsonResponse({
+                'success': True,
+                **draft_store.get(request)
+            })
+
+        if request.content_type and request.content_type.startswith('multipart/'):
+            text = request.POST.get('text')
+            reset = request.POST.get('reset', 'false').lower() in ('true', '1', 'yes')
+        else:
+            data = json.loads(request.body or '{}')
+            text = data.get('text')
+            reset = bool(data.get('reset', False))
+
+        if reset:
+            draft_store.clear(request)
+
+        if not text:
+            error_response = audio_upload_error(request)
+            if error_response:
+                return error_response
+            text = recognize_upload(request.FILES['audio'])
+            if not text:
+                return JsonResponse({
+                    'success': False,
+                    'error': 'Could not transcribe audio'
+                })
+
+        # A spoken "revert" reverts the last uploaded rows, as on /upload-to-sheet/
+        try:
+            revert_steps_count = revert_command_steps(text)
+        except ValueError as e:
+            return revert_steps_error(e)
+        if revert_steps_count:
+            return revert_last_entry(revert_steps_count)
+
+        merged = merge_fields(text, draft_store.get(request))
+        draft_store.save(request, merged)
+        return JsonResponse({
+            'success': True,
+            'transcript': text,
+            **merged
+        })
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+class ImageUploadError(Exception):
+    pass
+
+def read_upload_request(request):
+    """Read text, current_state, do_upload, steps and the optional image from a JSON or multipart request"""
+    with timing.stage('decode'):
         # Support both JSON and multipart/form-data
         if request.content_type and request.content_type.startswith('multipart/'):
             text = request.POST.get('text')
+            if upload_error(request, 'image'):
+                raise ImageUploadError(upload_error(request, 'image'))
             current_state = json.loads(request.POST.get('current_state', '{}'))
             do_upload = request.POST.get('do_upload', 'true').lower() in ('true', '1', 'yes')
+            steps = request.POST.get('steps')
             image_file = request.FILES.get('image')
         else:
             data = json.loads(request.body)
             text = data.get('text')
             current_state = data.get('current_state', {})
             do_upload = data.get('do_upload', True)
+            steps = data.get('steps')
             image_file = None
+    return text, current_state, do_upload, steps, image_file
+
+def revert_command_steps(text, steps=None):
+    """
+    Number of entries to revert if the text is a revert command, otherwise None.
+    Raises ValueError unless it is between 1 and REVERT_MAX_STEPS.
+    """
+    words = [word.strip(string.punctuation).lower() for word in text.split()]
+    if 'revert' not in words:
+        return None
+    try:
+        count = int(steps or revert_steps(words))
+    except (TypeError, ValueError):
+        count = 0
+    if not 1 <= count <= settings.REVERT_MAX_STEPS:
+        raise ValueError(f'Revert between 1 and {settings.REVERT_MAX_STEPS} entries at a time')
+    return count
+
+def revert_steps_error(error):
+    return JsonResponse({
+        'success': False,
+        'error': str(error),
+        'parsed_text': 'revert'
+    }, status=400)
+
+def merge_fields(text, current_state):
+    """Parse the voice input (may be partial) and merge it into the current state"""
+    with timing.stage('parse'):
+        # The matches are needed to merge a partial transcript, whether or not they are reported
+        parsed = parser.parse_voice_input(text, debug=True)
+    debug_matches = parsed['debug_matches']
+
+    # Only update a field if its _match variable is present in the new parse; otherwise, keep previous value
+    merged = {
+        'storage': current_state.get('storage', ''),
+        'shelf': current_state.get('shelf', ''),
+        'keywords': current_state.get('keywords', ''),
+        'debug_matches': debug_matches if DEBUG else {}
+    }
+    # Only update if new value is not None and not empty string; a partial
+    # transcript fails validation, so the values come from the matches
+    if debug_matches.get('storage_match') and debug_matches.get('storage') not in (None, ''):
+        merged['storage'] = debug_matches['storage']
+    if debug_matches.get('shelf_match') and debug_matches.get('shelf') not in (None, ''):
+        merged['shelf'] = debug_matches['shelf']
+    if debug_matches.get('keyword_match') and debug_matches.get('keywords') not in (None, ''):
+        merged['keywords'] = debug_matches['keywords']
+    merged['parsed_text'] = f"Storage {merged['storage']}. Shelf {merged['shelf']}. Keywords {merged['keywords']}"
+    return merged
+
+def merged_error_response(merged):
+    """Error response if a merged row is missing fields or has an invalid shelf, otherwise None"""
+    error = parser.validation_error(merged['storage'], merged['shelf'], merged['keywords'])
+    if error is None:
+        return None
+    return JsonResponse({
+        'success': False,
+        'error': error,
+        'parsed_text': merged['parsed_text'],
+        'debug_matches': merged['debug_matches']
+    })
+
+def imgbb_body(image_file):
+    """Streaming multipart body for the imgbb upload; imgbb accepts the binary file, so no base64 copy is made"""
+    IMGBB_API_KEY = os.getenv('IMGBB_API_KEY')
+    if not IMGBB_API_KEY:
+        raise ImageUploadError('IMGBB_API_KEY not set in environment.')
+    return MultipartBody({'key': IMGBB_API_KEY}, 'image', image_file)
+
+def image_url(response):
+    """URL of the uploaded image from the imgbb response (from requests or httpx)"""
+    if response.status_code == 200:
+        return response.json()['data']['url']
+    raise ImageUploadError('Image upload failed: ' + response.text)
+
+def image_formula(url):
+    return f'=IMAGE("{url}")'
+
+def upload_image(image_file):
+    """
+    Upload an image file (or bytes) to imgbb, unless the same photo was uploaded before.
+    Returns the =IMAGE() formula for the picture cell and the images.PreparedImage report.
+    """
+    import requests
+    image = images.PreparedImage(image_file)
+    with timing.stage('image_lookup'):
+        cached = images.lookup(image)
+    if cached is None:
+        with timing.stage('image_process'):
+            images.process(image)
+        with image.step('upload'):
+            body = imgbb_body(image.upload_file())
+            # The body rewinds the file when it is sent again
+            response = scheduler.call(
+                'imgbb', lambda: check_response(requests.post(IMGBB_UPLOAD_URL, data=body, headers=body.headers())),
+                stage='imgbb'
+            )
+        with timing.stage('image_save'):
+            images.remember(image, image_url(response))
+    return image_formula(image.url), image.report()
+
+def stored_row_response(merged, picture_url, updates=None, queued_row=None, image=None):
+    """Response for a row that was appended to the sheet or queued for a later append"""
+    if queued_row is not None:
+        response = {
+            'success': True,
+            'message': 'Data queued for upload',
+            'queued': True,
+            'queued_row_id': queued_row.id,
+            'storage': merged['storage'],
+            'shelf': merged['shelf'],
+            'keywords': merged['keywords'],
+            'picture_url': picture_url,
+            'parsed_text': merged['parsed_text']
+        }
+    else:
+        response = {
+            'success': True,
+            'message': 'Data uploaded successfully',
+            'storage': merged['storage'],
+            'shelf': merged['shelf'],
+            'keywords': merged['keywords'],
+            'picture_url': picture_url,
+            'parsed_text': merged['parsed_text'],
+            'result': updates
+        }
+    if image is not None:
+        response['image'] = image
+    return JsonResponse(response)
+
+def overloaded_response(error, **extra):
+    """503 with Retry-After for a call refused by the upstream scheduler"""
+    retry_after = max(math.ceil(error.retry_after), 1)
+    response = JsonResponse({
+        'success': False,
+        'overloaded': True,
+        'error': str(error),
+        'retry_after': retry_after,
+        **extra
+    }, status=503)
+    response['Retry-After'] = str(retry_after)
+    return response
+
+def credentials_missing_response():
+    return JsonResponse({
+        'success': False,
+        'error': f'Credentials file not found at {CREDENTIALS_PATH}. Please add your credentials.json file or set GOOGLE_CREDENTIALS_JSON.'
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def upload_to_sheet(request):
+    """Upload transcribed text to Google Sheets or revert last entry, or just parse and merge fields if requested. Optionally upload an image to the 'picture' cell."""
+    try:
+        text, current_state, do_upload, steps, image_file = read_upload_request(request)
 
         if not text:
             return JsonResponse({
@@ -214,58 +745,14 @@ def upload_to_sheet(request):
             })
 
         # Check if it's a revert command
-        words = [word.strip(string.punctuation).lower() for word in text.split()]
-        if 'revert' in words:
-            return revert_last_entry()
-
-        # Parse the voice input (may be partial)
-        parsed = parse_voice_input(text)
-        debug_matches = parsed.get('debug_matches', {})
-
-        # Only update a field if its _match variable is present in the new parse; otherwise, keep previous value
-        merged = {
-            'storage': current_state.get('storage', ''),
-            'shelf': current_state.get('shelf', ''),
-            'keywords': current_state.get('keywords', ''),
-            'debug_matches': debug_matches
-        }
-        # Only update if new value is not None and not empty string
-        if debug_matches.get('storage_match') and parsed.get('storage') not in (None, ''):
-            merged['storage'] = parsed.get('storage')
-        if debug_matches.get('shelf_match') and parsed.get('shelf') not in (None, ''):
-            merged['shelf'] = parsed.get('shelf')
-        if debug_matches.get('keyword_match') and parsed.get('keywords') not in (None, ''):
-            merged['keywords'] = parsed.get('keywords')
-        merged['parsed_text'] = f"Storage {merged['storage']}. Shelf {merged['shelf']}. Keywords {merged['keywords']}"
+        try:
+            revert_steps_count = revert_command_steps(text, steps)
+        except ValueError as e:
+            return revert_steps_error(e)
+        if revert_steps_count:
+            return revert_last_entry(revert_steps_count)
 
-        # Only check for missing/invalid fields if actually uploading
-
-        missing = []
-        invalid_values = {}
-        if do_upload:
-            if not merged['storage']:
-                missing.append('storage')
-            if not merged['shelf']:
-                missing.append('shelf')
-            elif not re.match(r'^[A-Z]\d+$', merged['shelf'].upper()):
-                invalid_values['shelf'] = merged['shelf']
-            if not merged['keywords']:
-                missing.append('keywords')
-
-            if missing or invalid_values:
-                error_parts = []
-                if missing:
-                    error_parts.append(f'Missing values for: {", ".join(missing)}.')
-                if invalid_values:
-                    for field, value in invalid_values.items():
-                        if field == 'shelf':
-                            error_parts.append(f'Invalid shelf format: "{value}". Shelf must be like A1, B5 (letter followed by number).')
-                return JsonResponse({
-                    'success': False,
-                    'error': ' '.join(error_parts),
-                    'parsed_text': merged['parsed_text'],
-                    'debug_matches': debug_matches
-                })
+        merged = merge_fields(text, current_state)
 
         if not do_upload:
             # Just return the merged result for preview
@@ -274,121 +761,395 @@ def upload_to_sheet(request):
                 **merged
             })
 
-
-        # Otherwise, upload to sheet
-        storage = merged['storage']
-        shelf = merged['shelf']
-        keywords = merged['keywords']
-        picture_url = ''
+        # Only check for missing/invalid fields if actually uploading
+        error_response = merged_error_response(merged)
+        if error_response:
+            return error_response
 
         # If image is present, upload to imgbb and get URL, then wrap in IMAGE formula
+        picture_url = ''
+        image = None
         if image_file:
-            import requests
-            IMGBB_API_KEY = os.getenv('IMGBB_API_KEY')
-            if not IMGBB_API_KEY:
-                return JsonResponse({'success': False, 'error': 'IMGBB_API_KEY not set in environment.'})
-            img_data = image_file.read()
-            import base64
-            encoded_image = base64.b64encode(img_data).decode('utf-8')
-            payload = {
-                'key': IMGBB_API_KEY,
-                'image': encoded_image
-            }
-            response = requests.post('https://api.imgbb.com/1/upload', data=payload)
-            if response.status_code == 200:
-                image_url = response.json()['data']['url']
-                picture_url = f'=IMAGE("{image_url}")'
-            else:
-                return JsonResponse({'success': False, 'error': 'Image upload failed: ' + response.text})
+            picture_url, image = upload_image(image_file)
+
+        # In write-behind mode the row is queued and appended later in a batch
+        if settings.SHEET_WRITE_BEHIND:
+            queued_row = sheet_queue.enqueue(merged['storage'], merged['shelf'], merged['keywords'], picture_url)
+            draft_store.clear(request)
+            return stored_row_response(merged, picture_url, queued_row=queued_row, image=image)
 
         # Load credentials
-        if not GOOGLE_CREDENTIALS_JSON and not os.path.exists(CREDENTIALS_PATH):
+        if credentials_missing():
+            return credentials_missing_response()
+
+        # Append data to sheet, now with picture_url as 4th column
+        try:
+            updates = append_rows([[merged['storage'], merged['shelf'], merged['keywords'], picture_url]])
+        except Overloaded:
+            # Sheets is over quota: hand the row to the write-behind queue, which retries it later
+            queued_row = sheet_queue.enqueue(merged['storage'], merged['shelf'], merged['keywords'], picture_url)
+            draft_store.clear(request)
+            return stored_row_response(merged, picture_url, queued_row=queued_row, image=image)
+        # The row is stored, so the next dictation starts from an empty draft
+        draft_store.clear(request)
+        return stored_row_response(merged, picture_url, updates, image=image)
+
+    except Overloaded as e:
+        return overloaded_response(e)
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def bulk_upload(request):
+    """
+    Parse a batch of transcripts or a CSV/JSONL/text file and append all valid rows in as few Sheets calls as possible.
+    JSON bodies carry {"transcripts": [...]} or {"rows": [{"storage", "shelf", "keywords", "picture"}, ...]};
+    multipart requests carry a 'file' and optionally its 'format'. With dry_run the rows are only validated.
+    """
+    try:
+        with timing.stage('decode'):
+            if request.content_type and request.content_type.startswith('multipart/'):
+                error = upload_error(request, 'file')
+                if error:
+                    return JsonResponse({
+                        'success': False,
+                        'error': error
+                    })
+                upload = request.FILES.get('file')
+                if not upload:
+                    return JsonResponse({
+                        'success': False,
+                        'error': 'No file provided'
+                    })
+                file_format = request.POST.get('format') or bulk.format_from_name(upload.name)
+                entries = bulk.entries_from_file(upload.file, file_format)
+                dry_run = request.POST.get('dry_run', 'false').lower() in ('true', '1', 'yes')
+            else:
+                data = json.loads(request.body)
+                entries = bulk.entries_from_transcripts(data.get('transcripts', data.get('rows', [])))
+                dry_run = bool(data.get('dry_run', False))
+
+        if not entries:
             return JsonResponse({
                 'success': False,
-                'error': f'Credentials file not found at {CREDENTIALS_PATH}. Please add your credentials.json file or set GOOGLE_CREDENTIALS_JSON.'
+                'error': 'No rows provided'
             })
 
-        # Build Sheets API service
-        service = build('sheets', 'v4', credentials=creds)
+        if not dry_run and credentials_missing():
+            return credentials_missing_response()
 
-        # Append data to sheet, now with picture_url as 4th column
-        values = [[storage, shelf, keywords, picture_url]]
-        body = {
-            'values': values
-        }
+        result = bulk.ingest(entries, append_rows, dry_run=dry_run, route=lambda row: shard_router.shard_for(row[0]))
+        return JsonResponse({
+            'success': 'append_error' not in result,
+            **result
+        })
+
+    except Exception as e:
+        return JsonResponse({
+            'success': False,
+            'error': str(e)
+        })
+
+@require_http_methods(["GET"])
+def queued_row_status(request, row_id):
+    """Report the status of a row in the write-behind queue"""
+    try:
+        row = QueuedRow.objects.get(id=row_id)
+    except QueuedRow.DoesNotExist:
+        return JsonResponse({
+            'success': False,
+            'error': f'Queued row {row_id} not found'
+        }, status=404)
+    return JsonResponse({
+        'success': True,
+        'queued_row_id': row.id,
+        'status': row.status,
+        'attempts': row.attempts,
+        'error': row.error,
+        'updated_range': row.updated_range,
+        'created_at': row.created_at.isoformat(),
+        'sent_at': row.sent_at.isoformat() if row.sent_at else None
+    })
+
+@require_http_methods(["GET"])
+def search(request):
+    """Answer "where is it?" queries from the in-memory keyword index"""
+    query = request.GET.get('q', '')
+    if not query.strip():
+        return JsonResponse({
+            'success': False,
+            'error': 'Missing query'
+        })
+    try:
+        limit = int(request.GET.get('limit', 10))
+    except ValueError:
+        return JsonResponse({
+            'success': False,
+            'error': 'limit must be a whole number'
+        }, status=400)
+    limit = min(max(limit, 1), SEARCH_MAX_LIMIT)
+    return JsonResponse({
+        'success': True,
+        'query': query,
+        **inventory_index.search(query, limit=limit)
+    })
+
+@csrf_exempt
+@require_http_methods(["POST"])
+def voice_search(request):
+    """Transcribe a spoken question like "where are the cables" and search for it"""
+    try:
+        error_response = audio_upload_error(request)
+        if error_response:
+            return error_response
 
-        result = service.spreadsheets().values().append(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range=f"{GOOGLE_SHEET_NAME}!A:D",
-            valueInputOption='USER_ENTERED',
-            body=body
-        ).execute()
+        transcript = recognize_upload(request.FILES['audio'])
+        if not transcript:
+            return JsonResponse({
+                'success': False,
+                'error': 'Could not transcribe audio'
+            })
 
         return JsonResponse({
             'success': True,
-            'message': 'Data uploaded successfully',
-            'storage': storage,
-            'shelf': shelf,
-            'keywords': keywords,
-            'picture_url': picture_url,
-            'parsed_text': merged['parsed_text'],
-            'result': result.get('updates', {})
+            'transcript': transcript,
+            'query': transcript,
+            **inventory_index.search(transcript)
         })
 
+    except Overloaded as e:
+        return overloaded_response(e)
     except Exception as e:
         return JsonResponse({
             'success': False,
             'error': str(e)
         })
 
-def revert_last_entry():
-    """Revert the last entry in the Google Sheet"""
+@require_http_methods(["GET"])
+def inventory(request):
+    """List mirrored inventory rows of every shard, optionally filtered by storage and shelf"""
+    items = InventoryItem.objects.filter(sheet__in=shard_router.tabs())
+    storage = request.GET.get('storage')
+    shelf = request.GET.get('shelf')
+    if storage:
+        items = items.filter(storage__iexact=storage)
+    if shelf:
+        items = items.filter(shelf__iexact=shelf)
+    return JsonResponse({
+        'success': True,
+        'items': [
+            {
+                'row': item.row_number,
+                'storage': item.storage,
+                'shelf': item.shelf,
+                'keywords': item.keywords,
+                'picture_url': item.picture
+            }
+            for item in items
+        ]
+    })
+
+def append_rows(values):
+    """Append rows to the tab of their storage and return the 'updates' part of the response; the rows must share a shard"""
+    shard = shard_router.shard_for(values[0][0])
+    if len(shard_router.group(values)) > 1:
+        raise ValueError('Rows for different shards must be appended separately')
+    shard_router.ensure_tab(shard)
+    service = client_pool.sheets()
+    request = service.spreadsheets().values().append(
+        spreadsheetId=shard.spreadsheet_id,
+        range=f"{quote_tab(shard.tab)}!A:D",
+        valueInputOption='USER_ENTERED',
+        body={'values': values}
+    )
+    # An append that failed with a 5xx may have been applied, so only throttled appends are retried
+    result = scheduler.call('sheets', request.execute, stage='sheets_append', idempotent=False)
+    updates = result.get('updates', {})
+    with timing.stage('journal'):
+        journal_rows(updates.get('updatedRange', ''), values)
+    return updates
+
+def revert_last_entry(steps=1):
+    """Revert the last entries: rows still in the write-behind queue are cancelled, the others cleared using the local row journal"""
     try:
         # Load credentials
-        if not GOOGLE_CREDENTIALS_JSON and not os.path.exists(CREDENTIALS_PATH):
+        if credentials_missing():
             return JsonResponse({
                 'success': False,
                 'error': f'Credentials file not found at {CREDENTIALS_PATH}. Please add your credentials.json file or set GOOGLE_CREDENTIALS_JSON.',
                 'parsed_text': 'revert'
             })
-        
-        # Build Sheets API service
-        service = build('sheets', 'v4', credentials=creds)
-        
-        # Get all values to find the last row
-        result = service.spreadsheets().values().get(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range=f"{GOOGLE_SHEET_NAME}!A:Z"
-        ).execute()
-        
-        values = result.get('values', [])
-        
-        if not values or len(values) == 0:
+
+        # The newest entries may still be waiting in the write-behind queue; those are
+        # cancelled there, and only the rest are cleared from the sheet
+        with timing.stage('queue'):
+            cancelled, in_flight = sheet_queue.cancel_newest(steps)
+        if in_flight:
+            return JsonResponse({
+                'success': False,
+                'error': 'The last entry is being sent to the sheet, please revert it again in a moment',
+                'cancelled_rows': [row.id for row in cancelled],
+                'parsed_text': 'revert'
+            }, status=409)
+        if len(cancelled) == steps:
+            return reverted_response([], cancelled)
+        steps -= len(cancelled)
+
+        # Get the pooled Sheets API service
+        service = client_pool.sheets()
+
+        # The journal knows exactly which rows were appended last, in whichever shard
+        tabs = shard_router.tabs()
+        with timing.stage('journal'):
+            entries = list(
+                AppendedRow.objects.filter(sheet__in=tabs, reverted=False)
+                .order_by('-id')[:steps]
+            )
+        # Fall back to reading the end of the tab appended to last if the journal cannot answer
+        if len(entries) < steps:
+            last = AppendedRow.objects.filter(sheet__in=tabs).order_by('-id').first()
+            shard = shard_router.shard_of_tab(last.sheet) if last else shard_router.default
+            with timing.stage('sheets_read'):
+                entries = find_last_rows(service, steps, shard)
+        else:
+            # Rows edited, sorted or deleted in the sheet since they were appended must not be cleared
+            with timing.stage('sheets_read'):
+                stale = journal_mismatches(service, entries)
+            if stale:
+                # Rows of a changed tab may all have moved, so its journal is dropped and
+                # the next revert reads the end of the tab instead
+                AppendedRow.objects.filter(sheet__in={entry.sheet for entry in stale}, reverted=False).delete()
+                return JsonResponse({
+                    'success': False,
+                    'error': 'The sheet was changed since the last entries were added, so nothing was reverted. '
+                             'Check the sheet and revert again.',
+                    'changed_rows': [entry.a1_range() for entry in stale],
+                    'cancelled_rows': [row.id for row in cancelled],
+                    'parsed_text': 'revert'
+                }, status=409)
+
+        if not entries and cancelled:
+            return reverted_response([], cancelled)
+        if not entries:
             return JsonResponse({
                 'success': False,
                 'error': 'No entries to revert',
                 'parsed_text': 'revert'
             })
-        
-        # Find the last non-empty row (in case there are empty rows)
-        last_row = len(values)
-        
-        # Clear the last row
-        range_to_clear = f"{GOOGLE_SHEET_NAME}!A{last_row}:C{last_row}"
-        service.spreadsheets().values().clear(
-            spreadsheetId=GOOGLE_SHEET_ID,
-            range=range_to_clear
-        ).execute()
-        
-        return JsonResponse({
-            'success': True,
-            'message': 'Last entry reverted successfully',
-            'parsed_text': 'revert'
-        })
-        
+
+        # Clear the whole rows, including the picture column, in one call per spreadsheet
+        ranges = {}
+        for entry in entries:
+            ranges.setdefault(shard_router.shard_of_tab(entry.sheet).spreadsheet_id, []).append(entry.a1_range())
+        for spreadsheet_id, spreadsheet_ranges in ranges.items():
+            scheduler.call('sheets', service.spreadsheets().values().batchClear(
+                spreadsheetId=spreadsheet_id,
+                body={'ranges': spreadsheet_ranges}
+            ).execute, stage='sheets_clear')
+
+        with timing.stage('journal'):
+            AppendedRow.objects.filter(id__in=[entry.id for entry in entries]).update(
+                reverted=True, reverted_at=timezone.now()
+            )
+            rows_by_tab = {}
+            for entry in entries:
+                rows_by_tab.setdefault(entry.sheet, []).append(entry.row_number)
+            for tab, row_numbers in rows_by_tab.items():
+                mirror.delete_rows(tab, row_numbers)
+
+        return reverted_response(entries, cancelled)
+
+    except Overloaded as e:
+        return overloaded_response(e, parsed_text='revert')
     except Exception as e:
         return JsonResponse({
             'success': False,
             'error': str(e),
             'parsed_text': 'revert'
-        })
\ No newline at end of file
+        })
+
+def reverted_response(entries, cancelled):
+    """Success response for journal entries cleared from the sheet and queued rows cancelled before they were sent"""
+    count = len(entries) + len(cancelled)
+    return JsonResponse({
+        'success': True,
+        'message': 'Last entry reverted successfully' if count == 1 else f'Last {count} entries reverted successfully',
+        'reverted_rows': [entry.row_number for entry in entries],
+        'cancelled_rows': [row.id for row in cancelled],
+        'parsed_text': 'revert'
+    })
+
+def journal_mismatches(service, entries):
+    """Journal entries whose row in the sheet no longer holds the values that were appended"""
+    by_spreadsheet = {}
+    for entry in entries:
+        by_spreadsheet.setdefault(shard_router.shard_of_tab(entry.sheet).spreadsheet_id, []).append(entry)
+    mismatches = []
+    for spreadsheet_id, spreadsheet_entries in by_spreadsheet.items():
+        # Formulas, so a picture reads back as the =IMAGE() that was appended
+        result = scheduler.call('sheets', service.spreadsheets().values().batchGet(
+            spreadsheetId=spreadsheet_id,
+            ranges=[entry.a1_range() for entry in spreadsheet_entries],
+            valueRenderOption='FORMULA'
+        ).execute)
+        value_ranges = result.get('valueRanges', [])
+        for index, entry in enumerate(spreadsheet_entries):
+            rows = value_ranges[index].get('values', []) if index < len(value_ranges) else []
+            cells = [str(cell) for cell in (rows[0] if rows else [])][:4]
+            if cells + [''] * (4 - len(cells)) != entry.values():
+                mismatches.append(entry)
+    return mismatches
+
+def find_last_rows(service, count, shard):
+    """
+    Find the last non-empty rows of a shard by reading only the end of its tab.
+    Reads a window ending past the highest journaled (or mirrored) row and widens it until
+    enough rows are found. The rows found are added to the journal.
+    """
+    anchor = AppendedRow.objects.filter(sheet=shard.tab).aggregate(Max('row_number'))['row_number__max']
+    if anchor is None:
+        # Without a journal the local mirror still knows about where the tab ends
+        anchor = InventoryItem.objects.filter(sheet=shard.tab).aggregate(Max('row_number'))['row_number__max']
+    window = count + settings.REVERT_TAIL_WINDOW
+    while True:
+        start = max(anchor - window, 1) if anchor else 1
+        result = scheduler.call('sheets', service.spreadsheets().values().get(
+            spreadsheetId=shard.spreadsheet_id,
+            range=f"{quote_tab(shard.tab)}!A{start}:D"
+        ).execute)
+        rows = [
+            (start + offset, row)
+            for offset, row in enumerate(result.get('values', []))
+            if any(cell for cell in row)
+        ]
+        if len(rows) >= count or start == 1:
+            break
+        window *= 4
+
+    entries = []
+    for row_number, row in reversed(rows[-count:]):
+        row = (row + [''] * 4)[:4]
+        entry = AppendedRow.objects.filter(sheet=shard.tab, row_number=row_number, reverted=False).first()
+        if entry is None:
+            entry = AppendedRow.objects.create(
+                sheet=shard.tab, row_number=row_number,
+                storage=row[0], shelf=row[1], keywords=row[2], picture=row[3]
+            )
+        entries.append(entry)
+    return entries
+
+def journal_rows(updated_range, values):
+    """Record appended rows in the journal and the local mirror using the range returned by the append"""
+    sheet, first_row, _ = row_range(updated_range)
+    mirror.upsert_rows(sheet, first_row, values)
+    AppendedRow.objects.bulk_create([
+        AppendedRow(
+            sheet=sheet, row_number=first_row + offset,
+            storage=row[0], shelf=row[1], keywords=row[2], picture=row[3]
+        )
+        for offset, row in enumerate(values)
+    ])
@@ -14,3 +14,15 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'little_helper.settings')
 
 application = get_wsgi_application()
+
+from django.conf import settings
+
+# Load the Google SDKs and build the pooled clients before the first request needs them
+if settings.GOOGLE_CLIENTS_PREWARM:
+    from little_helper.views import prewarm_in_background
+    prewarm_in_background()
+
+# Drain rows left in the write-behind queue by a previous run
+if settings.SHEET_WRITE_BEHIND:
+    from little_helper.views import sheet_queue
+    sheet_queue.start()